@@ -8,13 +8,20 @@ A股量化选股系统 - 主程序
     python main.py select    # 执行选股
     python main.py run       # 完整流程（更新+选股+通知）
     python main.py schedule  # 启动定时调度
+    python main.py migrate   # 迁移数据存储格式（CSV -> 列式）
+    python main.py panel     # 构建全市场内存映射面板
+    python main.py manifest  # 重建股票数据清单
+    python main.py backtest  # 基于行情面板回测历史信号
+    python main.py sweep     # 策略参数网格搜索
+    python main.py walkforward  # 滚动前推参数优化
+    python main.py analog    # 历史相似走势检索
 """
 import sys
 import os
 import argparse
 import platform
 from pathlib import Path
-from datetime import datetime, time as dt_time
+from datetime import datetime, time as dt_time, timedelta
 import time
 
 # 添加项目根目录到路径
@@ -25,10 +32,21 @@ sys.path.insert(0, str(project_root))
 __version__ = "1.0.0"
 
 from utils.akshare_fetcher import AKShareFetcher
-from utils.csv_manager import CSVManager
+from utils.csv_manager import get_storage_manager, migrate_storage
 from utils.dingtalk_notifier import DingTalkNotifier
+from utils.market_panel import MarketPanel, load_market_panel
+from utils.market_cap_snapshot import get_market_cap_snapshot, set_default_data_dir
+from utils.parallel_select import is_excluded_name
+from utils.select_pipeline import SelectPipeline
+from strategy.base_strategy import HistoryStrategy
 from strategy.strategy_registry import get_registry
 from utils.kline_chart import generate_kline_chart
+from utils.backtest import DEFAULT_HORIZONS, print_summary, run_backtest
+from utils.pattern_scan import PatternScanner, rank_matches
+from utils.analog_index import DEFAULT_TOP_K, AnalogIndex, summarize_analogs
+from utils.param_sweep import (
+    ParamSweep, default_workers, expand_grid, rank_results, walk_forward_select, walk_forward_windows
+)
 import yaml
 
 
@@ -38,10 +56,24 @@ class QuantSystem:
     def __init__(self, config_file="config/config.yaml"):
         self.config = self._load_config(config_file)
         self.data_dir = self.config.get('data_dir', 'data')
-        self.csv_manager = CSVManager(self.data_dir)
-        self.fetcher = AKShareFetcher(self.data_dir)
+        self.csv_manager = get_storage_manager(self.data_dir)
+        self.fetcher = AKShareFetcher(self.data_dir, **self.config.get('fetch', {}))
         self.notifier = self._init_notifier()
         self.registry = get_registry("config/strategy_params.yaml")
+        # 策略查询市值快照时使用配置的数据目录
+        set_default_data_dir(self.data_dir)
+        # 面板存在时使用全市场批量选股
+        self.use_panel = self.config.get('use_panel', False)
+        # 使用流式指标状态增量选股
+        self.incremental = self.config.get('incremental', False)
+        self.rebuild_state = False
+        # 只读取策略声明的尾部预热窗口（validate_tail 时与全量历史结果逐只比对）
+        self.tail_window = self.config.get('tail_window', True)
+        self.validate_tail = False
+        # 选股进程数（1 为串行）
+        self.select_workers = self.config.get('select_workers', 1)
+        # 分阶段选股：先检查廉价条件，通过后才计算完整指标
+        self.staged = self.config.get('staged', True)
     
     def _load_config(self, config_file):
         """加载配置文件"""
@@ -89,7 +121,201 @@ class QuantSystem:
         print("=" * 60)
         self.fetcher.init_full_data(max_stocks=max_stocks)
         print("\n✓ 数据初始化完成")
+    
+    def migrate_data(self, storage='feather', remove_source=False, order='asc'):
+        """迁移数据存储格式 / 文件内行顺序"""
+        print("=" * 60)
+        print(f"📦 迁移数据存储格式 -> {storage} ({order})")
+        print("=" * 60)
+        migrate_storage(self.data_dir, target=storage, remove_source=remove_source, order=order)
+        # 迁移后重新创建数据管理器
+        self.csv_manager = get_storage_manager(self.data_dir)
+        self.fetcher = AKShareFetcher(self.data_dir, **self.config.get('fetch', {}))
 
+    def rebuild_manifest(self):
+        """按数据目录重建股票清单（清单与数据文件不一致时使用）"""
+        print("=" * 60)
+        print("🗂️ 重建股票数据清单")
+        print("=" * 60)
+        stats = self.csv_manager.rebuild_manifest()
+        print(f"✓ 清单已重建: {len(self.csv_manager.manifest.entries)} 只股票 "
+              f"(未变化 {stats['unchanged']}, 重新扫描 {stats['scanned']}, 删除 {stats['removed']})")
+    
+    def build_panel(self):
+        """构建全市场内存映射面板"""
+        print("=" * 60)
+        print("🧱 构建全市场行情面板")
+        print("=" * 60)
+        MarketPanel(self.data_dir).build(self.csv_manager)
+    
+    def backtest(self, start=None, end=None, max_stocks=None):
+        """基于行情面板回测各策略的历史信号（向量化，不逐日选股）"""
+        print("=" * 60)
+        print("📈 历史信号回测")
+        print("=" * 60)
+        panel = load_market_panel(self.data_dir)
+        if panel is None:
+            print("✗ 未找到行情面板，请先执行 python main.py panel")
+            return {}
+        
+        print("\n加载策略...")
+        self.registry.auto_register_from_directory("strategy")
+        
+        # 名称过滤（退市/ST）按当前名称处理
+        stock_names = self._load_stock_names({})
+        stock_codes = [code for code in panel.codes if not is_excluded_name(stock_names.get(code, '未知'))]
+        if max_stocks:
+            stock_codes = stock_codes[:max_stocks]
+        print(f"面板: {panel.n_dates} 个交易日 × {len(stock_codes)} 只股票，"
+              f"统计区间: {start or panel.dates[0]} ~ {end or panel.dates[-1]}")
+        
+        results = {}
+        for strategy_name, strategy in self.registry.strategies.items():
+            if not isinstance(strategy, HistoryStrategy):
+                print(f"\n⚠️ {strategy_name} 不支持历史信号，跳过")
+                continue
+            started = time.time()
+            result = run_backtest(strategy, panel, stock_codes, DEFAULT_HORIZONS, start, end)
+            print(f"\n✓ {strategy_name}: {result['signals']} 个信号，{result['stocks']} 只股票，"
+                  f"{result['dates']} 个交易日 ({time.time() - started:.1f}s)")
+            print_summary(result['summary'])
+            results[strategy_name] = result
+        return results
+    
+    def _prepare_sweep(self, samples=None, workers=None, max_stocks=None):
+        """参数搜索 / 滚动前推的公共准备：加载策略、面板和参数网格，失败时返回 None"""
+        print("\n加载策略...")
+        self.registry.auto_register_from_directory("strategy")
+        sweep_config = self.registry.params.get('ParamSweep', {})
+        strategy_name = sweep_config.get('strategy', 'BowlReboundStrategy')
+        strategy = self.registry.get_strategy(strategy_name)
+        if strategy is None or not isinstance(strategy, HistoryStrategy):
+            print(f"✗ 策略 {strategy_name} 未注册或不支持历史信号")
+            return None
+        panel = load_market_panel(self.data_dir)
+        if panel is None:
+            print("✗ 未找到行情面板，请先执行 python main.py panel")
+            return None
+        
+        stock_names = self._load_stock_names({})
+        stock_codes = [code for code in panel.codes if not is_excluded_name(stock_names.get(code, '未知'))]
+        if max_stocks:
+            stock_codes = stock_codes[:max_stocks]
+        
+        samples = sweep_config.get('samples', 0) if samples is None else samples
+        param_sets = expand_grid(sweep_config.get('grid', {}), samples=samples, seed=sweep_config.get('seed'))
+        workers = workers or sweep_config.get('workers') or default_workers()
+        print(f"策略: {strategy_name}，{len(param_sets)} 组参数，{len(stock_codes)} 只股票，{workers} 个进程")
+        return {
+            'config': sweep_config,
+            'strategy': strategy,
+            'panel': panel,
+            'stock_codes': stock_codes,
+            'param_sets': param_sets,
+            'workers': workers,
+            'horizon': sweep_config.get('horizon', 5),
+            'metric': sweep_config.get('metric', 'mean_return'),
+        }
+    
+    def _sweep_output_file(self, prefix):
+        output_dir = Path(self.data_dir) / 'backtest'
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return output_dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    
+    def sweep(self, samples=None, start=None, end=None, workers=None, max_stocks=None):
+        """按 strategy_params.yaml 的 ParamSweep 网格搜索策略参数，按历史信号的持有期收益排序"""
+        print("=" * 60)
+        print("🔎 策略参数搜索")
+        print("=" * 60)
+        setup = self._prepare_sweep(samples, workers, max_stocks)
+        if setup is None:
+            return None
+        sweep_config, panel = setup['config'], setup['panel']
+        horizon, metric = setup['horizon'], setup['metric']
+        print(f"统计区间: {start or panel.dates[0]} ~ {end or panel.dates[-1]}，排序: {horizon}日 {metric}")
+        
+        started = time.time()
+        runner = ParamSweep(self.data_dir, setup['strategy'], workers=setup['workers'], stock_codes=setup['stock_codes'],
+                            horizons=DEFAULT_HORIZONS, start=start, end=end)
+        rows = runner.run(setup['param_sets'], on_progress=lambda done, total: print(f"  进度: [{done}/{total}]"))
+        table = rank_results(rows, horizon=horizon, metric=metric, min_signals=sweep_config.get('min_signals', 0))
+        print(f"\n✓ 参数搜索完成 ({time.time() - started:.1f}s)")
+        
+        output_file = self._sweep_output_file('sweep')
+        table.to_csv(output_file, index=False, encoding='utf-8-sig')
+        
+        top_n = sweep_config.get('top_n', 20)
+        columns = list(sweep_config.get('grid', {})) + ['signals'] + \
+            [f"{m}_{horizon}" for m in ('mean_return', 'hit_rate', 'mean_drawdown')]
+        print(f"\n前 {top_n} 组参数（完整结果: {output_file}）:")
+        print(table[columns].head(top_n).to_string(float_format=lambda v: f"{v:.2f}"))
+        return table
+    
+    def walk_forward(self, samples=None, workers=None, max_stocks=None):
+        """滚动前推优化：每个窗口在样本内选参数、在样本外检验，串联各窗口的样本外表现"""
+        print("=" * 60)
+        print("🔁 滚动前推参数优化")
+        print("=" * 60)
+        setup = self._prepare_sweep(samples, workers, max_stocks)
+        if setup is None:
+            return None
+        sweep_config, panel = setup['config'], setup['panel']
+        horizon, metric = setup['horizon'], setup['metric']
+        wf_config = sweep_config.get('walk_forward', {})
+        windows = walk_forward_windows(panel.dates, wf_config.get('in_sample_days', 500),
+                                       wf_config.get('out_of_sample_days', 120), gap=max(DEFAULT_HORIZONS))
+        if not windows:
+            print(f"✗ 面板只有 {panel.n_dates} 个交易日，不足一个窗口")
+            return None
+        print(f"{len(windows)} 个窗口（样本内 {wf_config.get('in_sample_days', 500)} 天，"
+              f"样本外 {wf_config.get('out_of_sample_days', 120)} 天），选择依据: 样本内 {horizon}日 {metric}")
+        
+        # 每组参数的信号只算一次，在全部区间上切分评估
+        started = time.time()
+        ranges = [r for window in windows for r in (window['in_sample'], window['out_of_sample'])]
+        runner = ParamSweep(self.data_dir, setup['strategy'], workers=setup['workers'],
+                            stock_codes=setup['stock_codes'], horizons=DEFAULT_HORIZONS)
+        rows = runner.run(setup['param_sets'], windows=ranges,
+                          on_progress=lambda done, total: print(f"  进度: [{done}/{total}]"))
+        table, combined = walk_forward_select(rows, windows, horizon=horizon, metric=metric,
+                                              min_signals=sweep_config.get('min_signals', 0))
+        print(f"\n✓ 滚动前推完成 ({time.time() - started:.1f}s)")
+        if table.empty:
+            print("✗ 没有窗口产生有效信号")
+            return table
+        
+        output_file = self._sweep_output_file('walk_forward')
+        table.to_csv(output_file, index=False, encoding='utf-8-sig')
+        
+        print(f"\n各窗口最优参数及样本外表现（完整结果: {output_file}）:")
+        for record in table.to_dict('records'):
+            print(f"  样本外 {record['out_of_sample']}: {record['params']}")
+            print(f"    样本内 {metric}_{horizon}={record[f'is_{metric}_{horizon}']:.2f}，"
+                  f"样本外 信号 {record['oos_signals']}，{horizon}日平均收益 {record[f'oos_mean_return_{horizon}']:.2f}%，"
+                  f"胜率 {record[f'oos_hit_rate_{horizon}']:.1f}%")
+        print("\n样本外串联汇总:")
+        for n in DEFAULT_HORIZONS:
+            if f"signals_{n}" in combined:
+                print(f"  {n:>2}日: 信号 {combined[f'signals_{n}']}，平均收益 {combined[f'mean_return_{n}']:.2f}%，"
+                      f"胜率 {combined[f'hit_rate_{n}']:.1f}%，平均回撤 {combined[f'mean_drawdown_{n}']:.2f}%")
+        return table, combined
+    
+    def _refresh_panel(self):
+        """数据更新后原地刷新面板（未构建过面板则跳过）"""
+        panel = MarketPanel(self.data_dir)
+        if not panel.exists():
+            return
+        print("\n🧱 刷新全市场行情面板...")
+        panel.update(self.csv_manager)
+    
+    def _refresh_market_cap_snapshot(self):
+        """数据更新后批量刷新全市场市值快照（选股时只读本地快照）"""
+        snapshot = get_market_cap_snapshot(self.data_dir)
+        if snapshot.is_fresh():
+            return
+        print("\n💰 刷新全市场市值快照...")
+        snapshot.refresh(self.fetcher, self.csv_manager.list_all_stocks())
+    
     def _smart_update(self, max_stocks=None, check_latest=True):
         """智能更新：3点前不更新，检查每只股票是否有当天数据"""
         from datetime import datetime
@@ -115,13 +341,12 @@ class QuantSystem:
             total = len(stock_codes)
             has_today = 0
             no_today = 0
-            check_limit = min(100, total)  # 抽样检查100只
+            check_limit = total  # 查股票清单，不打开数据文件，全部检查
 
             for code in stock_codes[:check_limit]:
-                df = self.csv_manager.read_stock(code)
-                if not df.empty:
-                    latest_date = pd.to_datetime(df.iloc[0]['date']).date()
-                    if latest_date == today:
+                latest = self.csv_manager.get_latest(code)
+                if latest is not None:
+                    if latest[0] == today:
                         has_today += 1
                     else:
                         no_today += 1
@@ -137,6 +362,8 @@ class QuantSystem:
         # 执行更新
         print("\n🔄 执行数据更新...")
         self.fetcher.daily_update(max_stocks=max_stocks)
+        self._refresh_panel()
+        self._refresh_market_cap_snapshot()
         print("\n✓ 数据更新完成")
 
     def update_data(self, max_stocks=None):
@@ -145,6 +372,8 @@ class QuantSystem:
         print("🔄 每日增量更新")
         print("=" * 60)
         self.fetcher.daily_update(max_stocks=max_stocks)
+        self._refresh_panel()
+        self._refresh_market_cap_snapshot()
         print("\n✓ 数据更新完成")
 
     def select_stocks(self, category='all', max_stocks=None, return_data=False):
@@ -202,72 +431,24 @@ class QuantSystem:
         # 先获取股票名称
         stock_names = self._load_stock_names({})
         
-        # 流式选股处理
-        import gc
-        results = {}
-        indicators_dict = {}  # 只保存入选股票的数据
-        category_count = {'bowl_center': 0, 'near_duokong': 0, 'near_short_trend': 0}
-        
         # 限制处理数量
         process_codes = stock_codes[:max_stocks] if max_stocks else stock_codes
         
-        for strategy_name, strategy in self.registry.strategies.items():
-            print(f"\n执行策略: {strategy_name}")
-            signals = []
-            valid_count = 0
-            invalid_count = 0
-            
-            for i, code in enumerate(process_codes, 1):
-                # 读取单只股票
-                df = self.csv_manager.read_stock(code)
-                name = stock_names.get(code, '未知')
-                
-                # 过滤
-                invalid_keywords = ['退', '未知', '退市', '已退']
-                if any(kw in name for kw in invalid_keywords):
-                    invalid_count += 1
-                    continue
-                
-                # 过滤 ST/*ST 股票
-                if name.startswith('ST') or name.startswith('*ST'):
-                    invalid_count += 1
-                    continue
-                if df.empty or len(df) < 60:
-                    continue
-                
-                valid_count += 1
-                
-                # 计算指标
-                df_with_indicators = strategy.calculate_indicators(df)
-                
-                # 选股
-                signal_list = strategy.select_stocks(df_with_indicators, name)
-                
-                if signal_list:
-                    for s in signal_list:
-                        cat = s.get('category', 'unknown')
-                        category_count[cat] = category_count.get(cat, 0) + 1
-                        
-                        if category == 'all' or cat == category:
-                            signals.append({
-                                'code': code,
-                                'name': name,
-                                'signals': [s]
-                            })
-                            # 只保存入选股票的数据
-                            if return_data:
-                                indicators_dict[code] = df_with_indicators
-                
-                # 释放内存
-                del df, df_with_indicators
-                
-                # 每100只显示进度并GC
-                if i % 100 == 0 or i == len(process_codes):
-                    gc.collect()
-                    print(f"  进度: [{i}/{len(process_codes)}] 有效 {valid_count} 只，选出 {len(signals)} 只...")
-            
-            results[strategy_name] = signals
-            print(f"  ✓ 选股完成: 共 {len(signals)} 只 (过滤 {invalid_count} 只)")
+        # 全市场面板（批量选股）
+        panel = None
+        if self.use_panel:
+            panel = load_market_panel(self.data_dir)
+            if panel is None:
+                print("⚠️ 未找到行情面板，回退为逐只选股（可先执行 python main.py panel）")
+        
+        pipeline = SelectPipeline(
+            self.csv_manager, self.registry.strategies, self.data_dir,
+            tail_window=self.tail_window, validate=self.validate_tail, staged=self.staged,
+            workers=self.select_workers, incremental=self.incremental, rebuild_state=self.rebuild_state
+        )
+        results, category_count, indicators_dict = pipeline.run(
+            process_codes, stock_names, panel=panel, category=category, return_data=return_data
+        )
         
         # 显示结果汇总
         print("\n" + "=" * 60)
@@ -401,10 +582,11 @@ class QuantSystem:
         print("\n[3/3] 执行B1完美图形匹配...")
         matched_results = []
         
+        # 收集全部候选，与案例库一次性批量计算相似度
+        candidates = []
         for strategy_name, signals in results.items():
             for signal in signals:
                 code = signal['code']
-                name = signal.get('name', stock_names.get(code, '未知'))
                 
                 # 获取该股票的完整数据
                 if code not in stock_data_dict:
@@ -414,38 +596,42 @@ class QuantSystem:
                 if df.empty:
                     continue
                 
-                try:
-                    # 匹配最佳案例（使用指定回看天数）
-                    match_result = library.find_best_match(code, df, lookback_days=lookback_days)
+                candidates.append((strategy_name, signal, df))
+        
+        # 匹配最佳案例（使用指定回看天数）；特征提取失败的股票在 find_best_matches 中逐只跳过，无匹配结果
+        match_results = library.find_best_matches(
+            [(signal['code'], df) for _, signal, df in candidates],
+            lookback_days=lookback_days
+        )
+        
+        for (strategy_name, signal, df), match_result in zip(candidates, match_results):
+            code = signal['code']
+            name = signal.get('name', stock_names.get(code, '未知'))
+            
+            if match_result.get('best_match'):
+                best = match_result['best_match']
+                score = best.get('similarity_score', 0)
+                
+                # 只保留超过阈值的股票
+                if score >= min_similarity:
+                    # 获取第一个信号的信息
+                    s = signal['signals'][0] if signal.get('signals') else {}
                     
-                    if match_result.get('best_match'):
-                        best = match_result['best_match']
-                        score = best.get('similarity_score', 0)
-                        
-                        # 只保留超过阈值的股票
-                        if score >= min_similarity:
-                            # 获取第一个信号的信息
-                            s = signal['signals'][0] if signal.get('signals') else {}
-                            
-                            matched_results.append({
-                                'stock_code': code,
-                                'stock_name': name,
-                                'strategy': strategy_name,
-                                'category': s.get('category', 'unknown'),
-                                'close': s.get('close', '-'),
-                                'J': s.get('J', '-'),
-                                'similarity_score': score,
-                                'matched_case': best.get('case_name', ''),
-                                'matched_date': best.get('case_date', ''),
-                                'matched_code': best.get('case_code', ''),
-                                'breakdown': best.get('breakdown', {}),
-                                'tags': best.get('tags', []),
-                                'all_matches': best.get('all_matches', []),
-                            })
-                            
-                except Exception as e:
-                    print(f"  ⚠️ 匹配 {code} 失败: {e}")
-                    continue
+                    matched_results.append({
+                        'stock_code': code,
+                        'stock_name': name,
+                        'strategy': strategy_name,
+                        'category': s.get('category', 'unknown'),
+                        'close': s.get('close', '-'),
+                        'J': s.get('J', '-'),
+                        'similarity_score': score,
+                        'matched_case': best.get('case_name', ''),
+                        'matched_date': best.get('case_date', ''),
+                        'matched_code': best.get('case_code', ''),
+                        'breakdown': best.get('breakdown', {}),
+                        'tags': best.get('tags', []),
+                        'all_matches': best.get('all_matches', []),
+                    })
         
         # 按相似度排序
         matched_results.sort(key=lambda x: x['similarity_score'], reverse=True)
@@ -518,6 +704,127 @@ class QuantSystem:
         
         return match_result
     
+    def scan_b1(self, min_similarity=None, lookback_days=None, workers=None, max_stocks=None):
+        """
+        全市场B1相似度扫描：不经过选股策略，对全部股票最新的回看窗口与B1案例库批量匹配并排序
+        
+        Args:
+            min_similarity: 最小相似度阈值（只影响打印，CSV保存全部股票）
+            lookback_days: 回看天数
+            workers: 特征提取进程数，默认CPU核数
+            max_stocks: 限制处理的股票数量
+        """
+        from strategy.pattern_config import MIN_SIMILARITY_SCORE, DEFAULT_LOOKBACK_DAYS, TOP_N_RESULTS
+        from strategy.pattern_library import B1PatternLibrary
+        if min_similarity is None:
+            min_similarity = MIN_SIMILARITY_SCORE
+        if lookback_days is None:
+            lookback_days = DEFAULT_LOOKBACK_DAYS
+        workers = workers or os.cpu_count() or 1
+        
+        print("=" * 60)
+        print("🌐 全市场B1完美图形扫描")
+        print(f"   相似度阈值: {min_similarity}%，回看天数: {lookback_days}天，{workers} 个进程")
+        print("=" * 60)
+        
+        library = B1PatternLibrary(self.csv_manager)
+        if not library.cases:
+            print("⚠️ 警告: 案例库为空，可能数据不足")
+            return None
+        
+        stock_codes = self.csv_manager.list_all_stocks()
+        if max_stocks:
+            stock_codes = stock_codes[:max_stocks]
+        stock_names = self._load_stock_names({})
+        stock_codes, removed = prescreen(stock_codes, stock_names, self.csv_manager.manifest, min_bars=lookback_days)
+        print(f"共 {len(stock_codes)} 只股票（预筛选剔除 {sum(removed.values())} 只）")
+        
+        started = time.time()
+        items = PatternScanner(self.data_dir, workers).extract(
+            stock_codes, lookback_days,
+            on_progress=lambda done, total: print(f"  特征提取: [{done}/{total}]")
+        )
+        extracted = time.time()
+        table = rank_matches(items, library.match_features([features for _, _, features in items]), stock_names)
+        print(f"\n✓ 扫描完成: {len(table)} 只股票，特征提取 {extracted - started:.1f}s，"
+              f"相似度计算 {time.time() - extracted:.1f}s")
+        
+        output_dir = Path(self.data_dir) / 'b1_scan'
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_file = output_dir / f"b1_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        table.to_csv(output_file, index=False, encoding='utf-8-sig')
+        
+        passed = table[table['similarity_score'] >= min_similarity]
+        print(f"\n{len(passed)} 只股票相似度 >= {min_similarity}%，Top {TOP_N_RESULTS}（完整结果: {output_file}）:")
+        for i, r in enumerate(passed.head(TOP_N_RESULTS).itertuples(index=False), 1):
+            print(f"{i:>3}. {r.stock_code} {r.stock_name} 相似度: {r.similarity_score}% | "
+                  f"匹配: {r.matched_case}({r.matched_date}) | 趋势:{r.trend_structure}% KDJ:{r.kdj_state}% "
+                  f"量能:{r.volume_pattern}% 形态:{r.price_shape}%")
+        return table
+    
+    def search_analogs(self, stock_code=None, end=None, top_k=None, lookback_days=None, max_stocks=None):
+        """
+        历史相似走势检索：在全市场全部历史窗口中查找与查询窗口最相似的走势及其后续收益
+        
+        Args:
+            stock_code: 查询股票，None 时依次查询B1案例库中每个案例突破前的窗口
+            end: 查询窗口的截止日期 YYYY-MM-DD（含），默认最新
+            top_k: 每个查询返回的相似窗口数
+            lookback_days: 窗口长度（K线数）
+            max_stocks: 限制参与索引的股票数量
+        """
+        from strategy.pattern_config import B1_PERFECT_CASES, DEFAULT_LOOKBACK_DAYS
+        window = lookback_days or DEFAULT_LOOKBACK_DAYS
+        top_k = top_k or DEFAULT_TOP_K
+        
+        print("=" * 60)
+        print("🔭 历史相似走势检索")
+        print(f"   窗口长度: {window}天，每个查询返回 Top {top_k}")
+        print("=" * 60)
+        panel = load_market_panel(self.data_dir)
+        if panel is None:
+            print("✗ 未找到行情面板，请先执行 python main.py panel")
+            return {}
+        
+        stock_codes = panel.codes[:max_stocks] if max_stocks else None
+        started = time.time()
+        # 索引缓存在面板未变化时直接按内存映射加载
+        output_dir = Path(self.data_dir) / 'analog'
+        index = AnalogIndex(panel, stock_codes, window=window, cache_dir=output_dir / 'index')
+        print(f"✓ 索引{'加载' if index.cached else '完成'}: {len(index.codes)} 只股票，{index.size} 个窗口 "
+              f"({time.time() - started:.1f}s)")
+        
+        if stock_code:
+            queries = [(stock_code, stock_code, end)]
+        else:
+            # 案例窗口不包含突破当天（与案例库特征提取一致）
+            queries = [(f"{case['name']}({case['code']})", case['code'],
+                        (datetime.strptime(case['breakout_date'], '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d'))
+                       for case in B1_PERFECT_CASES]
+        
+        output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        results = {}
+        for label, code, end_date in queries:
+            started = time.time()
+            table = index.query_stock(code, end_date=end_date, k=top_k)
+            if table is None:
+                print(f"\n⚠️ {label}: 不在面板中或K线不足 {window} 根，跳过")
+                continue
+            print(f"\n📌 {label} 截止 {end_date or '最新'} 的相似走势 ({(time.time() - started) * 1000:.0f}ms):")
+            for i, r in enumerate(table.itertuples(index=False), 1):
+                returns = ' '.join(f"{n}日:{getattr(r, f'return_{n}d'):+.2f}%" for n in index.horizons)
+                print(f"{i:>3}. {r.stock_code} 截止 {r.end_date} 距离: {r.distance:.3f} | {returns}")
+            summary = summarize_analogs(table, index.horizons)
+            print("    后续收益: " + ' | '.join(
+                f"{row.horizon}日 平均{row.mean_return:+.2f}% 胜率{row.hit_rate:.0f}%"
+                for row in summary.itertuples(index=False)
+            ))
+            table.to_csv(output_dir / f"analog_{code}_{timestamp}.csv", index=False, encoding='utf-8-sig')
+            results[code] = table
+        print(f"\n完整结果: {output_dir}")
+        return results
+    
     def run_schedule(self):
         """启动定时调度"""
         try:
@@ -568,6 +875,20 @@ def main():
   python main.py run --b1-match --min-similarity 70  # 匹配+提高相似度阈值到70%
   python main.py run --b1-match --lookback-days 30   # 使用30天回看期
   python main.py web                           # 启动Web界面
+  python main.py migrate --storage feather     # 将CSV数据迁移为列式存储（读取更快）
+  python main.py panel                         # 构建全市场内存映射面板（日期×股票×字段）
+  python main.py manifest                      # 重建股票数据清单（手工增删数据文件后使用）
+  python main.py run --use-panel               # 基于行情面板一次性计算全市场指标并选股
+  python main.py backtest --start 2022-01-01   # 基于行情面板回测历史信号（1/3/5/10日收益、胜率、回撤）
+  python main.py sweep --samples 200           # 按 ParamSweep 网格随机抽取200组参数回测并排序
+  python main.py walkforward                   # 滚动前推：样本内选参数、样本外检验并串联
+  python main.py scan --workers 8              # 全市场B1相似度扫描（不经过选股策略）
+  python main.py analog --code 600519 --end 2024-03-01  # 全市场历史窗口中检索相似走势及后续收益
+  python main.py analog                        # 检索每个B1案例突破前走势的历史相似窗口
+  python main.py run --incremental             # 流式指标状态选股，每日只递推新增K线
+  python main.py run --validate-tail           # 校验尾部窗口选股结果与全量历史一致
+  python main.py run --workers 8               # 8个进程并行选股
+  python main.py run --no-staged               # 关闭分阶段选股（每只股票计算完整指标）
   python main.py --version                     # 显示版本信息
 
 分类说明:
@@ -591,9 +912,9 @@ B1完美图形匹配:
 
     parser.add_argument(
         'command',
-        choices=['init', 'run', 'web'],
+        choices=['init', 'run', 'web', 'migrate', 'panel', 'manifest', 'backtest', 'sweep', 'walkforward', 'scan', 'analog'],
         nargs='?',
-        help='要执行的命令: init(初始化数据), run(执行选股), web(启动Web服务器)'
+        help='要执行的命令: init(初始化数据), run(执行选股), web(启动Web服务器), migrate(迁移存储格式), panel(构建行情面板), manifest(重建股票清单), backtest(历史信号回测), sweep(参数搜索), walkforward(滚动前推优化), scan(全市场B1相似度扫描), analog(历史相似走势检索)'
     )
 
     parser.add_argument(
@@ -630,6 +951,101 @@ B1完美图形匹配:
         help='筛选股票分类: all(全部), bowl_center(回落碗中), near_duokong(靠近多空线), near_short_trend(靠近短期趋势线)'
     )
     
+    parser.add_argument(
+        '--storage',
+        choices=['csv', 'feather'],
+        default='feather',
+        help='migrate命令的目标存储格式 (默认: feather)'
+    )
+    
+    parser.add_argument(
+        '--order',
+        choices=['asc', 'desc'],
+        default='asc',
+        help='migrate命令的文件内行顺序: asc(时间正序，每日更新只追加) desc(旧的倒序) (默认: asc)'
+    )
+    
+    parser.add_argument(
+        '--use-panel',
+        action='store_true',
+        help='使用全市场行情面板批量选股（需先执行 panel 命令）'
+    )
+    
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='使用持久化的流式指标状态选股，每日只递推新增K线'
+    )
+    
+    parser.add_argument(
+        '--rebuild-state',
+        action='store_true',
+        help='丢弃流式指标状态并从全量数据重建（前复权改写历史后使用，隐含 --incremental）'
+    )
+    
+    parser.add_argument(
+        '--full-history',
+        action='store_true',
+        help='逐只选股时读取全部历史（默认只读取策略声明的尾部预热窗口）'
+    )
+    
+    parser.add_argument(
+        '--validate-tail',
+        action='store_true',
+        help='校验模式：逐只比对尾部窗口与全量历史的选股结果，不一致时报错'
+    )
+    
+    parser.add_argument(
+        '--no-staged',
+        action='store_true',
+        help='逐只选股时对每只股票计算完整指标（默认先检查廉价条件，淘汰的股票不再计算）'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='选股进程数（默认读取配置 select_workers，1 为串行）；sweep命令的进程数（默认读取 ParamSweep.workers）；scan命令的进程数（默认CPU核数）'
+    )
+    
+    parser.add_argument(
+        '--start',
+        default=None,
+        help='backtest命令的统计起始日期 YYYY-MM-DD（默认面板第一天）'
+    )
+    
+    parser.add_argument(
+        '--end',
+        default=None,
+        help='backtest命令的统计截止日期 YYYY-MM-DD（默认面板最后一天）；analog命令的查询窗口截止日期（默认最新）'
+    )
+    
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=None,
+        help='sweep/walkforward命令从参数网格中随机抽取的组数（默认读取 ParamSweep.samples，0 为全部组合）'
+    )
+    
+    parser.add_argument(
+        '--code',
+        default=None,
+        help='analog命令的查询股票代码（默认依次查询B1案例突破前的窗口）'
+    )
+    
+    parser.add_argument(
+        '--top-k',
+        type=int,
+        default=None,
+        help=f'analog命令每个查询返回的相似窗口数 (默认: {DEFAULT_TOP_K})'
+    )
+    
+    parser.add_argument(
+        '--remove-source',
+        action='store_true',
+        help='migrate全部成功并切换格式后删除源格式文件'
+    )
+    
     # 从配置读取B1PatternMatch默认值
     try:
         from strategy.pattern_config import MIN_SIMILARITY_SCORE, DEFAULT_LOOKBACK_DAYS
@@ -656,7 +1072,7 @@ B1完美图形匹配:
         '--lookback-days',
         type=int,
         default=None,
-        help=f'B1完美图形匹配的回看天数 (默认: {default_lookback_days})'
+        help=f'B1完美图形匹配的回看天数，analog命令的窗口长度 (默认: {default_lookback_days})'
     )
 
     args = parser.parse_args()
@@ -676,6 +1092,20 @@ B1完美图形匹配:
     
     # 创建系统实例
     quant = QuantSystem(args.config)
+    if args.use_panel:
+        quant.use_panel = True
+    if args.full_history:
+        quant.tail_window = False
+    if args.validate_tail:
+        quant.tail_window = True
+        quant.validate_tail = True
+    if args.workers is not None:
+        quant.select_workers = args.workers
+    if args.no_staged:
+        quant.staged = False
+    if args.incremental or args.rebuild_state:
+        quant.incremental = True
+        quant.rebuild_state = args.rebuild_state
     
     # 执行命令
     if args.command == 'init':
@@ -698,6 +1128,33 @@ B1完美图形匹配:
             # 原有选股流程（不带B1匹配）
             quant.run_full(category=args.category, max_stocks=args.max_stocks)
     
+    elif args.command == 'migrate':
+        quant.migrate_data(storage=args.storage, remove_source=args.remove_source, order=args.order)
+    
+    elif args.command == 'panel':
+        quant.build_panel()
+    
+    elif args.command == 'manifest':
+        quant.rebuild_manifest()
+    
+    elif args.command == 'backtest':
+        quant.backtest(start=args.start, end=args.end, max_stocks=args.max_stocks)
+    
+    elif args.command == 'sweep':
+        quant.sweep(samples=args.samples, start=args.start, end=args.end,
+                    workers=args.workers, max_stocks=args.max_stocks)
+    
+    elif args.command == 'walkforward':
+        quant.walk_forward(samples=args.samples, workers=args.workers, max_stocks=args.max_stocks)
+    
+    elif args.command == 'scan':
+        quant.scan_b1(min_similarity=args.min_similarity, lookback_days=args.lookback_days,
+                      workers=args.workers, max_stocks=args.max_stocks)
+    
+    elif args.command == 'analog':
+        quant.search_analogs(stock_code=args.code, end=args.end, top_k=args.top_k,
+                             lookback_days=args.lookback_days, max_stocks=args.max_stocks)
+    
     elif args.command == 'web':
         # 启动Web服务器
         from web_server import run_web_server
@@ -5,8 +5,21 @@ from abc import ABC, abstractmethod
 import pandas as pd
 
 
+# 名称中包含这些关键字的股票（退市/未知）不参与选股，选股流程的预筛选和策略共用
+INVALID_NAME_KEYWORDS = ['退', '未知', '退市', '已退']
+
+
 class BaseStrategy(ABC):
-    """策略抽象基类"""
+    """
+    策略抽象基类
+    
+    可选能力通过同时继承下方的能力混入类声明（PanelStrategy / StateStrategy / HistoryStrategy /
+    StagedStrategy / CachedIndicatorStrategy），调用方用 isinstance 判断；
+    混入类的方法都是抽象方法，声明了能力却未实现时策略无法实例化
+    """
+    
+    # 选股所需的最少K线数（预热窗口），None 表示需要全部历史
+    warmup_bars = None
     
     def __init__(self, name, params=None):
         """
@@ -36,6 +49,14 @@ class BaseStrategy(ABC):
         """
         pass
     
+    def prefilter(self, meta) -> bool:
+        """
+        读取数据前的预筛选（可选实现），只能使用股票清单中的元信息
+        :param meta: 清单记录（rows / first_date / last_date / last_close / last_volume / last_market_cap）
+        :return: False 表示该股票一定不会入选，不再读取数据
+        """
+        return True
+    
     def analyze_stock(self, stock_code, stock_name, df):
         """
         分析单只股票
@@ -57,3 +78,80 @@ class BaseStrategy(ABC):
                 'signals': signals
             }
         return None
+
+
+# ========== 可选能力（混入类） ==========
+
+class CachedIndicatorStrategy(ABC):
+    """calculate_indicators 接受 cache 参数（IndicatorCache，多个策略共用同一只股票的指标）"""
+    
+    @abstractmethod
+    def calculate_indicators(self, df, cache=None) -> pd.DataFrame:
+        """
+        :param cache: 同一份数据上的 IndicatorCache，None 时单独计算
+        """
+
+
+class StagedStrategy(ABC):
+    """分阶段选股：先检查廉价条件，通过后才计算全部指标"""
+    
+    @abstractmethod
+    def select_stocks_staged(self, df, stock_name='', cache=None):
+        """
+        结果必须与 calculate_indicators + select_stocks 一致
+        :param cache: 同一份数据上的 IndicatorCache，None 时单独计算
+        :return: (淘汰阶段名，入选时为None; 选股信号列表; 完整指标数据，提前淘汰时为None)
+        """
+
+
+class PanelStrategy(ABC):
+    """基于全市场面板的批量选股"""
+    
+    @abstractmethod
+    def select_stocks_panel(self, panel, stock_codes=None) -> dict:
+        """
+        :param panel: 已加载的 MarketPanel
+        :param stock_codes: 参与选股的股票列表，None 表示面板中全部股票
+        :return: {股票代码: 选股信号列表}
+        """
+
+
+class StateStrategy(ABC):
+    """基于流式指标状态的增量选股"""
+    
+    @abstractmethod
+    def create_state_store(self, data_dir="data"):
+        """创建与当前参数匹配的流式指标状态存储"""
+    
+    @abstractmethod
+    def select_from_state(self, state, stock_code=None) -> list:
+        """
+        :param state: 已同步到最新K线的指标状态
+        :param stock_code: 股票代码（市值等需要按代码查询的数据）
+        :return: 选股信号列表
+        """
+
+
+class HistoryStrategy(ABC):
+    """向量化的历史信号（用于回测和参数搜索）"""
+    
+    # 历史信号的分类名称，history_signals 返回的分类编号是它的下标
+    history_categories = ()
+    
+    # history_indicators 依赖的参数名，其余参数不同的参数组可共用同一份指标（None 表示依赖全部参数）
+    history_indicator_params = None
+    
+    @abstractmethod
+    def history_indicators(self, raw, codes):
+        """
+        计算全市场每个交易日的指标
+        :param raw: {字段: (时间正序 × 股票) 数组}
+        :param codes: 与列对应的股票代码
+        """
+    
+    @abstractmethod
+    def history_signals(self, data):
+        """
+        基于 history_indicators 的结果计算每个交易日的选股信号
+        :return: (信号布尔数组, 分类编号数组)
+        """
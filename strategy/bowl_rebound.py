@@ -30,21 +30,51 @@
 
 9. 选股信号 = 异动 AND 趋势线在上 AND J值低位 AND (回落碗中 OR 靠近多空线 OR 靠近短期趋势线)
 """
+import numpy as np
 import pandas as pd
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from strategy.base_strategy import BaseStrategy
+from strategy.base_strategy import (
+    BaseStrategy, CachedIndicatorStrategy, HistoryStrategy,
+    PanelStrategy, StagedStrategy, StateStrategy, INVALID_NAME_KEYWORDS
+)
 from utils.technical import (
     MA, EMA, LLV, HHV, REF, EXIST,
     KDJ, calculate_zhixing_trend
 )
+from utils import technical_panel as tp
+from utils.indicator_cache import IndicatorCache
+from utils.indicator_state import IndicatorStateStore
+from utils.market_cap_snapshot import get_market_cap_snapshot
+
+
+# 以元为单位的总市值合理范围（10亿到1000亿），范围外或缺失的市值改查市值快照
+CAP_UNIT_RANGE = (1e9, 1e11)
+
+# EMA/KDJ 递推的收敛余量：初值影响按 (9/11)^k 衰减，250根后小于1e-20
+CONVERGENCE_BARS = 250
 
+# 分阶段选股的淘汰阶段（按检查顺序，越靠前越廉价）
+STAGE_LATEST_BAR = '最新K线无成交'
+STAGE_MAX_VOLUME = '最大量为阴线'
+STAGE_TREND = '趋势线不在上'
+STAGE_KDJ = 'J值不在低位'
+STAGE_FULL = '完整条件'
+STAGES = (STAGE_LATEST_BAR, STAGE_MAX_VOLUME, STAGE_TREND, STAGE_KDJ, STAGE_FULL)
 
-class BowlReboundStrategy(BaseStrategy):
+# 历史信号中的分类编号（-1 表示不满足任何位置条件），顺序即优先级
+CATEGORIES = ('bowl_center', 'near_duokong', 'near_short_trend')
+
+
+class BowlReboundStrategy(BaseStrategy, CachedIndicatorStrategy, StagedStrategy,
+                          PanelStrategy, StateStrategy, HistoryStrategy):
     """碗口反弹策略 - 分类标记版"""
     
+    history_categories = CATEGORIES
+    history_indicator_params = ('M1', 'M2', 'M3', 'M4')
+    
     def __init__(self, params=None):
         # 默认参数
         default_params = {
@@ -66,16 +96,26 @@ class BowlReboundStrategy(BaseStrategy):
         
         super().__init__("碗口反弹策略", default_params)
     
-    def calculate_indicators(self, df) -> pd.DataFrame:
+    @property
+    def warmup_bars(self):
+        """
+        选股所需的尾部K线数：
+        最长均线周期 + 回溯窗口（M天关键K线 / 30天J值） + EMA/KDJ 收敛余量
+        """
+        longest_ma = max(self.params['M1'], self.params['M2'], self.params['M3'], self.params['M4'])
+        return longest_ma + max(self.params['M'], 30) + CONVERGENCE_BARS
+    
+    def calculate_indicators(self, df, cache=None) -> pd.DataFrame:
         """
         计算碗口反弹策略所需的所有指标
+        :param cache: 同一份数据上的 IndicatorCache（多策略共用趋势线、KDJ等），None 时单独计算
         """
+        if cache is None:
+            cache = IndicatorCache(df)
         result = df.copy()
         
         # 1. 知行趋势线（使用technical模块，正确处理倒序数据）
-        from utils.technical import calculate_zhixing_trend
-        trend_df = calculate_zhixing_trend(
-            result, 
+        trend_df = cache.zhixing_trend(
             m1=self.params['M1'],
             m2=self.params['M2'],
             m3=self.params['M3'],
@@ -84,113 +124,88 @@ class BowlReboundStrategy(BaseStrategy):
         result['short_term_trend'] = trend_df['short_term_trend']
         result['bull_bear_line'] = trend_df['bull_bear_line']
         
-        # 2. 上升趋势
-        result['trend_above'] = result['short_term_trend'] > result['bull_bear_line']
-        
-        # 3. 分类条件计算
-        # 回落碗中：价格位于多空线和短期趋势线之间（优先级最高）
-        result['fall_in_bowl'] = (
-            (result['close'] >= result['bull_bear_line']) & 
-            (result['close'] <= result['short_term_trend'])
-        )
-        
-        # 靠近多空线：价格距离多空线 ±duokong_pct% 范围内
-        duokong_pct = self.params['duokong_pct'] / 100
-        result['near_duokong'] = (
-            (result['close'] >= result['bull_bear_line'] * (1 - duokong_pct)) & 
-            (result['close'] <= result['bull_bear_line'] * (1 + duokong_pct))
-        )
-        
-        # 靠近短期趋势线：价格距离短期趋势线 ±short_pct% 范围内
-        short_pct = self.params['short_pct'] / 100
-        result['near_short_trend'] = (
-            (result['close'] >= result['short_term_trend'] * (1 - short_pct)) & 
-            (result['close'] <= result['short_term_trend'] * (1 + short_pct))
-        )
-        
-        # 4. KDJ指标
-        from utils.technical import KDJ
-        kdj_df = KDJ(result, n=9, m1=3, m2=3)
+        # 2. KDJ指标
+        kdj_df = cache.kdj(n=9, m1=3, m2=3)
         result['K'] = kdj_df['K']
         result['D'] = kdj_df['D']
         result['J'] = kdj_df['J']
         
-        # 5. 放量阳线条件
-        # 成交量 >= 前一日 * N
-        from utils.technical import REF
-        result['vol_ratio'] = result['volume'] / REF(result['volume'], 1)
-        result['vol_surge'] = result['vol_ratio'] >= self.params['N']
-        
-        # 阳线：收盘价 > 开盘价
-        result['positive_candle'] = result['close'] > result['open']
+        # 3. 趋势线在上 AND J值低位 AND 位置分类（CATEGORIES 下标，-1 为不满足）
+        result['category_id'] = self._classify(
+            result['close'].to_numpy(dtype=float),
+            result['short_term_trend'].to_numpy(dtype=float),
+            result['bull_bear_line'].to_numpy(dtype=float),
+            result['J'].to_numpy(dtype=float)
+        )
         
-        # 总市值达标（优先从实时数据获取）
+        # 4. 关键K线 = 放量 AND 阳线 AND 总市值达标
+        result['vol_ratio'] = result['volume'] / cache.ref('volume', 1)
         result['market_cap_ok'] = self._check_market_cap_realtime(result)
-        
-        # 关键K线 = 放量 AND 阳线 AND 市值达标
-        result['key_candle'] = (
-            result['vol_surge'] & 
-            result['positive_candle'] & 
-            result['market_cap_ok']
+        result['key_candle'] = self._key_candle(
+            result['vol_ratio'].to_numpy(dtype=float),
+            result['open'].to_numpy(dtype=float),
+            result['close'].to_numpy(dtype=float),
+            result['market_cap_ok'].to_numpy()
         )
         
-        # 6. 异动 = EXIST(关键K线, M)
-        from utils.technical import EXIST
+        # 5. 异动 = EXIST(关键K线, M)
         result['abnormal'] = EXIST(result['key_candle'], self.params['M'])
         
-        # 7. J值低位
-        result['j_low'] = result['J'] <= self.params['J_VAL']
-        
         return result
     
+    # ========== 选股规则（各选股入口共用，逐元素计算） ==========
+    
+    def _classify(self, close, short_term_trend, bull_bear_line, j):
+        """
+        趋势线在上、J值低位和位置分类，按优先级：回落碗中 > 靠近多空线 > 靠近短期趋势线
+        参数为标量或形状相同的数组
+        :return: 分类编号（CATEGORIES 下标），不满足趋势、J值或任何位置条件时为 -1
+        """
+        close, stt, bbl, j = (np.asarray(values, dtype=float) for values in (close, short_term_trend, bull_bear_line, j))
+        duokong_pct = self.params['duokong_pct'] / 100
+        short_pct = self.params['short_pct'] / 100
+        with np.errstate(invalid='ignore'):
+            positions = [
+                # 回落碗中：价格位于多空线和短期趋势线之间
+                (close >= bbl) & (close <= stt),
+                # 靠近多空线：价格距离多空线 ±duokong_pct% 范围内
+                (close >= bbl * (1 - duokong_pct)) & (close <= bbl * (1 + duokong_pct)),
+                # 靠近短期趋势线：价格距离短期趋势线 ±short_pct% 范围内
+                (close >= stt * (1 - short_pct)) & (close <= stt * (1 + short_pct)),
+            ]
+            valid = (stt > bbl) & (j <= self.params['J_VAL'])
+        category = np.select(positions, np.arange(len(CATEGORIES)), default=-1)
+        return np.where(valid, category, -1).astype(np.int8)
+    
+    def _reasons(self, category_id):
+        """分类编号对应的标记说明"""
+        return [(
+            '回落碗中',
+            f'靠近多空线(±{self.params["duokong_pct"]}%)',
+            f'靠近短期趋势线(±{self.params["short_pct"]}%)',
+        )[category_id]]
+    
+    def _key_candle(self, vol_ratio, open_, close, market_cap_ok):
+        """关键K线 = 成交量 >= 前一日 * N AND 阳线 AND 总市值达标（逐元素）"""
+        with np.errstate(invalid='ignore'):
+            return (vol_ratio >= self.params['N']) & (close > open_) & market_cap_ok
+    
     def _check_market_cap_realtime(self, df) -> pd.Series:
         """
         检查总市值是否达标
-        优先从CSV数据获取，如果异常则从实时数据获取
+        逐行判断：CSV市值在合理范围内（单位为元）时直接比较；缺失或单位异常的行使用本地市值快照
+        （不访问网络），快照中没有则不过滤。结果只取决于每行自身，与读取的历史长度无关
         """
-        import akshare as ak
-        
-        # 尝试从CSV数据获取
-        if 'market_cap' in df.columns:
-            # 检查数据是否合理（单位应该是元）
-            sample_cap = df['market_cap'].dropna().iloc[-1] if not df['market_cap'].dropna().empty else 0
-            
-            # 如果市值在合理范围（10亿到1000亿之间），使用CSV数据
-            if 1e9 < sample_cap < 1e11:
-                return df['market_cap'] > self.params['CAP']
-        
-        # 从实时数据获取总市值
-        try:
-            # 从股票代码推断市场
-            stock_code = str(df['code'].iloc[0]) if 'code' in df.columns else None
-            
-            if stock_code:
-                # 获取实时数据
-                spot_df = ak.stock_individual_info_em(symbol=stock_code)
-                if not spot_df.empty:
-                    # 查找总市值
-                    total_cap_row = spot_df[spot_df['item'] == '总市值']
-                    if not total_cap_row.empty:
-                        total_cap = total_cap_row['value'].values[0]
-                        # 转换为数字（可能是字符串）
-                        if isinstance(total_cap, str):
-                            # 处理"33.19亿"格式
-                            if '亿' in total_cap:
-                                total_cap = float(total_cap.replace('亿', '')) * 1e8
-                            else:
-                                total_cap = float(total_cap)
-                        
-                        # 创建 Series
-                        return pd.Series([total_cap > self.params['CAP']] * len(df), index=df.index)
-        except Exception as e:
-            # 如果实时获取失败，尝试用收盘价估算
-            if 'close' in df.columns:
-                # 假设总股本2亿股，估算市值
-                estimated_cap = df['close'] * 2e8  # 粗略估计
-                return estimated_cap > self.params['CAP']
-        
-        # 默认返回True（不过滤）
-        return pd.Series([True] * len(df), index=df.index)
+        market_cap = df['market_cap'].to_numpy(dtype=float) if 'market_cap' in df.columns else np.full(len(df), np.nan)
+        stock_code = str(df['code'].iloc[0]) if 'code' in df.columns else df.attrs.get('code')
+        return pd.Series(self._market_cap_ok(market_cap[:, None], [stock_code])[:, 0], index=df.index)
+    
+    def _snapshot_cap_ok(self, stock_code):
+        """按市值快照判断是否达标，快照中没有该股票时返回 None"""
+        total_cap = get_market_cap_snapshot().get(stock_code) if stock_code else None
+        if total_cap is None:
+            return None
+        return total_cap > self.params['CAP']
     
     def select_stocks(self, df, stock_name='') -> list:
         """
@@ -202,8 +217,7 @@ class BowlReboundStrategy(BaseStrategy):
         
         # 过滤退市/异常股票
         if stock_name:
-            invalid_keywords = ['退', '未知', '退市', '已退']
-            if any(kw in stock_name for kw in invalid_keywords):
+            if any(kw in stock_name for kw in INVALID_NAME_KEYWORDS):
                 return []
             
             # 过滤 ST/*ST 股票
@@ -225,15 +239,12 @@ class BowlReboundStrategy(BaseStrategy):
         
         # ========== 核心条件检查 ==========
         
-        # 1. 上升趋势
-        if not latest['trend_above']:
-            return []
-        
-        # 2. J值条件
-        if not latest['j_low']:
+        # 1. 趋势线在上 AND J值低位 AND 位置分类（优先级：回落碗中 > 靠近多空线 > 靠近短期趋势线）
+        category_id = latest['category_id']
+        if category_id < 0:
             return []
         
-        # 3. 异动条件：在M天内存在放量阳线
+        # 2. 异动条件：在M天内存在放量阳线
         lookback_df = df.head(self.params['M'])
 
         # 剔除：如果回顾期内最大成交量的一天是阴线（最大量是阴量）
@@ -243,35 +254,11 @@ class BowlReboundStrategy(BaseStrategy):
             # 最大成交量那天是阴线，剔除
             return []
 
-        key_candles = lookback_df[
-            (lookback_df['key_candle'] == True) &
-            (lookback_df['close'] > lookback_df['open'])
-        ]
+        key_candles = lookback_df[lookback_df['key_candle']]
 
         if key_candles.empty:
             return []
         
-        # ========== 分类标记（按优先级） ==========
-        
-        reasons = []
-        category = None
-        
-        # 优先级1：回落碗中（价格位于多空线和短期趋势线之间）
-        if latest['fall_in_bowl']:
-            reasons.append('回落碗中')
-            category = 'bowl_center'
-        # 优先级2：靠近多空线
-        elif latest['near_duokong']:
-            reasons.append(f'靠近多空线(±{self.params["duokong_pct"]}%)')
-            category = 'near_duokong'
-        # 优先级3：靠近短期趋势线
-        elif latest['near_short_trend']:
-            reasons.append(f'靠近短期趋势线(±{self.params["short_pct"]}%)')
-            category = 'near_short_trend'
-        else:
-            # 不满足任何位置条件
-            return []
-        
         # ========== 构建选股信号 ==========
         
         latest_key = key_candles.iloc[0]
@@ -284,9 +271,306 @@ class BowlReboundStrategy(BaseStrategy):
             'market_cap': round(latest['market_cap'] / 1e8, 2),
             'short_term_trend': round(latest['short_term_trend'], 2),
             'bull_bear_line': round(latest['bull_bear_line'], 2),
-            'reasons': reasons,
-            'category': category,  # 分类标记
+            'reasons': self._reasons(category_id),
+            'category': CATEGORIES[category_id],  # 分类标记
             'key_candle_date': latest_key['date'],
         }
         
         return [signal_info]
+
+    def select_stocks_staged(self, df, stock_name='', cache=None):
+        """
+        分阶段选股：先在最新K线上检查廉价且淘汰率高的条件，通过后才计算完整指标
+        
+        1. 最新一天无成交或收盘价缺失（只看原始数据）
+        2. 回溯期内最大成交量是阴线（只看最近M天原始数据）
+        3. 趋势线不在上（只算知行趋势线）
+        4. J值不在低位或数据异常（只算KDJ）
+        5. 完整指标 + select_stocks
+        
+        前四项都是 select_stocks 的必要条件，结果与 calculate_indicators + select_stocks 一致；
+        趋势线和KDJ放在缓存中，进入第5步时不重复计算。
+        """
+        if df.empty:
+            return STAGE_LATEST_BAR, [], None
+        if cache is None:
+            cache = IndicatorCache(df)
+        
+        latest = df.iloc[0]
+        if latest['volume'] <= 0 or pd.isna(latest['close']):
+            return STAGE_LATEST_BAR, [], None
+        
+        lookback_df = df.head(self.params['M'])
+        if lookback_df['volume'].notna().any():
+            max_volume_row = lookback_df.loc[lookback_df['volume'].idxmax()]
+            if max_volume_row['close'] < max_volume_row['open']:
+                return STAGE_MAX_VOLUME, [], None
+        
+        trend_df = cache.zhixing_trend(
+            m1=self.params['M1'],
+            m2=self.params['M2'],
+            m3=self.params['M3'],
+            m4=self.params['M4']
+        )
+        if not trend_df['short_term_trend'].iloc[0] > trend_df['bull_bear_line'].iloc[0]:
+            return STAGE_TREND, [], None
+        
+        J = cache.kdj(n=9, m1=3, m2=3)['J']
+        if not J.iloc[0] <= self.params['J_VAL'] or J.head(30).abs().mean() > 80:
+            return STAGE_KDJ, [], None
+        
+        result = self.calculate_indicators(df, cache=cache)
+        signal_list = self.select_stocks(result, stock_name)
+        return (None if signal_list else STAGE_FULL), signal_list, result
+    
+    def prefilter(self, meta) -> bool:
+        """最新一天无成交或收盘价缺失时一定不会入选（与 select_stocks 的第一项检查一致）"""
+        volume = meta.get('last_volume')
+        return not pd.isna(meta.get('last_close')) and (volume is None or volume > 0)
+    
+    # ========== 全市场批量选股 ==========
+    
+    def select_stocks_panel(self, panel, stock_codes=None) -> dict:
+        """
+        基于全市场面板一次性计算所有股票的指标并选股
+        结果与逐只调用 calculate_indicators + select_stocks 一致（不含名称过滤）
+        :param panel: 已加载的 MarketPanel
+        :param stock_codes: 参与选股的股票，None 表示面板中全部股票
+        :return: {股票代码: 选股信号列表}，只包含K线数>=60的股票
+        """
+        if stock_codes is None:
+            stock_codes = panel.codes
+        codes = [code for code in stock_codes if code in panel.code_index]
+        if not codes or panel.n_dates == 0:
+            return {}
+        
+        cols = np.array([panel.code_index[code] for code in codes])
+        raw = {field: np.asarray(panel.field(field)[:, cols], dtype=float)
+               for field in ('open', 'high', 'low', 'close', 'volume', 'market_cap')}
+        
+        # 剔除停牌日：每只股票的有效K线压缩到底部，最后一行即各自最新交易日
+        index = tp.CompactIndex.from_values(raw['close'])
+        data = {field: index.compact(values) for field, values in raw.items()}
+        close, open_, volume = data['close'], data['open'], data['volume']
+        
+        # 1. 知行趋势线
+        short_term_trend, bull_bear_line = tp.calculate_zhixing_trend(
+            close,
+            m1=self.params['M1'],
+            m2=self.params['M2'],
+            m3=self.params['M3'],
+            m4=self.params['M4']
+        )
+        
+        # 2. KDJ指标
+        _, _, j = tp.KDJ(data['high'], data['low'], close, n=9, m1=3, m2=3)
+        
+        # 3. 关键K线 = 放量 AND 阳线 AND 市值达标
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol_ratio = volume / tp.REF(volume, 1)
+        key_candle = self._key_candle(vol_ratio, open_, close, self._market_cap_ok(data['market_cap'], codes))
+        
+        # ========== 最新一天的条件（向量化） ==========
+        
+        latest = -1
+        latest_close = close[latest]
+        latest_stt = short_term_trend[latest]
+        latest_bbl = bull_bear_line[latest]
+        category_id = self._classify(latest_close, latest_stt, latest_bbl, j[latest])
+        
+        with np.errstate(invalid='ignore'):
+            j_abs_mean = np.nanmean(np.abs(j[-30:]), axis=0)
+        
+        # 回溯期按时间倒序（最新在前），与 df.head(M) 的顺序一致
+        M = self.params['M']
+        lookback_volume = volume[-M:][::-1]
+        lookback_bearish = (close < open_)[-M:][::-1]
+        lookback_key = key_candle[-M:][::-1]
+        
+        # 最大成交量的一天（并列取最新）
+        max_volume_pos = np.where(np.isnan(lookback_volume), -np.inf, lookback_volume).argmax(axis=0)
+        max_volume_bearish = lookback_bearish[max_volume_pos, np.arange(len(codes))]
+        
+        candidates = (
+            (index.counts >= 60) &
+            (volume[latest] > 0) &
+            ~(j_abs_mean > 80) &
+            (category_id >= 0) &
+            ~max_volume_bearish &
+            lookback_key.any(axis=0)
+        )
+        key_pos = lookback_key.argmax(axis=0)
+        
+        results = {code: [] for code, count in zip(codes, index.counts) if count >= 60}
+        n_rows = index.shape[0]
+        for col in np.flatnonzero(candidates):
+            latest_row = index.source_rows[latest, col]
+            key_row = index.source_rows[n_rows - 1 - key_pos[col], col]
+            ratio = vol_ratio[latest, col]
+            
+            results[codes[col]] = [{
+                'date': pd.Timestamp(panel.dates[latest_row]),
+                'close': round(latest_close[col], 2),
+                'J': round(j[latest, col], 2),
+                'volume_ratio': round(ratio, 2) if not np.isnan(ratio) else 1.0,
+                'market_cap': round(data['market_cap'][latest, col] / 1e8, 2),
+                'short_term_trend': round(latest_stt[col], 2),
+                'bull_bear_line': round(latest_bbl[col], 2),
+                'reasons': self._reasons(category_id[col]),
+                'category': CATEGORIES[category_id[col]],
+                'key_candle_date': pd.Timestamp(panel.dates[key_row]),
+            }]
+        
+        return results
+    
+    def _market_cap_ok(self, market_cap, codes) -> np.ndarray:
+        """
+        市值检查（时间 × 股票 数组，各选股入口共用）：
+        逐日判断，市值在合理范围内直接比较，缺失或单位异常的位置查市值快照，快照中没有则不过滤
+        """
+        low, high = CAP_UNIT_RANGE
+        in_range = (market_cap > low) & (market_cap < high)
+        needs_snapshot = ~in_range.all(axis=0)
+        fallback = np.array([
+            self._snapshot_cap_ok(code) in (True, None) if needs_snapshot[col] else True
+            for col, code in enumerate(codes)
+        ], dtype=bool)
+        return np.where(in_range, market_cap > self.params['CAP'], fallback)
+    
+    # ========== 历史信号（回测） ==========
+    
+    def history_indicators(self, raw, codes):
+        """
+        计算全市场每个交易日的指标，供 history_signals 使用
+        只依赖均线参数 M1~M4：N/M/J_VAL/CAP/分类百分比不同的参数组可共用同一份结果
+        :param raw: {字段: (时间正序 × 股票) 数组}，含 open/high/low/close/volume/market_cap，停牌为NaN
+        :param codes: 与列对应的股票代码
+        :return: 压缩（底部对齐）后的原始行情和趋势线、J值，以及压缩索引 index
+        """
+        index = tp.CompactIndex.from_values(raw['close'])
+        data = {field: index.compact(values) for field, values in raw.items()}
+        data['short_term_trend'], data['bull_bear_line'] = tp.calculate_zhixing_trend(
+            data['close'],
+            m1=self.params['M1'],
+            m2=self.params['M2'],
+            m3=self.params['M3'],
+            m4=self.params['M4']
+        )
+        _, _, data['J'] = tp.KDJ(data['high'], data['low'], data['close'], n=9, m1=3, m2=3)
+        data['index'] = index
+        data['codes'] = list(codes)
+        return data
+    
+    def history_signals(self, data):
+        """
+        向量化计算每只股票每个交易日的选股信号
+        第 t 行的结果与截至该日的数据调用 calculate_indicators + select_stocks 一致（不含名称过滤）
+        :param data: history_indicators 的结果
+        :return: (信号布尔数组, 分类编号数组（CATEGORIES 下标，-1 为无）)，形状与压缩数组一致
+        """
+        close, open_, volume = data['close'], data['open'], data['volume']
+        stt, bbl, j = data['short_term_trend'], data['bull_bear_line'], data['J']
+        index = data['index']
+        n_rows = close.shape[0]
+        
+        # 截至每一行的K线数
+        bars = np.arange(n_rows)[:, None] - (n_rows - index.counts)[None, :] + 1
+        
+        # 关键K线 = 放量 AND 阳线 AND 市值达标；异动 = EXIST(关键K线, M)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol_ratio = volume / tp.REF(volume, 1)
+        key_candle = self._key_candle(vol_ratio, open_, close, self._market_cap_ok(data['market_cap'], data['codes']))
+        abnormal = tp.EXIST(key_candle, self.params['M'])
+        
+        # 最近30天 |J| 均值（数据异常过滤）
+        j_abs_mean = pd.DataFrame(np.abs(j)).rolling(window=30, min_periods=1).mean().to_numpy()
+        
+        # 回溯期内最大成交量是否阴线：从最新一天往前逐日比较，并列取最新
+        bearish = close < open_
+        volume_filled = np.where(np.isnan(volume), -np.inf, volume)
+        max_volume = volume_filled.copy()
+        max_volume_bearish = bearish.copy()
+        for lag in range(1, self.params['M']):
+            lagged = np.full(volume.shape, -np.inf)
+            lagged[lag:] = volume_filled[:-lag]
+            larger = lagged > max_volume
+            max_volume = np.where(larger, lagged, max_volume)
+            max_volume_bearish[lag:] = np.where(larger[lag:], bearish[:-lag], max_volume_bearish[lag:])
+        
+        # 趋势线在上 AND J值低位 AND 位置分类
+        category = self._classify(close, stt, bbl, j)
+        
+        with np.errstate(invalid='ignore'):
+            signal = (
+                (bars >= 60) &
+                (volume > 0) &
+                ~(j_abs_mean > 80) &
+                ~max_volume_bearish &
+                abnormal &
+                (category >= 0)
+            )
+        return signal, category
+    
+    # ========== 流式指标状态选股 ==========
+    
+    def create_state_store(self, data_dir="data") -> IndicatorStateStore:
+        """创建与当前参数匹配的流式指标状态存储"""
+        return IndicatorStateStore(
+            data_dir,
+            ma_periods=(self.params['M1'], self.params['M2'], self.params['M3'], self.params['M4']),
+            lookback=self.params['M']
+        )
+    
+    def select_from_state(self, state, stock_code=None) -> list:
+        """
+        基于流式指标状态选股，条件与 select_stocks 一致（不含名称过滤）
+        :param state: 已同步到最新K线的 StreamingIndicators
+        :param stock_code: 股票代码（市值单位异常时查市值快照）
+        """
+        if state.count == 0:
+            return []
+        
+        latest = state.latest_bar
+        if not latest['volume'] > 0 or np.isnan(latest['close']):
+            return []
+        
+        # 过滤数据异常的股票
+        if np.mean(np.abs(state.recent_j)) > 80:
+            return []
+        
+        short_term_trend = state.short_term_trend
+        bull_bear_line = state.bull_bear_line
+        j = state.j
+        category_id = int(self._classify(latest['close'], short_term_trend, bull_bear_line, j))
+        if category_id < 0:
+            return []
+        
+        # 回溯期K线（最新在前）: [date, open, close, volume, vol_ratio, market_cap]
+        lookback_bars = list(state.recent_bars)[::-1]
+        
+        # 剔除：回顾期内最大成交量的一天是阴线（并列取最新）
+        volumes = np.array([bar[3] for bar in lookback_bars])
+        max_volume_bar = lookback_bars[np.where(np.isnan(volumes), -np.inf, volumes).argmax()]
+        if max_volume_bar[2] < max_volume_bar[1]:
+            return []
+        
+        # 关键K线 = 放量 AND 阳线 AND 市值达标（逐根判断，缺失或单位异常时查市值快照，同 _check_market_cap_realtime）
+        bars = np.array([bar[1:] for bar in lookback_bars], dtype=float)
+        cap_ok = self._market_cap_ok(bars[:, 4:5], [stock_code])[:, 0]
+        key_candles = [bar for bar, ok in zip(lookback_bars, self._key_candle(bars[:, 3], bars[:, 0], bars[:, 1], cap_ok)) if ok]
+        if not key_candles:
+            return []
+        
+        vol_ratio = latest['vol_ratio']
+        return [{
+            'date': pd.Timestamp(latest['date']),
+            'close': round(latest['close'], 2),
+            'J': round(j, 2),
+            'volume_ratio': round(vol_ratio, 2) if not np.isnan(vol_ratio) else 1.0,
+            'market_cap': round(latest['market_cap'] / 1e8, 2),
+            'short_term_trend': round(short_term_trend, 2),
+            'bull_bear_line': round(bull_bear_line, 2),
+            'reasons': self._reasons(category_id),
+            'category': CATEGORIES[category_id],
+            'key_candle_date': pd.Timestamp(key_candles[0][0]),
+        }]
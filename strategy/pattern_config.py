@@ -142,6 +142,13 @@ MIN_SIMILARITY_SCORE = _yaml_config.get('min_similarity', 60.0)
 # 回看天数（默认25天）
 DEFAULT_LOOKBACK_DAYS = _yaml_config.get('lookback_days', 25)
 
+# DTW带宽（Sakoe-Chiba 带）：占曲线长度的比例，25天曲线约±3天的时间错位
+DTW_WINDOW = _yaml_config.get('dtw_window', 0.1)
+
+# 案例近邻索引：案例数超过 index_min_cases 时，每个候选只对特征向量最接近的 index_top_k 个案例精确计算相似度
+INDEX_MIN_CASES = _yaml_config.get('index_min_cases', 200)
+INDEX_TOP_K = _yaml_config.get('index_top_k', 32)
+
 # Top N 结果展示（优先从YAML读取）
 TOP_N_RESULTS = _yaml_config.get('top_n_results', 15)
 
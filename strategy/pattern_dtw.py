@@ -0,0 +1,132 @@
+"""
+带约束的DTW（Sakoe-Chiba 带）及 LB_Keogh 下界 - 对一批序列对向量化计算
+
+- 代价为逐点绝对差，路径只能落在 |i - j| <= window 的带内
+  （两序列长度不同时带宽至少为长度差，保证终点可达）
+- 动态规划按反对角线推进（波前）：同一条反对角线上的单元格互不依赖，整条一次算完，
+  循环 n + m - 1 次，每一步对整批序列对同时计算
+- LB_Keogh：每个点到另一序列带内上下包络的距离之和，不超过带约束DTW距离，
+  用于在精确计算前排除不可能成为最佳匹配的序列对
+"""
+import numpy as np
+
+
+def dtw_window(n, m, ratio):
+    """带宽（单元格数）：较长序列长度 × ratio 向上取整，且不小于长度差"""
+    return max(int(np.ceil(max(n, m) * ratio)), abs(n - m))
+
+
+def banded_dtw(a, b, window):
+    """
+    一批等长序列对的带约束DTW距离
+    :param a: (P, n) 数组
+    :param b: (P, m) 数组
+    :param window: 带宽，小于 |n - m| 时按 |n - m|
+    :return: (P,) 距离
+    """
+    pairs, n = a.shape
+    m = b.shape[1]
+    window = max(window, abs(n - m))
+    # 按 (位置, 序列对) 排列，每一步都是对整批序列对的连续向量运算；
+    # b 倒序存放，使反对角线上的 b[d - i] 也是一段连续切片
+    a = np.ascontiguousarray(a.T, dtype=float)
+    b = np.ascontiguousarray(b[:, ::-1].T, dtype=float)
+    
+    # 第 d 条反对角线 (i + j = d) 上的单元格只依赖前两条反对角线，整条一次算完：
+    # D(i, j) = cost(i, j) + min(D(i-1, j), D(i, j-1), D(i-1, j-1))，
+    # 前者在 d-1 条上的下标为 i-1 和 i，对角一步在 d-2 条上的下标为 i-1。
+    # 三个缓冲轮换使用，下标 i+1 对应第 i 个点，带两侧各留一格 inf 免去边界判断
+    diagonals = [np.full((n + 2, pairs), np.inf) for _ in range(3)]
+    diagonals[1][0] = 0  # 起点 (0, 0) 的对角前驱
+    cost = np.empty((min(n, window + 1), pairs))
+    step = np.empty_like(cost)
+    for d in range(n + m - 1):
+        before, prev, cur = diagonals[(d + 1) % 3], diagonals[(d + 2) % 3], diagonals[d % 3]
+        # 带内 |i - j| <= window 即 (d - window) / 2 <= i <= (d + window) / 2
+        lo = max(-((window - d) // 2), 0, d - m + 1)
+        hi = min((d + window) // 2, n - 1, d) + 1
+        c, s = cost[:hi - lo], step[:hi - lo]
+        np.subtract(a[lo:hi], b[m - 1 - d + lo:m - 1 - d + hi], out=c)
+        np.abs(c, out=c)
+        np.minimum(prev[lo:hi], prev[lo + 1:hi + 1], out=s)
+        np.minimum(s, before[lo:hi], out=s)
+        np.add(s, c, out=cur[lo + 1:hi + 1])
+        # 带每次最多移动一格，只需把两侧相邻的一格置为 inf
+        cur[lo] = np.inf
+        cur[hi + 1] = np.inf
+    return cur[n]
+
+
+def envelope(b, n, window):
+    """
+    b 在带内的上下包络（按另一序列的 n 个位置）
+    :param b: (K, m) 数组
+    :return: (upper, lower)，均为 (K, n)
+    """
+    m = b.shape[1]
+    window = max(window, abs(n - m))
+    upper = np.empty((b.shape[0], n))
+    lower = np.empty((b.shape[0], n))
+    for i in range(n):
+        segment = b[:, max(0, i - window):min(m, i + window + 1)]
+        upper[:, i] = segment.max(axis=1)
+        lower[:, i] = segment.min(axis=1)
+    return upper, lower
+
+
+def lb_keogh(a, upper, lower):
+    """
+    LB_Keogh 下界：a 的每个点到另一序列带内上下包络之外的距离之和
+    :param a: (P, n) 数组
+    :param upper / lower: (P, n) 包络（见 envelope）
+    :return: (P,) 下界，不超过两序列的 banded_dtw 距离
+    """
+    return (np.maximum(a - upper, 0) + np.maximum(lower - a, 0)).sum(axis=1)
+
+
+def pairwise_dtw(left, right, rows, cols, ratio):
+    """
+    序列对 (left[rows[p]], right[cols[p]]) 的带约束DTW距离，按两侧长度分组批量计算
+    :param left / right: 序列列表（未参与的位置可以为 None）
+    :param rows / cols: 序列对下标数组
+    :param ratio: 带宽比例（见 dtw_window）
+    :return: (P,) 距离，与 rows/cols 顺序对应
+    """
+    out = np.empty(len(rows))
+    for group, window, a, a_index, b, b_index in _length_groups(left, right, rows, cols, ratio):
+        out[group] = banded_dtw(a[a_index], b[b_index], window)
+    return out
+
+
+def pairwise_lower_bound(left, right, rows, cols, ratio):
+    """序列对的 LB_Keogh 下界（参数同 pairwise_dtw），右侧每条序列的包络只计算一次"""
+    out = np.empty(len(rows))
+    for group, window, a, a_index, b, b_index in _length_groups(left, right, rows, cols, ratio):
+        upper, lower = envelope(b, a.shape[1], window)
+        out[group] = lb_keogh(a[a_index], upper[b_index], lower[b_index])
+    return out
+
+
+def _length_groups(left, right, rows, cols, ratio):
+    """
+    按两侧序列长度分组
+    :yield: (组内序列对下标, 带宽, 左侧去重后堆叠的序列, 序列对对应的左侧行, 右侧序列, 右侧行)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    left_len = np.array([len(seq) if seq is not None else 0 for seq in left], dtype=np.int64)
+    right_len = np.array([len(seq) if seq is not None else 0 for seq in right], dtype=np.int64)
+    
+    n, m = left_len[rows], right_len[cols]
+    keys, group_of = np.unique(n * (right_len.max(initial=0) + 1) + m, return_inverse=True)
+    for g in range(len(keys)):
+        group = np.nonzero(group_of == g)[0]
+        a, a_index = _stack(left, rows[group])
+        b, b_index = _stack(right, cols[group])
+        yield group, dtw_window(a.shape[1], b.shape[1], ratio), a, a_index, b, b_index
+
+
+def _stack(seqs, index):
+    """堆叠下标对应的等长序列（相同序列只保留一份），返回 (序列数组, 每个下标所在的行)"""
+    unique, inverse = np.unique(index, return_inverse=True)
+    return np.stack([np.asarray(seqs[i], dtype=float) for i in unique]), inverse
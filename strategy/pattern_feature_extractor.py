@@ -15,6 +15,19 @@ from utils.technical import (
 )
 
 
+# 提取时在回看窗口上重新计算的指标列（输入数据中已有的同名列会被替换）
+INDICATOR_COLUMNS = ['short_term_trend', 'bull_bear_line', 'K', 'D', 'J']
+
+
+def normalize_curve(values):
+    """把曲线缩放到0-1范围（最小值为0、最大值为1），平坦曲线返回全零"""
+    values_min = values.min()
+    values_max = values.max()
+    if values_max > values_min:
+        return (values - values_min) / (values_max - values_min)
+    return np.zeros_like(values)
+
+
 class PatternFeatureExtractor:
     """从股票数据中提取完美图形特征"""
     
@@ -39,16 +52,14 @@ class PatternFeatureExtractor:
         # 按日期正序排列（便于计算趋势）
         window_df = window_df.sort_values('date').reset_index(drop=True)
         
-        # 计算知行指标
+        # 计算知行指标和KDJ（一次拼接，逐列赋值的开销比指标计算本身还大）
         trend_df = calculate_zhixing_trend(window_df)
-        window_df['short_term_trend'] = trend_df['short_term_trend']
-        window_df['bull_bear_line'] = trend_df['bull_bear_line']
-        
-        # 计算KDJ
         kdj_df = KDJ(window_df, n=9, m1=3, m2=3)
-        window_df['K'] = kdj_df['K']
-        window_df['D'] = kdj_df['D']
-        window_df['J'] = kdj_df['J']
+        window_df = pd.concat([
+            window_df.drop(columns=INDICATOR_COLUMNS, errors='ignore'),
+            trend_df[['short_term_trend', 'bull_bear_line']],
+            kdj_df[['K', 'D', 'J']],
+        ], axis=1)
         
         features = {
             "trend_structure": self._extract_trend_features(window_df),
@@ -177,10 +188,9 @@ class PatternFeatureExtractor:
         shrink_then_expand = self._detect_shrink_expand(volumes)
         
         # 关键K线数量（放量+阳线）
-        key_candles = 0
-        for i in range(len(df)):
-            if i > 0 and df['volume'].iloc[i] > df['volume'].iloc[i-1] * 2 and df['close'].iloc[i] > df['open'].iloc[i]:
-                key_candles += 1
+        closes = df['close'].values
+        opens = df['open'].values
+        key_candles = np.sum((volumes[1:] > volumes[:-1] * 2) & (closes[1:] > opens[1:]))
         
         # 量能趋势分类
         volume_trend = self._classify_volume_trend(volumes)
@@ -201,12 +211,7 @@ class PatternFeatureExtractor:
         closes = df['close'].values
         
         # 归一化曲线（用于DTW匹配）- 缩放到0-1范围
-        price_min = closes.min()
-        price_max = closes.max()
-        if price_max > price_min:
-            normalized = (closes - price_min) / (price_max - price_min)
-        else:
-            normalized = np.zeros_like(closes)
+        normalized = normalize_curve(closes)
         
         # 最大回撤（从最高点回落的最大幅度）
         peak = np.maximum.accumulate(closes)
@@ -0,0 +1,176 @@
+"""
+B1案例近邻索引 - 案例库扩展到成千上万个案例后，先检索每个候选最接近的少量案例，再精确计算相似度
+
+- embed 把特征按 PatternMatcher 的打分方式展开为定长向量：数值项除以容差，斜率记方向和大小，
+  类别项独热编码，归一化曲线重采样为定长点列；各项再乘以 维度权重 / 维度比较项数，
+  使两个向量的 L1 距离近似等于总分的扣分（曲线的逐点距离不小于DTW距离）
+- 用 scipy cKDTree 按 L1 距离检索 top-k 案例，PatternMatcher 只对这些案例精确打分
+- 向量和案例ID保存在案例库缓存旁（.npz），新增/移除案例时增量更新：新增的向量先放在
+  KD树之外按暴力搜索，超过一定比例后才重建KD树
+"""
+import json
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+from strategy.pattern_vector import CATEGORY_VALUES, DIMENSIONS, DIMENSION_TERMS, FeatureMatrix
+
+
+# 索引文件格式版本（向量布局变化时递增，旧索引自动重建）
+INDEX_VERSION = 1
+
+# 曲线重采样的点数
+CURVE_POINTS = 16
+
+# KD树之外的新增案例超过 max(REBUILD_MIN, 已建树案例数 × REBUILD_RATIO) 时重建KD树
+REBUILD_MIN = 64
+REBUILD_RATIO = 0.1
+
+
+def embed(matrix: FeatureMatrix, weights: dict, tolerances: dict) -> np.ndarray:
+    """
+    特征矩阵展开为定长向量
+    :return: (行数, 向量维数)，缺失的项为 0
+    """
+    blocks = []
+    grid = np.linspace(0, 1, CURVE_POINTS)
+    for dim in DIMENSIONS:
+        terms = DIMENSION_TERMS[dim]
+        scale = weights.get(dim, 0.25) / len(terms)
+        for j, (kind, field, param) in enumerate(terms):
+            present = matrix.present[dim][:, j]
+            values = np.where(present, matrix.values[dim][:, j], 0.0)
+            if kind == 'diff':
+                tol = tolerances.get(*param) if isinstance(param, tuple) else param
+                block = (values / tol * scale)[:, None]
+            elif kind == 'slope':
+                # 方向不同扣 0.7 以上，方向相同按差值 / 10 扣分
+                block = np.stack([np.where(present & (values > 0), 0.7 * scale, 0.0), values / 10 * scale], axis=1)
+            elif kind == 'equal':
+                # 取值不同的两个独热向量 L1 距离为 2 × 单边编码值
+                known = CATEGORY_VALUES[field]
+                block = np.zeros((matrix.size, len(known)))
+                rows = np.nonzero(present & (values < len(known)))[0]
+                block[rows, values[rows].astype(np.int64)] = (param[0] - param[1]) * scale / 2
+            else:
+                # 逐点平均绝对差即等长曲线对角路径的DTW距离 / 长度
+                block = np.zeros((matrix.size, CURVE_POINTS))
+                for i, curve in enumerate(matrix.curves):
+                    if curve is not None:
+                        block[i] = np.interp(grid, np.linspace(0, 1, len(curve)), curve) * scale / CURVE_POINTS
+            blocks.append(block)
+    return np.nan_to_num(np.hstack(blocks))
+
+
+class CaseIndex:
+    """
+    案例特征向量的近邻索引
+    - 前 _tree_size 行建有KD树，其后为尚未建树的新增案例
+    - 案例以ID标识，与案例库中的顺序无关
+    """
+    
+    def __init__(self, weights: dict, tolerances: dict):
+        self.weights = weights
+        self.tolerances = tolerances
+        self.case_ids = []
+        self.vectors = np.zeros((0, 0))
+        self._tree = None
+        self._tree_size = 0
+    
+    def __len__(self):
+        return len(self.case_ids)
+    
+    @property
+    def layout(self) -> str:
+        """向量布局签名（权重、容差或编码方式变化后旧索引失效）"""
+        return json.dumps({
+            'version': INDEX_VERSION,
+            'curve_points': CURVE_POINTS,
+            'weights': self.weights,
+            'tolerances': self.tolerances,
+            'categories': {field: [str(v) for v in values] for field, values in CATEGORY_VALUES.items()},
+        }, ensure_ascii=False, sort_keys=True)
+    
+    def embed(self, matrix: FeatureMatrix) -> np.ndarray:
+        return embed(matrix, self.weights, self.tolerances)
+    
+    def rebuild(self, case_ids: list, matrix: FeatureMatrix):
+        """按全部案例重建索引"""
+        self.case_ids = list(case_ids)
+        self.vectors = self.embed(matrix)
+        self._tree = None
+        self._tree_size = 0
+    
+    def add(self, case_id: str, features: dict):
+        """新增（或替换同ID的）案例"""
+        vector = self.embed(FeatureMatrix([features]))
+        if case_id in self.case_ids:
+            row = self.case_ids.index(case_id)
+            self.vectors[row] = vector[0]
+            if row < self._tree_size:
+                self._tree = None
+            return
+        self.case_ids.append(case_id)
+        self.vectors = np.vstack([self.vectors, vector]) if len(self.vectors) else vector
+    
+    def remove(self, case_id: str):
+        """移除案例（KD树在下次检索时重建）"""
+        if case_id not in self.case_ids:
+            return
+        row = self.case_ids.index(case_id)
+        del self.case_ids[row]
+        self.vectors = np.delete(self.vectors, row, axis=0)
+        self._tree = None
+    
+    def search(self, matrix: FeatureMatrix, k: int) -> np.ndarray:
+        """
+        每个候选 L1 距离最近的 k 个案例
+        :return: (候选数, min(k, 案例数)) 的行号（对应 case_ids），按距离升序
+        """
+        k = min(k, len(self))
+        if not k or not len(matrix):
+            return np.zeros((len(matrix), 0), dtype=np.int64)
+        
+        self._ensure_tree()
+        queries = self.embed(matrix)
+        # KD树部分
+        tree_k = min(k, self._tree_size)
+        distances = np.zeros((len(matrix), 0))
+        rows = np.zeros((len(matrix), 0), dtype=np.int64)
+        if tree_k:
+            distances, rows = self._tree.query(queries, k=tree_k, p=1)
+            distances = distances.reshape(len(matrix), tree_k)
+            rows = rows.reshape(len(matrix), tree_k)
+        # 尚未建树的新增案例：暴力计算后与KD树结果合并
+        if self._tree_size < len(self):
+            distances = np.hstack([distances, cdist(queries, self.vectors[self._tree_size:], 'cityblock')])
+            rows = np.hstack([rows, np.broadcast_to(np.arange(self._tree_size, len(self)), (len(matrix), len(self) - self._tree_size))])
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            rows = np.take_along_axis(rows, order, axis=1)
+        return rows
+    
+    def _ensure_tree(self):
+        pending = len(self) - self._tree_size
+        if self._tree is None or pending > max(REBUILD_MIN, self._tree_size * REBUILD_RATIO):
+            self._tree = cKDTree(self.vectors)
+            self._tree_size = len(self)
+    
+    def save(self, path):
+        """保存向量和案例ID（KD树加载后重建，几千个案例只需毫秒级）"""
+        np.savez(path, vectors=self.vectors, case_ids=np.array(self.case_ids, dtype=str),
+                 layout=np.array(self.layout))
+    
+    def load(self, path) -> bool:
+        """加载索引，文件不存在或布局不一致时返回 False"""
+        try:
+            with np.load(path) as data:
+                if str(data['layout']) != self.layout:
+                    return False
+                self.case_ids = [str(case_id) for case_id in data['case_ids']]
+                self.vectors = data['vectors']
+        except (OSError, KeyError, ValueError):
+            return False
+        self._tree = None
+        self._tree_size = 0
+        return True
@@ -9,9 +9,17 @@ import sys
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from strategy.pattern_config import B1_PERFECT_CASES, SIMILARITY_WEIGHTS, MIN_SIMILARITY_SCORE
+from strategy.pattern_config import (
+    B1_PERFECT_CASES, SIMILARITY_WEIGHTS, MIN_SIMILARITY_SCORE, MATCH_TOLERANCES, INDEX_MIN_CASES, INDEX_TOP_K
+)
 from strategy.pattern_feature_extractor import PatternFeatureExtractor
 from strategy.pattern_matcher import PatternMatcher
+from strategy.pattern_vector import FeatureMatrix
+from strategy.pattern_index import CaseIndex
+
+
+# 使用近邻索引时每次批量计算的候选数
+INDEX_CHUNK_SIZE = 32
 
 
 class B1PatternLibrary:
@@ -20,6 +28,7 @@ class B1PatternLibrary:
     - 预计算10个历史成功案例的特征向量
     - 支持序列化/反序列化（缓存）
     - 支持动态添加新案例
+    - 案例较多时通过近邻索引只对最接近的案例精确计算（索引随案例增删增量更新）
     - 为B2、B3等扩展预留空间
     """
     
@@ -30,10 +39,18 @@ class B1PatternLibrary:
         self.extractor = PatternFeatureExtractor()
         self.matcher = PatternMatcher(SIMILARITY_WEIGHTS)
         self.cases = {}  # {case_id: {meta, features}}
+        self._case_matrix = None  # 案例特征矩阵（案例变动时重建）
+        self.index = CaseIndex(SIMILARITY_WEIGHTS, MATCH_TOLERANCES)
         
         # 尝试从缓存加载，否则重新计算
         if not self._load_from_cache():
             self._build_library()
+        self._load_index()
+    
+    @property
+    def index_file(self) -> Path:
+        """近邻索引文件（与案例库缓存同目录）"""
+        return self.CACHE_FILE.with_name("b1_pattern_index.npz")
     
     def _build_library(self):
         """从本地CSV构建案例库"""
@@ -101,73 +118,134 @@ class B1PatternLibrary:
             stock_df: 股票数据
             lookback_days: 回看天数，默认25天
         """
-        if not self.cases:
-            return {
-                "stock_code": stock_code,
-                "best_match": None,
-                "all_matches": [],
-                "candidate_features": {},
-            }
+        return self.find_best_matches([(stock_code, stock_df)], lookback_days=lookback_days)[0]
+    
+    def find_best_matches(self, stocks: list, lookback_days: int = 25, prune: bool = True) -> list:
+        """
+        批量为多只股票找到最匹配的案例：先提取全部候选特征，再与所有案例一次性批量计算相似度
+        某只股票特征提取失败时只跳过该股票（特征为空、无匹配），其余股票照常批量计算
         
-        # 提取候选股特征（使用指定回看天数）
-        candidate_features = self.extractor.extract(stock_df, lookback_days=lookback_days)
+        Args:
+            stocks: [(股票代码, 股票数据), ...]
+            lookback_days: 回看天数，默认25天
+            prune: 用DTW下界跳过不可能成为最佳匹配的案例（all_matches 只包含精确计算的案例）
         
-        # 与所有案例对比
-        matches = []
-        for case_id, case_data in self.cases.items():
+        Returns:
+            与 stocks 顺序对应的匹配结果列表（结构同 find_best_match）
+        """
+        # 提取候选股特征（使用指定回看天数）
+        features_list = []
+        extracted = []
+        for i, (code, df) in enumerate(stocks):
             try:
-                similarity = self.matcher.match(
-                    candidate_features,
-                    case_data["features"]
-                )
-                
+                features_list.append(self.extractor.extract(df, lookback_days=lookback_days))
+                extracted.append(i)
+            except Exception as e:
+                print(f"  ⚠️ {code} 特征提取失败，跳过: {e}")
+                features_list.append({})
+        
+        matches_list = [[] for _ in stocks]
+        for i, matches in zip(extracted, self.match_features([features_list[i] for i in extracted], prune)):
+            matches_list[i] = matches
+        
+        return [
+            {
+                "stock_code": code,
+                "best_match": matches[0] if matches else None,
+                "all_matches": matches,
+                "candidate_features": features,
+            }
+            for (code, _), features, matches in zip(stocks, features_list, matches_list)
+        ]
+    
+    def match_features(self, features_list: list, prune: bool = True) -> list:
+        """
+        候选特征 × 全部案例的批量相似度
+        案例数超过 INDEX_MIN_CASES 时，每个候选只精确计算近邻索引检索出的 INDEX_TOP_K 个案例
+        
+        Args:
+            prune: 只保证最佳匹配，被DTW下界排除的案例不出现在结果中
+        
+        Returns:
+            每个候选的匹配列表（按相似度降序），元素结构同 find_best_match 的 all_matches
+        """
+        if not self.cases or not features_list:
+            return [[] for _ in features_list]
+        
+        candidates = FeatureMatrix(features_list)
+        cases = self.case_matrix()
+        case_items = list(self.cases.items())
+        # 百分制保留两位小数，与最佳得分取整后可能相同的案例也精确计算，保证同分时的排序不变
+        if len(case_items) <= INDEX_MIN_CASES:
+            return self._collect_matches(
+                self.matcher.match_matrix(candidates, cases, best_only=prune, tolerance=1e-4), case_items
+            )
+        
+        # 按候选分块，每块只与块内近邻案例的并集比较，非近邻的位置不计算
+        positions = {case_id: j for j, case_id in enumerate(self.cases)}
+        index_cols = np.array([positions[case_id] for case_id in self.index.case_ids], dtype=np.int64)
+        results = []
+        for start in range(0, len(candidates), INDEX_CHUNK_SIZE):
+            chunk = candidates.take(np.arange(start, min(start + INDEX_CHUNK_SIZE, len(candidates))))
+            shortlist = index_cols[self.index.search(chunk, INDEX_TOP_K)]
+            cols, inverse = np.unique(shortlist, return_inverse=True)
+            mask = np.zeros((len(chunk), len(cols)), dtype=bool)
+            mask[np.arange(len(chunk))[:, None], inverse.reshape(shortlist.shape)] = True
+            scores = self.matcher.match_matrix(chunk, cases.take(cols), best_only=prune, tolerance=1e-4, mask=mask)
+            results.extend(self._collect_matches(scores, [case_items[j] for j in cols]))
+        return results
+    
+    def _collect_matches(self, scores, case_items: list) -> list:
+        """match_matrix 的结果转换为每个候选的匹配列表（未计算的位置跳过）"""
+        total, breakdown, valid = scores
+        # 转换为百分制（与 PatternMatcher.match 的取整方式一致）
+        total = np.round(total * 100, 2)
+        breakdown = {k: np.round(v * 100, 2) for k, v in breakdown.items()}
+        
+        results = []
+        for i in range(total.shape[0]):
+            matches = []
+            for j in np.nonzero(~np.isnan(total[i]))[0]:
+                case_id, case_data = case_items[j]
                 matches.append({
                     "case_id": case_id,
                     "case_name": case_data["meta"]["name"],
                     "case_date": case_data["meta"]["breakout_date"],
                     "case_code": case_data["meta"]["code"],
-                    "similarity_score": similarity["total_score"],
-                    "breakdown": similarity["breakdown"],
+                    "similarity_score": float(total[i, j]),
+                    "breakdown": {k: float(v[i, j]) for k, v in breakdown.items()} if valid[i, j] else {},
                     "tags": case_data["meta"].get("tags", []),
                 })
-            except Exception as e:
-                print(f"  ⚠️ 匹配 {case_id} 失败: {e}")
-                continue
-        
-        # 按相似度排序
-        matches.sort(key=lambda x: x["similarity_score"], reverse=True)
-        
-        # 返回最佳匹配和所有匹配
-        best_match = matches[0] if matches else None
+            
+            # 按相似度排序
+            matches.sort(key=lambda x: x["similarity_score"], reverse=True)
+            results.append(matches)
         
-        return {
-            "stock_code": stock_code,
-            "best_match": best_match,
-            "all_matches": matches,
-            "candidate_features": candidate_features,
-        }
+        return results
+    
+    def case_matrix(self) -> FeatureMatrix:
+        """案例特征矩阵（按 self.cases 顺序，案例变动后重建）"""
+        if self._case_matrix is None:
+            self._case_matrix = FeatureMatrix(data["features"] for data in self.cases.values())
+        return self._case_matrix
     
     def match_batch(self, stocks_data: list) -> list:
         """
-        批量匹配多只股票
+        批量匹配多只股票（数据缺失或特征提取失败的股票跳过，不影响其余股票）
         stocks_data: [{code, df, stock_info}, ...]
         """
         results = []
         
-        for stock in stocks_data:
-            try:
-                match_result = self.find_best_match(stock["code"], stock["df"])
-                
-                if match_result["best_match"]:
-                    results.append({
-                        "stock_code": stock["code"],
-                        "stock_name": stock.get("name", ""),
-                        **match_result,
-                        **stock.get("info", {}),
-                    })
-            except Exception as e:
-                print(f"  ⚠️ 匹配 {stock['code']} 失败: {e}")
-                continue
+        stocks_data = [stock for stock in stocks_data if stock.get("df") is not None]
+        match_results = self.find_best_matches([(stock["code"], stock["df"]) for stock in stocks_data])
+        for stock, match_result in zip(stocks_data, match_results):
+            if match_result["best_match"]:
+                results.append({
+                    "stock_code": stock["code"],
+                    "stock_name": stock.get("name", ""),
+                    **match_result,
+                    **stock.get("info", {}),
+                })
         
         # 按相似度排序
         results.sort(key=lambda x: x["best_match"]["similarity_score"] if x.get("best_match") else 0, reverse=True)
@@ -190,9 +268,12 @@ class B1PatternLibrary:
                 "meta": case_config,
                 "features": features,
             }
+            self._case_matrix = None
+            self.index.add(case_config["id"], features)
             
             # 更新缓存
             self._save_to_cache()
+            self._save_index()
             print(f"✅ 新增案例: {case_config['name']}")
             
         except Exception as e:
@@ -202,7 +283,10 @@ class B1PatternLibrary:
         """移除案例"""
         if case_id in self.cases:
             del self.cases[case_id]
+            self._case_matrix = None
+            self.index.remove(case_id)
             self._save_to_cache()
+            self._save_index()
             print(f"✅ 移除案例: {case_id}")
     
     def list_cases(self):
@@ -265,16 +349,30 @@ class B1PatternLibrary:
                 serialized[key] = value
             elif isinstance(value, np.ndarray):
                 serialized[key] = value.tolist()
+            elif isinstance(value, (bool, np.bool_)):
+                serialized[key] = bool(value)
             elif isinstance(value, (np.integer, np.floating)):
                 serialized[key] = float(value)
-            elif isinstance(value, bool):
-                serialized[key] = bool(value)
             elif isinstance(value, str):
                 serialized[key] = value
             else:
                 serialized[key] = value
         return serialized
     
+    def _load_index(self):
+        """加载近邻索引，文件缺失或与案例库不一致时按全部案例重建"""
+        if self.index.load(self.index_file) and sorted(self.index.case_ids) == sorted(self.cases):
+            return
+        self.index.rebuild(list(self.cases), self.case_matrix())
+        self._save_index()
+    
+    def _save_index(self):
+        """保存近邻索引"""
+        try:
+            self.index.save(self.index_file)
+        except Exception as e:
+            print(f"⚠️ 索引保存失败: {e}")
+    
     def _deserialize_features(self, features: dict) -> dict:
         """反序列化特征"""
         deserialized = {}
@@ -291,5 +389,9 @@ class B1PatternLibrary:
         """清除缓存，强制重新构建"""
         if self.CACHE_FILE.exists():
             self.CACHE_FILE.unlink()
+        if self.index_file.exists():
+            self.index_file.unlink()
         self.cases = {}
+        self._case_matrix = None
+        self.index = CaseIndex(SIMILARITY_WEIGHTS, MATCH_TOLERANCES)
         print("🗑️ 缓存已清除")
@@ -1,26 +1,31 @@
 """
 相似度计算引擎 - 支持多维度加权匹配
-使用DTW进行形态相似度计算
+使用带约束的DTW（Sakoe-Chiba 带）进行形态相似度计算
 """
 import numpy as np
-from scipy.spatial.distance import euclidean
 
+from strategy.pattern_dtw import pairwise_dtw, pairwise_lower_bound
+from strategy.pattern_vector import DIMENSIONS, DIMENSION_TERMS, FeatureMatrix
 
-try:
-    from fastdtw import fastdtw
-    HAS_FASTDTW = True
-except ImportError:
-    HAS_FASTDTW = False
-    print("⚠️ fastdtw 未安装，将使用简化版DTW")
+
+# LB_Keogh 下界的浮点误差余量（下界与DTW距离相等时，避免累加顺序不同导致误剪枝）
+LOWER_BOUND_MARGIN = 1e-9
+
+
+def _clip_below(x, floor):
+    """与 max(floor, x) 一致：只有 x > floor 时取 x（NaN 取 floor）"""
+    return np.where(x > floor, x, floor)
 
 
 class PatternMatcher:
     """完美图形匹配器 - 支持从配置文件读取参数"""
     
-    def __init__(self, weights=None, tolerances=None):
-        from strategy.pattern_config import SIMILARITY_WEIGHTS, MATCH_TOLERANCES
+    def __init__(self, weights=None, tolerances=None, dtw_window=None):
+        from strategy.pattern_config import SIMILARITY_WEIGHTS, MATCH_TOLERANCES, DTW_WINDOW
         self.weights = weights or SIMILARITY_WEIGHTS
         self.tolerances = tolerances or MATCH_TOLERANCES
+        # DTW带宽占曲线长度的比例
+        self.dtw_window = dtw_window if dtw_window is not None else DTW_WINDOW
     
     def match(self, candidate_features: dict, case_features: dict) -> dict:
         """
@@ -78,6 +83,136 @@ class PatternMatcher:
             "breakdown": {k: round(v * 100, 2) for k, v in scores.items()},
         }
     
+    def match_matrix(self, candidates: FeatureMatrix, cases: FeatureMatrix, best_only: bool = False, tolerance: float = 0.0,
+                     mask: np.ndarray = None):
+        """
+        批量计算相似度：全部候选 × 全部案例一次广播完成，结果与逐对调用 match 一致
+        
+        Args:
+            best_only: 只保证每个候选的最佳匹配。先用 LB_Keogh 下界得到每对的总分上界，
+                       每个候选先精确计算上界最高的案例，其余案例上界低于该得分的不再计算DTW，
+                       这些位置的总分和明细为 NaN
+            tolerance: best_only 时上界不低于 最佳得分 - tolerance 的案例都精确计算
+            mask: (候选数, 案例数) 布尔数组，只计算为 True 的候选-案例对（如近邻索引检索出的案例），
+                  其余位置的总分和明细为 NaN；None 表示全部计算
+        
+        Returns:
+            (total, breakdown, valid)
+            total / breakdown[维度]: (候选数, 案例数) 的0-1分数（未转换为百分制）
+            valid: 两边特征都非空的位置（match 对其余位置返回0分、空明细）
+        """
+        shape = (len(candidates), len(cases))
+        pairs = (candidates.curve_lengths[:, None] > 0) & (cases.curve_lengths[None, :] > 0)
+        if mask is not None:
+            pairs &= mask
+        
+        if not best_only:
+            curve = self._curve_matrix(candidates, cases, self._curve_distances(candidates, cases, pairs, pairwise_dtw))
+            return self._masked(self._combine(candidates, cases, curve), mask)
+        
+        lower = self._curve_distances(candidates, cases, pairs, pairwise_lower_bound) * (1 - LOWER_BOUND_MARGIN)
+        upper_total = self._combine(candidates, cases, self._curve_matrix(candidates, cases, lower))[0]
+        if mask is not None:
+            upper_total[~mask] = -np.inf
+        
+        # 第一轮：每个候选精确计算总分上界最高的案例
+        first = np.zeros(shape, dtype=bool)
+        if shape[1]:
+            first[np.arange(shape[0]), np.argmax(upper_total, axis=1)] = True
+        first &= pairs
+        distances = self._curve_distances(candidates, cases, first, pairwise_dtw)
+        curve = self._curve_matrix(candidates, cases, np.where(first, distances, lower))
+        total = self._combine(candidates, cases, curve)[0]
+        unknown = pairs & ~first
+        if mask is not None:
+            unknown |= ~mask
+        best = np.where(unknown, -np.inf, total).max(axis=1, initial=-np.inf)
+        
+        # 第二轮：只计算上界不低于当前最佳得分（减去容差）的案例
+        second = pairs & ~first & (upper_total >= best[:, None] - tolerance)
+        distances = np.where(second, self._curve_distances(candidates, cases, second, pairwise_dtw), distances)
+        
+        exact = first | second
+        total, breakdown, valid = self._combine(candidates, cases, self._curve_matrix(candidates, cases, distances))
+        pruned = pairs & ~exact
+        total[pruned] = np.nan
+        for score in breakdown.values():
+            score[pruned] = np.nan
+        return self._masked((total, breakdown, valid), mask)
+    
+    def _masked(self, scores, mask):
+        """mask 之外的位置总分和明细置为 NaN"""
+        if mask is None:
+            return scores
+        total, breakdown, valid = scores
+        total[~mask] = np.nan
+        for score in breakdown.values():
+            score[~mask] = np.nan
+        return total, breakdown, valid
+    
+    def _combine(self, candidates: FeatureMatrix, cases: FeatureMatrix, curve: np.ndarray):
+        """由曲线相似度矩阵和其余各项合成四维分数与加权总分"""
+        shape = (len(candidates), len(cases))
+        total = np.zeros(shape)
+        breakdown = {}
+        
+        for dim in DIMENSIONS:
+            both = candidates.has[dim][:, None] & cases.has[dim][None, :]
+            score = np.where(both, self._dimension_matrix(dim, candidates, cases, curve), 0.5)
+            breakdown[dim] = score
+            # 与 match 中 sum() 的累加顺序一致
+            total = total + score * self.weights.get(dim, 0.25)
+        
+        valid = candidates.valid[:, None] & cases.valid[None, :]
+        return np.where(valid, total, 0.0), breakdown, valid
+    
+    def _curve_distances(self, candidates: FeatureMatrix, cases: FeatureMatrix, mask: np.ndarray, func) -> np.ndarray:
+        """mask 位置上曲线对的 DTW 距离（或下界），其余位置为 NaN"""
+        out = np.full(mask.shape, np.nan)
+        rows, cols = np.nonzero(mask)
+        if len(rows):
+            out[rows, cols] = func(candidates.curves, cases.curves, rows, cols, self.dtw_window)
+        return out
+    
+    def _curve_matrix(self, candidates: FeatureMatrix, cases: FeatureMatrix, distances: np.ndarray) -> np.ndarray:
+        """DTW 距离转换为曲线相似度（与 _calc_curve_similarity 一致）"""
+        max_len = np.maximum(candidates.curve_lengths[:, None], cases.curve_lengths[None, :])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return _clip_below(1 - distances / max_len, 0)
+    
+    def _dimension_matrix(self, dim: str, candidates: FeatureMatrix, cases: FeatureMatrix, curve: np.ndarray) -> np.ndarray:
+        """单个维度的批量相似度：逐项计算后对存在的项求平均"""
+        shape = (len(candidates), len(cases))
+        # 按 np.mean 的求和顺序（逐项依次累加）保证结果一致
+        total = np.zeros(shape)
+        count = np.zeros(shape, dtype=np.int64)
+        
+        for j, (kind, field, param) in enumerate(DIMENSION_TERMS[dim]):
+            both = candidates.present[dim][:, j][:, None] & cases.present[dim][:, j][None, :]
+            if not both.any():
+                continue
+            a = candidates.values[dim][:, j][:, None]
+            b = cases.values[dim][:, j][None, :]
+            
+            with np.errstate(invalid='ignore'):
+                if kind == 'diff':
+                    tol = self.tolerances.get(*param) if isinstance(param, tuple) else param
+                    sim = _clip_below(1 - np.abs(a - b) / tol, 0)
+                elif kind == 'slope':
+                    diff = np.abs(a - b)
+                    sim = np.where((a > 0) == (b > 0), _clip_below(1 - diff / 10, 0.7), _clip_below(0.3 - diff / 20, 0))
+                elif kind == 'equal':
+                    sim = np.where(a == b, param[0], param[1])
+                else:
+                    sim = curve
+            
+            total = np.where(both, total + sim, total)
+            count += both
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            score = total / count
+        return np.where(count > 0, score, 0.5)
+    
     def _calc_trend_similarity(self, cand: dict, case: dict) -> float:
         """知行趋势线相似度 - 基于相对百分比偏离"""
         similarities = []
@@ -222,17 +357,7 @@ class PatternMatcher:
             case_curve = np.array(case["normalized_curve"])
             
             if len(cand_curve) > 0 and len(case_curve) > 0:
-                if HAS_FASTDTW:
-                    try:
-                        distance, _ = fastdtw(cand_curve, case_curve, dist=euclidean)
-                        max_dist = max(len(cand_curve), len(case_curve))
-                        curve_sim = max(0, 1 - distance / max_dist) if max_dist > 0 else 0
-                    except:
-                        curve_sim = self._simple_dtw(cand_curve, case_curve)
-                else:
-                    curve_sim = self._simple_dtw(cand_curve, case_curve)
-                
-                similarities.append(curve_sim)
+                similarities.append(self._calc_curve_similarity(cand_curve, case_curve))
         
         # 回撤幅度相似（使用配置容差）
         if "max_drawdown" in cand and "max_drawdown" in case:
@@ -261,31 +386,8 @@ class PatternMatcher:
         
         return np.mean(similarities) if similarities else 0.5
     
-    def _simple_dtw(self, seq1: np.ndarray, seq2: np.ndarray) -> float:
-        """简化版DTW（当fastdtw不可用时使用）"""
-        n, m = len(seq1), len(seq2)
-        if n == 0 or m == 0:
-            return 0.0
-        
-        # 如果长度不同，进行线性插值到相同长度
-        if n != m:
-            target_len = max(n, m)
-            if n < target_len:
-                seq1 = np.interp(
-                    np.linspace(0, n-1, target_len),
-                    np.arange(n),
-                    seq1
-                )
-            if m < target_len:
-                seq2 = np.interp(
-                    np.linspace(0, m-1, target_len),
-                    np.arange(m),
-                    seq2
-                )
-        
-        # 计算欧氏距离
-        distance = np.sqrt(np.sum((seq1 - seq2) ** 2))
-        max_dist = np.sqrt(len(seq1))
-        
-        similarity = max(0, 1 - distance / max_dist) if max_dist > 0 else 0
-        return similarity
+    def _calc_curve_similarity(self, cand_curve: np.ndarray, case_curve: np.ndarray) -> float:
+        """归一化价格曲线相似度（带约束DTW）"""
+        distance = pairwise_dtw([cand_curve], [case_curve], [0], [0], self.dtw_window)[0]
+        max_dist = max(len(cand_curve), len(case_curve))
+        return max(0, 1 - distance / max_dist) if max_dist > 0 else 0
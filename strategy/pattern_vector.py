@@ -0,0 +1,142 @@
+"""
+B1特征矩阵 - 把特征字典编码为定宽数组，供批量相似度计算
+
+每个维度（趋势/KDJ/量能/形态）按 PatternMatcher 中逐项比较的顺序展开为若干列：
+- 数值项存原值
+- 类别项（是否在碗中、J值位置、量能趋势等）存类别编号
+- 曲线项（normalized_curve）单独保存，按序列对批量计算DTW
+同时记录每列是否存在，缺失的项不参与平均，和逐对计算的结果完全一致
+"""
+import numpy as np
+
+
+DIMENSIONS = ("trend_structure", "kdj_state", "volume_pattern", "price_shape")
+
+# 各维度的比较项，顺序与 PatternMatcher 中逐项计算的顺序一致（平均值的求和顺序依赖于此）
+# ('diff', 字段, 容差)：max(0, 1 - |差| / 容差)，容差为 (配置键, 默认值) 时从 tolerances 读取
+# ('slope', 字段, None)：斜率方向一致性
+# ('equal', 字段, (一致得分, 不一致得分))
+# ('curve', 字段, None)：曲线相似度（带约束DTW），按序列对批量计算
+DIMENSION_TERMS = {
+    "trend_structure": (
+        ('diff', 'short_vs_bullbear', ('trend_ratio', 0.10)),
+        ('slope', 'short_slope', None),
+        ('equal', 'is_in_bowl', (1.0, 0.2)),
+        ('diff', 'price_vs_short_pct', ('price_bias', 10)),
+        ('diff', 'trend_spread_pct', ('trend_spread', 10)),
+        ('diff', 'price_bias_pct', ('price_bias', 10)),
+    ),
+    "kdj_state": (
+        ('equal', 'j_position', (1.0, 0.4)),
+        ('diff', 'j_value', ('j_value', 30)),
+        ('equal', 'k_cross_d', (1.0, 0.6)),
+        ('equal', 'j_rebound', (1.0, 0.7)),
+    ),
+    "volume_pattern": (
+        ('diff', 'avg_volume_ratio', 1.5),
+        ('equal', 'shrink_then_expand', (1.0, 0.5)),
+        ('diff', 'key_candles_count', 3),
+        ('equal', 'volume_trend', (1.0, 0.6)),
+        ('diff', 'max_volume_ratio', 3),
+    ),
+    "price_shape": (
+        ('curve', 'normalized_curve', None),
+        ('diff', 'max_drawdown', ('drawdown', 15)),
+        ('diff', 'breakout_strength', 5),
+        ('equal', 'overall_trend', (1.0, 0.5)),
+        ('diff', 'consolidation_days', 10),
+    ),
+}
+
+# 缺失时按旧字段换算、总是参与比较的字段（与 PatternMatcher._calc_trend_similarity 一致）
+FIELD_FALLBACKS = {
+    'price_vs_short_pct': lambda f: f.get('price_vs_short', 0) * 100 - 100,
+    'trend_spread_pct': lambda f: f.get('trend_spread', 0),
+}
+
+# 各类别字段的已知取值（编号为下标）
+CATEGORY_VALUES = {
+    'is_in_bowl': (False, True),
+    'k_cross_d': (False, True),
+    'j_rebound': (False, True),
+    'shrink_then_expand': (False, True),
+    'j_position': ("低位", "中位", "高位"),
+    'volume_trend': ("持续放量", "持续缩量", "缩量后放量", "量能平稳", "unknown"),
+    'overall_trend': ("上升", "下降", "震荡"),
+}
+
+# 类别编号表（按字段），未见过的取值按出现顺序追加
+_CATEGORY_CODES = {field: {value: i for i, value in enumerate(values)} for field, values in CATEGORY_VALUES.items()}
+
+
+def category_code(field, value):
+    """类别取值的编号（同一字段取值相等则编号相等）"""
+    codes = _CATEGORY_CODES.setdefault(field, {})
+    if value not in codes:
+        codes[value] = len(codes)
+    return codes[value]
+
+
+class FeatureMatrix:
+    """
+    一组特征字典（PatternFeatureExtractor.extract 的结果）的定宽数组表示
+    - valid: (n,) 特征字典非空
+    - has[dim]: (n,) 该维度特征非空
+    - values[dim] / present[dim]: (n, 比较项数) 数值或类别编号 / 该项是否存在
+    - curves / curve_lengths: 每行的归一化曲线（无则为 None）及其长度（无则为0）
+    """
+    
+    def __init__(self, features_list):
+        features_list = list(features_list)
+        self.size = len(features_list)
+        self.valid = np.array([bool(f) for f in features_list], dtype=bool)
+        self.has = {}
+        self.values = {}
+        self.present = {}
+        self.curves = [None] * self.size
+        self.curve_lengths = np.zeros(self.size, dtype=np.int64)
+        
+        for dim, terms in DIMENSION_TERMS.items():
+            has = np.zeros(self.size, dtype=bool)
+            values = np.full((self.size, len(terms)), np.nan)
+            present = np.zeros((self.size, len(terms)), dtype=bool)
+            
+            for i, features in enumerate(features_list):
+                feats = features.get(dim) if features else None
+                if not feats:
+                    continue
+                has[i] = True
+                for j, (kind, field, _) in enumerate(terms):
+                    if kind == 'curve':
+                        curve = np.asarray(feats[field], dtype=float) if field in feats else None
+                        if curve is not None and len(curve) > 0:
+                            self.curves[i] = curve
+                            self.curve_lengths[i] = len(curve)
+                            present[i, j] = True
+                    elif field in feats:
+                        value = feats[field]
+                        values[i, j] = category_code(field, value) if kind == 'equal' else value
+                        present[i, j] = True
+                    elif field in FIELD_FALLBACKS:
+                        values[i, j] = FIELD_FALLBACKS[field](feats)
+                        present[i, j] = True
+            
+            self.has[dim] = has
+            self.values[dim] = values
+            self.present[dim] = present
+    
+    def __len__(self):
+        return self.size
+    
+    def take(self, index):
+        """按行下标取出子矩阵"""
+        index = np.asarray(index, dtype=np.int64)
+        sub = FeatureMatrix([])
+        sub.size = len(index)
+        sub.valid = self.valid[index]
+        sub.has = {dim: has[index] for dim, has in self.has.items()}
+        sub.values = {dim: values[index] for dim, values in self.values.items()}
+        sub.present = {dim: present[index] for dim, present in self.present.items()}
+        sub.curves = [self.curves[i] for i in index]
+        sub.curve_lengths = self.curve_lengths[index]
+        return sub
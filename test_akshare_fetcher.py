@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+数据抓取测试 - 令牌桶限速、按阶段请求计数、并发抓取，
+批量行情快照追加当日K线，以及除权、缺口超过一天时回退逐只K线抓取（不访问网络）
+
+用法:
+    python3 -m pytest test_akshare_fetcher.py
+    python3 test_akshare_fetcher.py
+"""
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher, RateLimiter, RequestCounter
+from utils.csv_manager import CSVManager
+
+
+def mock_stock(stock_code='600000', years=1):
+    """使用模拟数据生成器构造行情（不访问网络，日期取整到天）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    df = fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+    return df.assign(date=df['date'].dt.normalize())
+
+
+def test_rate_limiter_token_bucket_timing():
+    # 桶内的 burst 个令牌立即可用，之后按 rate 补充
+    limiter = RateLimiter(rate=50, burst=5)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - started < 0.05
+    for _ in range(10):
+        limiter.acquire()
+    elapsed = time.monotonic() - started
+    assert 10 / 50 * 0.9 <= elapsed < 1.0
+    
+    # 多线程共用一个桶：总请求数受同一速率限制
+    limiter = RateLimiter(rate=100, burst=1)
+    limiter.acquire()
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started >= 20 / 100 * 0.9
+    
+    # rate 为 0 时不限速
+    limiter = RateLimiter(rate=0)
+    started = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - started < 0.05
+
+
+def test_request_counter_phases():
+    counter = RequestCounter()
+    counter.record()
+    with counter.phase('K线'):
+        threads = [threading.Thread(target=lambda: [counter.record() for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with counter.phase('市值'):
+            counter.record(2)
+        counter.record()
+    assert counter.current == '其他'
+    assert counter.counts == {'其他': 1, 'K线': 401, '市值': 2}
+    counter.reset()
+    assert counter.counts == {}
+
+
+def test_fetch_concurrently_yields_every_task():
+    def fetch(code, days):
+        if code == 'bad':
+            raise ValueError('接口异常')
+        time.sleep(0.01 * (days % 3))
+        return f'{code}:{days}'
+    
+    tasks = [(f'6000{i:02d}', i) for i in range(12)] + [('bad', 0)]
+    expected = {task: None if task[0] == 'bad' else f'{task[0]}:{task[1]}' for task in tasks}
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    # 串行按任务顺序产出，并发按完成顺序产出；抓取异常的任务结果为 None
+    fetcher.workers = 1
+    assert list(fetcher._fetch_concurrently(tasks, fetch)) == list(expected.items())
+    fetcher.workers = 4
+    results = list(fetcher._fetch_concurrently(tasks, fetch))
+    assert len(results) == len(tasks) and dict(results) == expected
+
+
+def test_fetchers_keep_their_own_rate_limiter():
+    with tempfile.TemporaryDirectory() as tmp:
+        first = AKShareFetcher(tmp, workers=2, rate=5)
+        limiter = first.rate_limiter
+        second = AKShareFetcher(tmp, workers=4, rate=50)
+        assert first.rate_limiter is limiter and limiter.rate == 5
+        assert second.rate_limiter is not limiter and second.rate_limiter.rate == 50
+        assert first.session is not second.session
+
+
+def offline_fetcher(data_dir, trade_days, quote_bars):
+    """只替换交易日历和行情快照两个网络接口的抓取器，记录请求行情的股票"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    fetcher.csv_manager = CSVManager(data_dir)
+    fetcher.workers = 1
+    fetcher.quote_requests = []
+    fetcher._fetch_trade_days = lambda days=10: trade_days
+    
+    def fetch_quotes(stock_codes):
+        fetcher.quote_requests.append(list(stock_codes))
+        return {code: quote_bars[code] for code in stock_codes if code in quote_bars}
+    fetcher._fetch_quote_bars_tencent = fetch_quotes
+    return fetcher
+
+
+def quote(date, prev_close, close=10.5):
+    return {'date': date, 'open': 10.0, 'close': close, 'high': 11.0, 'low': 9.8, 'volume': 123456,
+            'prev_close': prev_close, 'market_cap': 5e9}
+
+
+def test_update_from_quotes_appends_or_falls_back():
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = {code: mock_stock(code) for code in ['600000', '600001', '600002', '600003']}
+        # 600002 缺最近两个交易日
+        frames['600002'] = frames['600002'].iloc[1:]
+        prev_day = frames['600000']['date'].iloc[0]
+        last_day = prev_day + pd.offsets.BDay(1)
+        trade_days = [prev_day - pd.offsets.BDay(1), prev_day, last_day]
+        
+        writer = CSVManager(tmp)
+        for code, df in frames.items():
+            writer.write_stock(code, df)
+        latest_close = {code: df['close'].iloc[0] for code, df in frames.items()}
+        quote_bars = {
+            # 昨收与本地最新收盘价一致（误差在0.005以内）：直接追加
+            '600000': quote(last_day, latest_close['600000'] + 0.004),
+            # 昨收不一致（除权除息）：回退
+            '600001': quote(last_day, latest_close['600001'] * 0.9),
+            '600002': quote(last_day, latest_close['600002']),
+            # 600003 行情中没有成交：停牌
+        }
+        
+        fetcher = offline_fetcher(tmp, trade_days, quote_bars)
+        stocks_to_update = [(code, 3) for code in frames]
+        latest_info = {code: fetcher.csv_manager.get_latest(code) for code in frames}
+        appended, suspended, fallback = fetcher._update_from_quotes(stocks_to_update, latest_info, {'600000': 6e9})
+        
+        assert (appended, suspended) == (1, 1)
+        assert fallback == [('600001', 3), ('600002', 3)]
+        # 缺口超过一天的股票不请求行情快照
+        assert fetcher.quote_requests == [['600000', '600001', '600003']]
+        
+        # 追加一根当日K线，市值优先用批量获取的值
+        result = fetcher.csv_manager.read_stock('600000')
+        assert len(result) == len(frames['600000']) + 1
+        assert result['date'].iloc[0] == last_day and result['close'].iloc[0] == 10.5
+        assert result['market_cap'].iloc[0] == 6e9
+        assert fetcher.csv_manager.get_latest('600000') == (last_day.date(), 10.5)
+        # 回退和停牌的股票文件不变
+        for code in ['600001', '600002', '600003']:
+            assert len(fetcher.csv_manager.read_stock(code)) == len(frames[code])
+
+
+def test_update_from_quotes_without_trade_days_falls_back():
+    with tempfile.TemporaryDirectory() as tmp:
+        fetcher = offline_fetcher(tmp, [], {})
+        stocks_to_update = [('600000', 3), ('600001', 5)]
+        assert fetcher._update_from_quotes(stocks_to_update, {}, {}) == (0, 0, stocks_to_update)
+        assert fetcher.quote_requests == []
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
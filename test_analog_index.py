@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+历史相似走势检索测试 - FFT 距离剖面与暴力搜索对比，索引缓存的加载与失效
+
+用法:
+    python3 -m pytest test_analog_index.py
+    python3 test_analog_index.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.analog_index import AnalogIndex, znormalize
+from strategy.pattern_feature_extractor import normalize_curve
+from test_technical import mock_panel, panel_view
+
+
+def test_analog_index_matches_brute_force():
+    codes = ['600000', '000001', '300750']
+    frames, raw = mock_panel(codes)
+    dates = sorted(set().union(*(set(df['date']) for df in frames.values())))
+    panel = panel_view(codes, raw, dates)
+    window = 20
+    index = AnalogIndex(panel, window=window, horizons=(1, 5))
+    # 逐只股票展开全部窗口（时间正序，停牌日不计）
+    series = {code: df.iloc[::-1].reset_index(drop=True) for code, df in frames.items()}
+    
+    query_df = series['000001'].iloc[100:100 + window]
+    total, _, _ = index.distances(query_df['close'].values, query_df['volume'].values)
+    query = np.concatenate([znormalize(normalize_curve(query_df[field].values)) for field in ('close', 'volume')])
+    brute = []
+    for col, code in enumerate(codes):
+        df = series[code]
+        offset = index.n_windows - (len(df) - window + 1)
+        assert np.isinf(total[col, :offset]).all()
+        for start in range(len(df) - window + 1):
+            curve = df.iloc[start:start + window]
+            vector = np.concatenate([znormalize(normalize_curve(curve[field].values)) for field in ('close', 'volume')])
+            distance = np.sqrt(((vector - query) ** 2).sum())
+            assert np.isclose(total[col, offset + start], distance, atol=1e-6)
+            brute.append((distance, col, start))
+    
+    # 查询自身时排除自身附近的窗口，结果与暴力搜索的最近邻一致
+    table = index.query_stock('000001', end_date=str(query_df['date'].iloc[-1])[:10], k=3)
+    assert len(table) == 3 and table['distance'].is_monotonic_increasing
+    distance, col, start = min(item for item in brute if not (item[1] == 1 and abs(item[2] - 100) < window))
+    df = series[codes[col]]
+    end = start + window - 1
+    assert table['stock_code'].iloc[0] == codes[col]
+    assert table['end_date'].iloc[0] == str(df['date'].iloc[end])[:10]
+    assert np.isclose(table['distance'].iloc[0], distance)
+    if end + 5 < len(df):
+        assert np.isclose(table['return_5d'].iloc[0], (df['close'].iloc[end + 5] / df['close'].iloc[end] - 1) * 100)
+    
+    # 缓存：第二次按内存映射加载，检索结果与重建一致；面板版本变化后重建
+    with tempfile.TemporaryDirectory() as tmp:
+        built = AnalogIndex(panel, window=window, horizons=(1, 5), cache_dir=tmp)
+        loaded = AnalogIndex(panel, window=window, horizons=(1, 5), cache_dir=tmp)
+        assert not built.cached and loaded.cached and loaded.codes == codes
+        end_date = str(query_df['date'].iloc[-1])[:10]
+        assert loaded.query_stock('000001', end_date=end_date, k=3).equals(table)
+        assert built.query_stock('000001', end_date=end_date, k=3).equals(table)
+        panel.version = 1
+        assert not AnalogIndex(panel, window=window, horizons=(1, 5), cache_dir=tmp).cached
+        assert AnalogIndex(panel, window=window, horizons=(1, 5), cache_dir=tmp).cached
+        assert not AnalogIndex(panel, ['600000', '000001'], window=window, horizons=(1, 5), cache_dir=tmp).cached
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+历史信号回测测试 - 持有期收益和回撤，参数搜索的指标复用，滚动前推的窗口切分与参数选择
+
+用法:
+    python3 -m pytest test_backtest.py
+    python3 test_backtest.py
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.backtest import forward_returns, load_raw
+from utils.param_sweep import SweepContext, expand_grid, walk_forward_select, walk_forward_windows
+from strategy.bowl_rebound import BowlReboundStrategy
+from test_technical import mock_panel, panel_view
+
+
+def test_forward_returns_and_drawdown():
+    close = np.array([[np.nan], [10.0], [11.0], [9.0], [12.0]])
+    low = np.array([[np.nan], [9.5], [10.0], [8.0], [11.5]])
+    returns = forward_returns(close, low, horizons=(1, 3))
+    ret, drawdown = returns[1]
+    assert np.allclose(ret[1:4, 0], [0.1, 9 / 11 - 1, 12 / 9 - 1])
+    assert np.allclose(drawdown[1:4, 0], [0.0, 8 / 11 - 1, 0.0])
+    assert np.isnan(ret[4, 0]) and np.isnan(drawdown[4, 0])
+    ret, drawdown = returns[3]
+    assert np.isclose(ret[1, 0], 0.2) and np.isclose(drawdown[1, 0], -0.2)
+    assert np.isnan(ret[2:, 0]).all()
+
+
+def test_sweep_reuses_indicators_across_signal_params():
+    codes = ['600000', '000001', '300750']
+    _, raw = mock_panel(codes)
+    panel = panel_view(codes, raw)
+    param_sets = expand_grid({'N': [1.5, 3], 'J_VAL': [20, 60], 'M1': [14, 10]})
+    assert len(param_sets) == 8
+    assert len(expand_grid({'N': [1.5, 3], 'J_VAL': [20, 60]}, samples=3, seed=1)) == 3
+    
+    context = SweepContext(panel, BowlReboundStrategy, {}, horizons=(1, 5))
+    param_sets = sorted(param_sets, key=lambda params: params['M1'])
+    rows = [context.evaluate(params) for params in param_sets]
+    # 趋势线和KDJ只按均线参数计算两次
+    assert context.indicator_builds == 2
+    for params, row in zip(param_sets, rows):
+        strategy = BowlReboundStrategy(params)
+        signal, _ = strategy.history_signals(strategy.history_indicators(raw, codes))
+        assert row['signals'] == signal.sum()
+    # 全部股票直接使用面板数组（不复制），部分股票才按列复制；原始行情不随评估环境常驻
+    assert not hasattr(context, 'raw')
+    assert np.shares_memory(load_raw(panel)[1]['close'], raw['close'])
+    subset_codes, subset = load_raw(panel, ['300750', '600000'])
+    assert subset_codes == ['300750', '600000'] and not np.shares_memory(subset['close'], raw['close'])
+    assert np.array_equal(subset['close'], raw['close'][:, [2, 0]], equal_nan=True)
+
+
+def test_walk_forward_windows_and_selection():
+    dates = [str(day) for day in np.arange(30).astype('datetime64[D]')]
+    windows = walk_forward_windows(dates, in_sample=12, out_of_sample=6, gap=2)
+    assert [w['in_sample'] for w in windows] == [(dates[0], dates[9]), (dates[6], dates[15]), (dates[12], dates[21])]
+    assert [w['out_of_sample'] for w in windows] == [(dates[12], dates[17]), (dates[18], dates[23]), (dates[24], dates[29])]
+    
+    codes = ['600000', '000001', '300750']
+    _, raw = mock_panel(codes)
+    panel = panel_view(codes, raw)
+    panel_dates = panel.date_values()
+    context = SweepContext(panel, BowlReboundStrategy, {}, horizons=(1, 5))
+    params = {'N': 1.5, 'J_VAL': 60}
+    # 整段区间上的切分结果与直接评估一致
+    full = context.evaluate_windows(params, [(None, None)])['windows'][0]
+    expected = context.evaluate(params)
+    assert full['signals'] == expected['signals']
+    assert np.isclose(full['mean_return_5'], expected['mean_return_5'], equal_nan=True)
+    
+    windows = walk_forward_windows([str(day) for day in panel_dates], in_sample=200, out_of_sample=100, gap=5)
+    ranges = [r for window in windows for r in (window['in_sample'], window['out_of_sample'])]
+    rows = [context.evaluate_windows(p, ranges) for p in expand_grid({'N': [1.5, 3], 'J_VAL': [30, 60]})]
+    table, combined = walk_forward_select(rows, windows, horizon=5)
+    assert len(windows) == 6 and len(table) == len(windows)
+    # 每个窗口选出的是样本内指标最大的参数组，样本外结果取自同一参数组
+    for i, record in enumerate(table.to_dict('records')):
+        scored = [row['windows'][2 * i]['mean_return_5'] for row in rows]
+        chosen = next(row for row in rows if row['params'] == record['params'])
+        assert record['is_mean_return_5'] == np.nanmax(scored) == chosen['windows'][2 * i]['mean_return_5']
+        assert record['oos_signals_5'] == chosen['windows'][2 * i + 1]['signals_5']
+    assert combined['signals_5'] == table['oos_signals_5'].sum() > 0
+    
+    # 样本内无收益（NaN）的参数组不参与，信号数不足 min_signals 的参数组让位于信号足够的参数组
+    window = {'in_sample': ('a', 'b'), 'out_of_sample': ('c', 'd')}
+    def result(signals, mean_return):
+        return {'signals': signals, 'signals_5': signals, 'mean_return_5': mean_return,
+                'hit_rate_5': 0.5, 'mean_drawdown_5': -1.0}
+    rows = [
+        {'params': {'N': 1}, 'windows': [result(0, np.nan), result(5, 9.0)]},
+        {'params': {'N': 2}, 'windows': [result(3, 4.0), result(5, 1.0)]},
+        {'params': {'N': 3}, 'windows': [result(30, 2.0), result(5, -1.0)]},
+    ]
+    assert walk_forward_select(rows, [window], horizon=5)[0]['params'].tolist() == [{'N': 2}]
+    assert walk_forward_select(rows, [window], horizon=5, min_signals=10)[0]['params'].tolist() == [{'N': 3}]
+    # 都不满足 min_signals 时放宽
+    assert walk_forward_select(rows, [window], horizon=5, min_signals=100)[0]['params'].tolist() == [{'N': 2}]
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+碗口反弹策略测试 - 全市场历史信号与逐日截断选股对比，尾部预热窗口与全量历史对比，
+逐行市值检查，分阶段选股与完整计算对比
+
+用法:
+    python3 -m pytest test_bowl_rebound.py
+    python3 test_bowl_rebound.py
+"""
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from strategy.bowl_rebound import CATEGORIES, STAGES, BowlReboundStrategy
+from utils.market_cap_snapshot import MarketCapSnapshot, set_default_data_dir
+from test_technical import TOLERANCE, mock_panel, mock_stock
+
+
+def test_history_signals_match_per_date_selection():
+    codes = ['600000', '000001', '300750', '688981']
+    frames, panel = mock_panel(codes)
+    for strategy in [BowlReboundStrategy(), BowlReboundStrategy({'N': 1.5, 'J_VAL': 60, 'M': 20})]:
+        data = strategy.history_indicators(panel, codes)
+        signal, category = strategy.history_signals(data)
+        n_rows = signal.shape[0]
+        for col, code in enumerate(codes):
+            df = frames[code]
+            # 倒序数据（最新在前），逐日截断后选股
+            for bars in range(60, len(df) + 1, 9):
+                expected = strategy.select_stocks(strategy.calculate_indicators(df.iloc[len(df) - bars:].reset_index(drop=True)))
+                row = n_rows - len(df) + bars - 1
+                assert bool(signal[row, col]) == bool(expected)
+                if expected:
+                    assert CATEGORIES[category[row, col]] == expected[0]['category']
+
+
+def test_tail_window_matches_full_history():
+    strategy = BowlReboundStrategy()
+    columns = ['short_term_trend', 'bull_bear_line', 'K', 'D', 'J', 'vol_ratio']
+    for code in ['600000', '000001', '300750']:
+        df = mock_stock(code)
+        tail = df.head(strategy.warmup_bars)
+        full_result = strategy.calculate_indicators(df)
+        tail_result = strategy.calculate_indicators(tail)
+        # 选股用到的最近 max(M, 30) 行都必须与全量历史一致
+        rows = max(strategy.params['M'], 30)
+        assert np.allclose(tail_result[columns].head(rows).to_numpy(dtype=float),
+                           full_result[columns].head(rows).to_numpy(dtype=float),
+                           rtol=0, atol=TOLERANCE)
+        assert strategy.select_stocks(tail_result) == strategy.select_stocks(full_result)
+
+
+def test_market_cap_check_does_not_depend_on_history_length():
+    strategy = BowlReboundStrategy()
+    columns = ['market_cap_ok', 'key_candle', 'abnormal']
+    rows = max(strategy.params['M'], 30)
+    for code in ['600000', '000001']:
+        df = mock_stock(code)
+        # 最新K线的市值缺失（批量更新留空），尾部窗口之外的最早几行是亿元单位
+        market_cap = df['market_cap'].to_numpy(dtype=float).copy()
+        market_cap[:rows // 2] = np.nan
+        market_cap[strategy.warmup_bars:] = 50.0
+        df['market_cap'] = market_cap
+        df.attrs['code'] = code
+        tail = df.head(strategy.warmup_bars)
+        tail.attrs['code'] = code
+        full_result = strategy.calculate_indicators(df)
+        tail_result = strategy.calculate_indicators(tail)
+        assert full_result[columns].head(rows).equals(tail_result[columns].head(rows))
+        # 信号中的市值为 NaN（NaN 不等于自身），按 repr 比较
+        assert repr(strategy.select_stocks(tail_result)) == repr(strategy.select_stocks(full_result))
+
+
+def test_market_cap_check_is_per_row():
+    # 每行单独判断：单位合理（10亿~1000亿元）的行直接与 CAP 比较，缺失或单位异常的行查市值快照，
+    # 快照中没有该股票时不过滤；不再由一个样本决定整只股票
+    strategy = BowlReboundStrategy()
+    cap = strategy.params['CAP']
+    market_cap = np.array([cap * 2, cap / 2, np.nan, 50.0, cap * 3])
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = MarketCapSnapshot(tmp)
+        snapshot.caps, snapshot.updated_at = {'600000': cap * 2, '000001': cap / 2}, datetime.now()
+        snapshot.save()
+        set_default_data_dir(tmp)
+        try:
+            df = mock_stock('600000').head(len(market_cap)).assign(market_cap=market_cap)
+            for code, snapshot_ok in [('600000', True), ('000001', False), ('300750', True)]:
+                df.attrs['code'] = code
+                expected = [True, False, snapshot_ok, snapshot_ok, True]
+                assert strategy._check_market_cap_realtime(df).tolist() == expected
+        finally:
+            set_default_data_dir('data')
+
+
+def test_staged_selection_matches_full_calculation():
+    # 放宽参数让部分股票走到完整条件阶段
+    strategies = [BowlReboundStrategy(), BowlReboundStrategy({'N': 1.2, 'J_VAL': 100, 'M': 30})]
+    for code in ['600000', '000001', '300750', '600519', '002594']:
+        df = mock_stock(code)
+        for days in range(0, 200, 20):
+            window = df.iloc[days:days + 400].reset_index(drop=True)
+            for strategy in strategies:
+                stage, signal_list, data = strategy.select_stocks_staged(window)
+                expected = strategy.select_stocks(strategy.calculate_indicators(window))
+                assert signal_list == expected
+                assert (stage is None) == bool(expected) and (stage is None or stage in STAGES)
+                assert data is None or stage in (None, STAGES[-1])
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+数据存储测试 - 行顺序原地转换中断后的读取与尾部追加，合并新数据的新增行数与清单中的最新行情，
+股票清单的重建（过期、删除、新增文件）、其他进程写入后的重新加载与多进程保存合并，
+Feather 列式存储的读写追加与 CSV → Feather 迁移
+
+用法:
+    python3 -m pytest test_csv_manager.py
+    python3 test_csv_manager.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.csv_manager import (
+    HAS_PYARROW, MIXED_ORDER, STORAGE_MARKER_FILE, STORAGE_ORDER_FILE,
+    CSVManager, FeatherManager, get_storage_manager, migrate_storage
+)
+from utils.stock_manifest import StockManifest
+
+
+def mock_stock(stock_code='600000', years=1):
+    """使用模拟数据生成器构造行情（不访问网络，日期取整到天）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    df = fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+    return df.assign(date=df['date'].dt.normalize())
+
+
+def test_interrupted_order_migration_reads_latest_first():
+    with tempfile.TemporaryDirectory() as tmp:
+        # 旧的倒序目录，原地转换为正序时中断：部分文件已是正序
+        legacy = CSVManager(tmp, order='desc')
+        frames = {code: mock_stock(code) for code in ['600000', '600001', '000001']}
+        for code, df in frames.items():
+            legacy.write_stock(code, df)
+        (Path(tmp) / STORAGE_ORDER_FILE).write_text(MIXED_ORDER, encoding='utf-8')
+        CSVManager(tmp, order='asc').write_stock('600000', frames['600000'])
+        
+        manager = get_storage_manager(tmp)
+        assert manager.order == MIXED_ORDER
+        for code, df in frames.items():
+            assert manager.read_stock(code)['date'].tolist() == df['date'].tolist()
+            assert manager.read_latest(code, 3)['date'].tolist() == df['date'].head(3).tolist()
+        
+        # 重新执行迁移完成转换，之后的尾部追加与整体重写结果一致
+        assert migrate_storage(tmp, target='csv', order='asc') == (3, 0)
+        manager = get_storage_manager(tmp)
+        assert manager.order == 'asc'
+        df = frames['600001']
+        manager.update_stock('600001', df.head(5).assign(close=df['close'].head(5) + 1))
+        expected = pd.concat([df.iloc[5:], df.head(5).assign(close=df['close'].head(5) + 1)])
+        result = manager.read_stock('600001')
+        assert result['date'].tolist() == df['date'].tolist()
+        assert np.allclose(result['close'], expected.sort_values('date', ascending=False)['close'])
+        assert not list(Path(tmp).rglob('*.tmp'))
+
+
+
+def test_merge_stock_counts_added_rows_and_keeps_latest_current():
+    df = mock_stock('600000')
+    for order in ('asc', 'desc'):
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = CSVManager(tmp, order=order)
+            manager.write_stock('600000', df.iloc[5:])
+            expected = df.iloc[5:]
+            # 与尾部重叠的3行（收盘价改写）+ 2行新数据；只有新数据 3 行；重叠远超尾部窗口的改写
+            merges = [
+                (df.iloc[3:8].assign(close=df['close'].iloc[3:8] + 1), 2),
+                (df.iloc[:3], 3),
+                (df.iloc[100:103].assign(close=df['close'].iloc[100:103] * 2), 0),
+            ]
+            for new_df, added in merges:
+                path, result = manager.merge_stock('600000', new_df)
+                assert path == manager.get_stock_path('600000') and result == added
+                expected = pd.concat([expected, new_df]).drop_duplicates('date', keep='last').sort_values('date', ascending=False)
+                
+                full = manager.read_stock('600000')
+                assert full['date'].tolist() == expected['date'].tolist()
+                assert np.allclose(full['close'], expected['close'])
+                # 清单中的最新行情与重新读取整个文件一致
+                latest_date, latest_close = manager.get_latest('600000')
+                assert latest_date == full['date'].iloc[0].date() and np.isclose(latest_close, full['close'].iloc[0])
+                assert manager.manifest.get('600000')['rows'] == len(full)
+                assert CSVManager(tmp, order=order).read_latest('600000', 1)['date'].iloc[0].date() == latest_date
+
+
+def test_rebuild_manifest_rescans_stale_and_drops_deleted_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = CSVManager(tmp)
+        frames = {code: mock_stock(code) for code in ['600000', '600001', '600002']}
+        for code, df in frames.items():
+            manager.write_stock(code, df)
+        manager.save_manifest()
+        
+        # 清单之外的改动：另一个管理器改写、新增文件但不保存清单，再删除一个文件
+        other = CSVManager(tmp)
+        other.write_stock('600001', frames['600001'].iloc[10:])
+        other.write_stock('000001', mock_stock('000001'))
+        manager.get_stock_path('600002').unlink()
+        
+        # 清单未变化时仍按旧记录返回
+        assert manager.list_all_stocks() == ['600000', '600001', '600002']
+        assert manager.rebuild_manifest() == {'unchanged': 1, 'scanned': 2, 'removed': 1}
+        assert manager.list_all_stocks() == ['000001', '600000', '600001']
+        for code in manager.list_all_stocks():
+            df = manager.read_stock(code)
+            entry = manager.manifest.get(code)
+            assert entry['rows'] == len(df)
+            latest_date, latest_close = manager.get_latest(code)
+            assert latest_date == df['date'].iloc[0].date() and np.isclose(latest_close, df['close'].iloc[0])
+        
+        # 保存后重新加载得到同一份清单
+        reloaded = StockManifest(tmp).load()
+        assert reloaded.complete and reloaded.entries == manager.manifest.entries
+
+
+def test_manifest_reloads_and_merges_concurrent_writers():
+    with tempfile.TemporaryDirectory() as tmp:
+        first = CSVManager(tmp)
+        for code in ['600000', '600001']:
+            first.write_stock(code, mock_stock(code))
+        first.save_manifest()
+        
+        # 两个进程加载同一份清单后各自写入、删除不同的股票
+        second, third = CSVManager(tmp), CSVManager(tmp)
+        second.write_stock('000001', mock_stock('000001'))
+        second.save_manifest()
+        third.write_stock('000002', mock_stock('000002'))
+        third.get_stock_path('600001').unlink()
+        third.manifest.remove('600001')
+        third.save_manifest()
+        
+        # 后保存者合并磁盘上的清单，不丢掉先保存者的记录
+        assert StockManifest(tmp).load().codes() == ['000001', '000002', '600000']
+        
+        # 没有未保存改动的进程在列出股票前重新加载
+        assert first.list_all_stocks() == ['000001', '000002', '600000']
+        assert first.get_latest('000001') == second.get_latest('000001')
+
+
+
+def test_feather_round_trip_and_append():
+    if not HAS_PYARROW:
+        print("  pyarrow 未安装，跳过")
+        return
+    df = mock_stock('600000')
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = FeatherManager(tmp)
+        manager.write_stock('600000', df.iloc[3:])
+        assert manager.get_stock_path('600000').suffix == '.feather'
+        
+        result = manager.read_stock('600000')
+        assert result['date'].tolist() == df['date'].iloc[3:].tolist()
+        for column in ['open', 'high', 'low', 'close', 'volume']:
+            assert np.allclose(result[column], df[column].iloc[3:])
+        assert result['volume'].dtype == np.int64 and result.attrs['code'] == '600000'
+        assert manager.read_latest('600000', 5)['date'].tolist() == df['date'].iloc[3:8].tolist()
+        
+        # 追加（重叠1行 + 新增3行）整体重写
+        path, added = manager.merge_stock('600000', df.iloc[:4].assign(close=df['close'].iloc[:4] + 1))
+        assert added == 3
+        result = FeatherManager(tmp).read_stock('600000')
+        assert result['date'].tolist() == df['date'].tolist()
+        assert np.allclose(result['close'].iloc[:4], df['close'].iloc[:4] + 1)
+        assert np.allclose(result['close'].iloc[4:], df['close'].iloc[4:])
+        assert manager.get_latest('600000') == (df['date'].iloc[0].date(), result['close'].iloc[0])
+        assert manager.manifest.get('600000')['rows'] == len(df)
+
+
+def test_migrate_csv_to_feather_switches_marker_and_removes_source():
+    if not HAS_PYARROW:
+        print("  pyarrow 未安装，跳过")
+        return
+    frames = {code: mock_stock(code) for code in ['600000', '600001', '000001']}
+    for remove_source in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = CSVManager(tmp)
+            for code, df in frames.items():
+                source.write_stock(code, df)
+            source.save_manifest()
+            
+            assert migrate_storage(tmp, target='feather', remove_source=remove_source) == (3, 0)
+            assert (Path(tmp) / STORAGE_MARKER_FILE).read_text(encoding='utf-8') == 'feather'
+            assert (Path(tmp) / STORAGE_ORDER_FILE).read_text(encoding='utf-8') == 'asc'
+            assert len(list(Path(tmp).rglob('*.csv'))) == (0 if remove_source else 3)
+            assert len(list(Path(tmp).rglob('*.feather'))) == 3
+            
+            manager = get_storage_manager(tmp)
+            assert isinstance(manager, FeatherManager)
+            assert manager.list_all_stocks() == sorted(frames)
+            for code, df in frames.items():
+                result = manager.read_stock(code)
+                assert result['date'].tolist() == df['date'].tolist()
+                assert np.allclose(result['close'], df['close'])
+            # 再次执行无需迁移
+            assert migrate_storage(tmp, target='feather') == (0, 0)
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
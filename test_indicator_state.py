@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+流式指标状态测试 - 逐根递推结果与全量计算对比
+
+用法:
+    python3 -m pytest test_indicator_state.py
+    python3 test_indicator_state.py
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.indicator_state import StreamingIndicators
+from strategy.bowl_rebound import BowlReboundStrategy
+
+
+TOLERANCE = 1e-9
+
+
+def mock_stock(stock_code='600000', years=3):
+    """使用模拟数据生成器构造行情（不访问网络）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    df = fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+    df['date'] = df['date'].dt.normalize()
+    return df
+
+
+def test_streaming_update_matches_full_calculation():
+    strategy = BowlReboundStrategy()
+    ma_periods = (strategy.params['M1'], strategy.params['M2'], strategy.params['M3'], strategy.params['M4'])
+    for code in ['600000', '000001', '300750']:
+        df = mock_stock(code)
+        # 用前面的历史建立状态，再逐根送入最新20根K线
+        state = StreamingIndicators.from_history(df.iloc[20:], ma_periods, strategy.params['M'])
+        for i in range(19, -1, -1):
+            state.update(df.iloc[i])
+        
+        expected = strategy.calculate_indicators(df).iloc[0]
+        assert state.count == len(df)
+        assert abs(state.short_term_trend - expected['short_term_trend']) < TOLERANCE
+        assert abs(state.bull_bear_line - expected['bull_bear_line']) < TOLERANCE
+        assert abs(state.j - expected['J']) < TOLERANCE
+        
+        rebuilt = StreamingIndicators.from_history(df, ma_periods, strategy.params['M'])
+        assert np.allclose(rebuilt.recent_j, state.recent_j, rtol=0, atol=TOLERANCE)
+        assert [bar[0] for bar in rebuilt.recent_bars] == [bar[0] for bar in state.recent_bars]
+
+
+def test_state_json_round_trip():
+    df = mock_stock('002594', years=1)
+    state = StreamingIndicators.from_history(df, lookback=15)
+    restored = StreamingIndicators.from_dict(json.loads(json.dumps(state.to_dict())), lookback=15)
+    assert restored.to_dict() == json.loads(json.dumps(state.to_dict()))
+    assert restored.bull_bear_line == state.bull_bear_line
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+市值快照测试 - 按数据目录区分的快照缓存，快照文件更新后重新加载，按来源换算市值单位
+
+用法:
+    python3 -m pytest test_market_cap_snapshot.py
+    python3 test_market_cap_snapshot.py
+"""
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.market_cap_snapshot import MarketCapSnapshot, get_market_cap_snapshot, normalize_market_cap, set_default_data_dir
+
+
+def test_market_cap_snapshot_is_keyed_by_data_dir():
+    with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+        for data_dir, cap in [(first, 5e9), (second, 8e10)]:
+            snapshot = MarketCapSnapshot(data_dir)
+            snapshot.caps, snapshot.updated_at = {'600000': cap}, pd.Timestamp.now().to_pydatetime()
+            snapshot.save()
+        assert get_market_cap_snapshot(first).get('600000') == 5e9
+        assert get_market_cap_snapshot(second).get('600000') == 8e10
+        try:
+            set_default_data_dir(second)
+            assert get_market_cap_snapshot() is get_market_cap_snapshot(second)
+        finally:
+            set_default_data_dir('data')
+    # 按来源的单位换算为元：akshare 实时行情为元（小于100亿元的市值也不再被当作亿元），腾讯为亿元
+    assert normalize_market_cap(5e9, 'akshare') == 5e9 and normalize_market_cap(3.5e10, 'akshare') == 3.5e10
+    assert normalize_market_cap(350.5, 'tencent') == 350.5e8
+
+
+def test_market_cap_snapshot_reloads_when_file_changes():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = MarketCapSnapshot(tmp)
+        writer.caps, writer.updated_at = {'600000': 5e9}, pd.Timestamp.now().to_pydatetime()
+        writer.save()
+        cached = get_market_cap_snapshot(tmp)
+        assert cached.get('600000') == 5e9
+        
+        # 其他进程（数据更新）写入新快照：修改时间变化后重新加载，同一对象原地更新
+        writer.caps = {'600000': 6e9, '600001': 7e9}
+        writer.save()
+        stat = os.stat(writer.snapshot_file)
+        os.utime(writer.snapshot_file, ns=(stat.st_atime_ns, cached.mtime + 10 ** 9))
+        assert get_market_cap_snapshot(tmp) is cached
+        assert cached.get('600000') == 6e9 and cached.get('600001') == 7e9
+        
+        # 旧版本快照（市值单位按数值猜测）不再加载，视为没有快照
+        with open(writer.snapshot_file, 'w', encoding='utf-8') as f:
+            json.dump({'updated_at': '2024-01-02 15:00:00', 'source': 'akshare', 'caps': {'600000': 5e17}}, f)
+        os.utime(writer.snapshot_file, ns=(stat.st_atime_ns, cached.mtime + 10 ** 9))
+        assert get_market_cap_snapshot(tmp).get('600000') is None and not cached.is_fresh()
+        
+        # 快照文件被删除后为空快照
+        os.remove(writer.snapshot_file)
+        assert get_market_cap_snapshot(tmp).get('600000') is None
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+行情面板测试 - 增量刷新只读取有改动的股票，改写历史时切换新版本，股票移出清单时重建
+
+用法:
+    python3 -m pytest test_market_panel.py
+    python3 test_market_panel.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.csv_manager import CSVManager
+from utils.market_panel import MarketPanel, load_market_panel
+
+
+def mock_stock(stock_code='600000', years=1):
+    """使用模拟数据生成器构造行情（不访问网络，日期取整到天）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    df = fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+    return df.assign(date=df['date'].dt.normalize())
+
+
+def test_panel_update_reads_only_changed_stocks():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = CSVManager(tmp)
+        frames = {code: mock_stock(code) for code in ['600000', '600001', '000001']}
+        for code, df in frames.items():
+            manager.write_stock(code, df.iloc[2:])
+        manager.save_manifest()
+        MarketPanel(tmp).build(manager)
+        reader = load_market_panel(tmp)
+        
+        full_reads = []
+        read_stock = manager.read_stock
+        manager.read_stock = lambda code: full_reads.append(code) or read_stock(code)
+        
+        # 两只股票追加新K线：只读取尾部，新交易日写入预留行，已打开的读者看不到
+        for code in ['600000', '000001']:
+            manager.update_stock(code, frames[code].head(2))
+        manager.save_manifest()
+        panel = MarketPanel(tmp).update(manager)
+        assert full_reads == [] and panel.version == reader.version
+        assert panel.n_dates == reader.n_dates + 2
+        assert np.isnan(panel.field('close')[-2:, panel.code_index['600001']]).all()
+        for code in ['600000', '000001']:
+            assert np.allclose(panel.get_stock(code)['close'], frames[code]['close'])
+        
+        # 前复权改写历史：重新读取该股票，写入新版本，旧版本的读者数据不变
+        before = reader.field('close').copy()
+        adjusted = frames['600000'].assign(close=frames['600000']['close'] * 0.9)
+        manager.write_stock('600000', adjusted)
+        manager.save_manifest()
+        panel = MarketPanel(tmp).update(manager)
+        assert full_reads == ['600000'] and panel.version == reader.version + 1
+        assert np.array_equal(reader.field('close'), before, equal_nan=True)
+        assert np.allclose(panel.get_stock('600000')['close'], adjusted['close'])
+        assert np.allclose(panel.get_stock('000001')['close'], frames['000001']['close'])
+
+
+
+def test_panel_update_drops_stocks_removed_from_manifest():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = CSVManager(tmp)
+        frames = {code: mock_stock(code) for code in ['600000', '600001', '000001']}
+        for code, df in frames.items():
+            manager.write_stock(code, df)
+        manager.save_manifest()
+        reader = MarketPanel(tmp).build(manager)
+        
+        # 退市删除数据：股票移出清单后重建面板，不再保留过期的列
+        manager.get_stock_path('600001').unlink()
+        manager.manifest.remove('600001')
+        manager.save_manifest()
+        panel = MarketPanel(tmp).update(manager)
+        assert panel.codes == ['000001', '600000'] and panel.version == reader.version + 1
+        assert panel.get_stock('600001').empty
+        assert np.allclose(panel.get_stock('600000')['close'], frames['600000']['close'])
+        # 已打开旧版本的读者不受影响
+        assert np.allclose(reader.get_stock('600001')['close'], frames['600001']['close'])
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+逐只选股测试 - 只按名称和股票清单预筛选，单只股票选股的过滤原因，进程池与串行选股结果和顺序一致
+
+用法:
+    python3 -m pytest test_parallel_select.py
+    python3 test_parallel_select.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.csv_manager import CSVManager, get_storage_manager
+from utils.market_cap_snapshot import set_default_data_dir
+from utils.parallel_select import ParallelScreener, prescreen, screen_stock, strategy_prefilter
+from utils.select_pipeline import SelectPipeline
+from strategy.bowl_rebound import BowlReboundStrategy
+
+
+def mock_stock(stock_code='600000', years=6):
+    """使用模拟数据生成器构造行情（不访问网络）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    return fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+
+
+def test_prescreen_uses_names_and_manifest_only():
+    names = {'000001': '平安银行', '000002': 'ST万科', '000003': '*ST国华', '000004': '退市海润', '000005': '新股'}
+    manifest = {
+        '000001': {'rows': 500, 'last_close': 10.0, 'last_volume': 1e6},
+        '000005': {'rows': 20, 'last_close': 5.0, 'last_volume': 1e5},
+        '000006': {'rows': 500, 'last_close': 8.0, 'last_volume': 0.0},
+    }
+    codes = ['000001', '000002', '000003', '000004', '000005', '000006', '000007']
+    names.update({'000006': '停牌股', '000007': '清单外'})
+    eligible, removed = prescreen(codes, names, manifest)
+    assert eligible == ['000001', '000006', '000007']
+    assert removed == {'退市/未知': 1, 'ST/*ST': 2, 'K线不足60条': 1}
+    # 最新一天无成交的股票不会入选，清单中没有的股票保留
+    assert strategy_prefilter(BowlReboundStrategy(), eligible, manifest) == ['000001', '000007']
+
+
+def test_screen_stock_reports_each_exclusion_reason():
+    class Frames:
+        def __init__(self, df):
+            self.df = df
+        
+        def read_stock(self, code):
+            return self.df
+        
+        def read_latest(self, code, n=1):
+            return self.df.head(n)
+    
+    strategies = {'BowlReboundStrategy': BowlReboundStrategy()}
+    assert screen_stock(Frames(mock_stock('000001')), strategies, '000001', '退市海润')['status'] == 'invalid'
+    short = screen_stock(Frames(mock_stock('000001').head(30)), strategies, '000001', '平安银行')
+    assert short['status'] == 'read' and short['strategies']['BowlReboundStrategy']['status'] == 'short'
+    full = screen_stock(Frames(mock_stock('000001')), strategies, '000001', '平安银行')
+    assert full['strategies']['BowlReboundStrategy']['status'] == 'screened'
+
+
+def test_parallel_screener_matches_serial_order():
+    # 放宽条件，20只模拟股票中通常有数只入选
+    params = {'N': 1.2, 'J_VAL': 100, 'CAP': 0, 'duokong_pct': 10, 'short_pct': 10}
+    strategies = {'BowlReboundStrategy': BowlReboundStrategy(params)}
+    codes = [f'6000{i:02d}' for i in range(20)]
+    names = {code: '测试' for code in codes}
+    names[codes[3]] = 'ST测试'
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = CSVManager(tmp)
+        for code in codes:
+            writer.write_stock(code, mock_stock(code, years=2))
+        set_default_data_dir(tmp)
+        try:
+            manager = get_storage_manager(tmp)
+            
+            items = [(code, names[code], list(strategies)) for code in codes]
+            serial = [(code, screen_stock(manager, strategies, code, name)) for code, name, _ in items]
+            with ParallelScreener(tmp, strategies, workers=2) as screener:
+                parallel = screener.screen(items)
+            
+            def signals(outcomes):
+                # 信号中可能有 NaN（市值），按 repr 比较
+                return [(code, outcome['status'], repr({name: result['signals'] for name, result in outcome['strategies'].items()}))
+                        for code, outcome in outcomes]
+            assert signals(parallel) == signals(serial)
+            assert [code for code, _ in parallel] == codes
+            assert parallel[3][1]['status'] == 'invalid'
+            assert any(result['signals'] for _, outcome in serial for result in outcome['strategies'].values())
+            
+            # 完整流程：进程池与串行的入选列表一致
+            runs = [SelectPipeline(manager, strategies, tmp, workers=workers).run(codes, names)[0] for workers in (1, 2)]
+            assert repr(runs[0]) == repr(runs[1])
+            
+            # 需要返回数据时，入选股票的指标按全部历史重新计算（尾部窗口只用于选股）
+            strategy = strategies['BowlReboundStrategy']
+            for workers in (1, 2):
+                results, _, data = SelectPipeline(manager, strategies, tmp, workers=workers).run(codes, names, return_data=True)
+                selected = {item['code'] for item in results['BowlReboundStrategy']}
+                assert selected and set(data) == selected
+                for code in selected:
+                    full = manager.read_stock(code)
+                    assert len(data[code]) == len(full) > strategy.warmup_bars
+                    assert data[code]['date'].equals(full['date'])
+        finally:
+            set_default_data_dir('data')
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+B1完美图形匹配测试 - 批量相似度与逐对 PatternMatcher.match 对比，带约束DTW与逐格递推对比，
+逐格循环耗时对比，DTW下界剪枝，案例近邻索引的增量更新与持久化，特征提取改写前后一致
+
+用法:
+    python3 -m pytest test_pattern_match.py
+    python3 test_pattern_match.py
+"""
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils import technical as ta
+from strategy.bowl_rebound import BowlReboundStrategy
+from strategy.pattern_dtw import banded_dtw, envelope, lb_keogh
+from strategy.pattern_config import MATCH_TOLERANCES, SIMILARITY_WEIGHTS
+from strategy.pattern_feature_extractor import PatternFeatureExtractor
+from strategy.pattern_index import CaseIndex
+from strategy.pattern_library import B1PatternLibrary
+from strategy.pattern_matcher import PatternMatcher
+from strategy.pattern_vector import FeatureMatrix
+
+
+TOLERANCE = 1e-9
+
+
+def mock_stock(stock_code='600000', years=6):
+    """使用模拟数据生成器构造行情（不访问网络）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    return fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+
+
+def test_matrix_scores_match_pairwise_matcher():
+    extractor = PatternFeatureExtractor()
+    features = []
+    for code in ['600000', '000001', '300750', '600519', '002594']:
+        df = mock_stock(code, years=1)
+        for days, lookback in [(0, 25), (30, 20), (60, 40)]:
+            features.append(extractor.extract(df.iloc[days:].reset_index(drop=True), lookback_days=lookback))
+    # 空特征、缺失维度/字段、旧字段名和NaN
+    legacy = {
+        "trend_structure": {"short_slope": float('nan'), "price_vs_short": 1.02, "trend_spread": 3.0},
+        "kdj_state": {"j_position": "低位", "j_value": 12.5},
+        "volume_pattern": {"volume_trend": "其他"},
+        "price_shape": {"normalized_curve": [], "overall_trend": "震荡", "max_drawdown": 8.0},
+    }
+    features += [{}, extractor._empty_features(), legacy, dict(features[0], kdj_state={})]
+    
+    matcher = PatternMatcher(tolerances={"trend_ratio": 0.05, "j_value": 20})
+    total, breakdown, valid = matcher.match_matrix(FeatureMatrix(features), FeatureMatrix(features))
+    for i, cand in enumerate(features):
+        for j, case in enumerate(features):
+            expected = matcher.match(cand, case)
+            assert round(total[i, j] * 100, 2) == expected["total_score"]
+            assert valid[i, j] == bool(expected["breakdown"])
+            for k, v in expected["breakdown"].items():
+                assert round(breakdown[k][i, j] * 100, 2) == v
+
+
+def reference_dtw(a, b, window):
+    """逐格递推的带约束DTW（逐点绝对差）"""
+    n, m = len(a), len(b)
+    window = max(window, abs(n - m))
+    D = np.full((n + 1, m + 1), np.inf)
+    D[0, 0] = 0
+    for i in range(1, n + 1):
+        for j in range(max(1, i - window), min(m, i + window) + 1):
+            D[i, j] = abs(a[i - 1] - b[j - 1]) + min(D[i - 1, j - 1], D[i - 1, j], D[i, j - 1])
+    return D[n, m]
+
+
+def test_banded_dtw_matches_reference_and_lower_bound():
+    rng = np.random.default_rng(0)
+    for n, m, window in [(25, 25, 3), (25, 20, 2), (18, 25, 0), (10, 10, 10), (1, 4, 1), (4, 1, 0), (30, 35, 0)]:
+        a = rng.random((6, n))
+        b = rng.random((6, m))
+        distance = banded_dtw(a, b, window)
+        expected = [reference_dtw(a[p], b[p], window) for p in range(6)]
+        assert np.allclose(distance, expected, rtol=0, atol=TOLERANCE)
+        assert (lb_keogh(a, *envelope(b, n, window)) <= distance + TOLERANCE).all()
+
+
+def cell_loop_dtw(a, b, window):
+    """按带内单元格循环、每格对整批序列对计算的带约束DTW（反对角线波前之前的实现）"""
+    pairs, n = a.shape
+    m = b.shape[1]
+    window = max(window, abs(n - m))
+    prev = np.full((pairs, m), np.inf)
+    for i in range(n):
+        cur = np.full((pairs, m), np.inf)
+        lo, hi = max(0, i - window), min(m, i + window + 1)
+        cost = np.abs(a[:, i:i + 1] - b[:, lo:hi])
+        for j in range(lo, hi):
+            if i == 0 and j == 0:
+                cur[:, 0] = cost[:, 0]
+                continue
+            best = prev[:, j]
+            if j > 0:
+                best = np.minimum(np.minimum(best, prev[:, j - 1]), cur[:, j - 1])
+            cur[:, j] = cost[:, j - lo] + best
+        prev = cur
+    return prev[:, m - 1]
+
+
+def best_time(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def test_banded_dtw_faster_than_cell_loop():
+    # B1 曲线规模：25 个点、带宽 3；以及较长序列、较宽的带
+    rng = np.random.default_rng(1)
+    for n, m, window, pairs in [(25, 25, 3, 2000), (25, 22, 3, 30), (60, 60, 6, 1000)]:
+        a = rng.random((pairs, n))
+        b = rng.random((pairs, m))
+        assert np.allclose(banded_dtw(a, b, window), cell_loop_dtw(a, b, window), rtol=0, atol=TOLERANCE)
+        wavefront = best_time(banded_dtw, a, b, window)
+        cell_loop = best_time(cell_loop_dtw, a, b, window)
+        print(f"  DTW {n}x{m} 带宽{window} {pairs}对: 波前 {wavefront * 1e3:.2f}ms，逐格 {cell_loop * 1e3:.2f}ms")
+        assert wavefront < cell_loop
+
+
+def test_pruned_matching_keeps_best_match():
+    extractor = PatternFeatureExtractor()
+    cases = [extractor.extract(mock_stock(code, years=1).iloc[days:].reset_index(drop=True))
+             for code in ['600000', '000001', '300750'] for days in (0, 40, 80, 120)]
+    candidates = [extractor.extract(mock_stock(code, years=1).iloc[days:].reset_index(drop=True), lookback_days=lookback)
+                  for code in ['600519', '002594', '601318'] for days in (0, 15, 30) for lookback in (20, 25)]
+    
+    matcher = PatternMatcher()
+    full = matcher.match_matrix(FeatureMatrix(candidates), FeatureMatrix(cases))[0]
+    pruned = matcher.match_matrix(FeatureMatrix(candidates), FeatureMatrix(cases), best_only=True)[0]
+    assert (np.nanargmax(pruned, axis=1) == full.argmax(axis=1)).all()
+    computed = ~np.isnan(pruned)
+    assert (pruned[computed] == full[computed]).all()
+    assert computed.sum() < computed.size
+
+
+def test_case_index_shortlist_and_incremental_update():
+    extractor = PatternFeatureExtractor()
+    cases = [extractor.extract(mock_stock(code, years=1).iloc[days:].reset_index(drop=True))
+             for code in ['600000', '000001', '300750', '600519'] for days in range(0, 200, 10)]
+    candidates = FeatureMatrix([extractor.extract(mock_stock(code, years=1).iloc[days:].reset_index(drop=True))
+                                for code in ['002594', '601318'] for days in (0, 25, 50)])
+    case_ids = [f'case_{i:03d}' for i in range(len(cases))]
+    
+    # 逐个增量加入（部分在KD树之外）与一次性重建的检索结果一致
+    index = CaseIndex(SIMILARITY_WEIGHTS, MATCH_TOLERANCES)
+    index.rebuild(case_ids[:20], FeatureMatrix(cases[:20]))
+    index.search(candidates, 5)
+    for case_id, features in zip(case_ids[20:], cases[20:]):
+        index.add(case_id, features)
+    rebuilt = CaseIndex(SIMILARITY_WEIGHTS, MATCH_TOLERANCES)
+    rebuilt.rebuild(case_ids, FeatureMatrix(cases))
+    shortlist = index.search(candidates, 5)
+    assert index._tree_size == 20 and shortlist.shape == (len(candidates), 5)
+    assert (shortlist == rebuilt.search(candidates, 5)).all()
+    # 检索结果按 L1 距离排序
+    distances = np.abs(index.embed(candidates)[:, None, :] - index.vectors[shortlist]).sum(axis=2)
+    assert (np.diff(distances, axis=1) >= -1e-12).all()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'index.npz'
+        index.remove(case_ids[3])
+        index.save(path)
+        loaded = CaseIndex(SIMILARITY_WEIGHTS, MATCH_TOLERANCES)
+        assert loaded.load(path) and loaded.case_ids == index.case_ids
+        assert (loaded.search(candidates, 5) == index.search(candidates, 5)).all()
+        # 权重变化后旧索引失效
+        assert not CaseIndex(dict(SIMILARITY_WEIGHTS, price_shape=0.9), MATCH_TOLERANCES).load(path)
+    
+    # 只对检索出的案例精确打分，分数与全部计算一致
+    matcher = PatternMatcher()
+    mask = np.zeros((len(candidates), len(cases)), dtype=bool)
+    mask[np.arange(len(candidates))[:, None], shortlist] = True
+    full = matcher.match_matrix(candidates, FeatureMatrix(cases))[0]
+    for best_only in (False, True):
+        masked = matcher.match_matrix(candidates, FeatureMatrix(cases), best_only=best_only, mask=mask)[0]
+        assert np.isnan(masked[~mask]).all()
+        computed = ~np.isnan(masked)
+        assert (masked[computed] == full[computed]).all()
+        assert (np.nanargmax(masked, axis=1) == np.where(mask, full, -1).argmax(axis=1)).all()
+    
+    # 特征中的 numpy 布尔值可以写入JSON缓存
+    library = object.__new__(B1PatternLibrary)
+    assert json.loads(json.dumps(library._serialize_features(cases[0])))['trend_structure']['is_in_bowl'] in (True, False)
+
+
+def test_batch_match_skips_frames_that_fail_extraction():
+    library = object.__new__(B1PatternLibrary)
+    library.extractor = PatternFeatureExtractor()
+    library.matcher = PatternMatcher(SIMILARITY_WEIGHTS)
+    library.cases = {
+        f'case_{i}': {'meta': {'name': f'案例{i}', 'breakout_date': '2025-01-01', 'code': code},
+                      'features': library.extractor.extract(mock_stock(code, years=1))}
+        for i, code in enumerate(['600000', '000001', '300750'])
+    }
+    library._case_matrix = None
+    good = [(code, mock_stock(code, years=1)) for code in ['600519', '002594']]
+    broken = ('000002', mock_stock('000002', years=1).drop(columns=['close']))
+    results = library.find_best_matches([good[0], broken, good[1]])
+    expected = library.find_best_matches(good)
+    # 特征提取失败的股票没有匹配，其余股票的结果与单独匹配一致
+    assert results[1]['best_match'] is None and results[1]['candidate_features'] == {}
+    assert [results[0], results[2]] == expected and all(r['best_match'] for r in expected)
+    batch = library.match_batch([{'code': code, 'df': df} for code, df in [good[0], broken, good[1]]]
+                                + [{'code': '000003', 'df': None}])
+    assert sorted(r['stock_code'] for r in batch) == ['002594', '600519']
+
+
+def test_feature_extraction_matches_column_by_column_version():
+    class ColumnByColumn(PatternFeatureExtractor):
+        """改写前的实现：逐列赋值指标，逐行统计关键K线"""
+        
+        def extract(self, df, lookback_days=None):
+            if df.empty or len(df) < 10:
+                return self._empty_features()
+            days = lookback_days if lookback_days is not None else self.lookback_days
+            window_df = df.head(days).copy().sort_values('date').reset_index(drop=True)
+            trend_df = ta.calculate_zhixing_trend(window_df)
+            window_df['short_term_trend'] = trend_df['short_term_trend']
+            window_df['bull_bear_line'] = trend_df['bull_bear_line']
+            kdj_df = ta.KDJ(window_df, n=9, m1=3, m2=3)
+            window_df['K'] = kdj_df['K']
+            window_df['D'] = kdj_df['D']
+            window_df['J'] = kdj_df['J']
+            return {
+                "trend_structure": self._extract_trend_features(window_df),
+                "kdj_state": self._extract_kdj_features(window_df),
+                "volume_pattern": self._extract_volume_features(window_df),
+                "price_shape": self._extract_shape_features(window_df),
+            }
+        
+        def _extract_volume_features(self, df):
+            features = super()._extract_volume_features(df)
+            if features:
+                key_candles = 0
+                for i in range(len(df)):
+                    if i > 0 and df['volume'].iloc[i] > df['volume'].iloc[i-1] * 2 and df['close'].iloc[i] > df['open'].iloc[i]:
+                        key_candles += 1
+                features['key_candles_count'] = key_candles
+            return features
+    
+    extractor, reference = PatternFeatureExtractor(), ColumnByColumn()
+    strategy = BowlReboundStrategy()
+    checked = 0
+    for code in ['600000', '000001', '300750', '600519', '002594']:
+        df = mock_stock(code, years=1)
+        # 输入中已有同名指标列时同样被替换
+        with_indicators = strategy.calculate_indicators(df)
+        for days in range(0, 200, 20):
+            for lookback in (10, 25, 40):
+                for frame in (df, with_indicators):
+                    window = frame.iloc[days:].reset_index(drop=True)
+                    assert repr(extractor.extract(window, lookback)) == repr(reference.extract(window, lookback))
+                    checked += 1
+    assert checked == 5 * 10 * 3 * 2
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+全市场B1相似度扫描测试 - 最新窗口特征提取（串行与进程池）、失败股票跳过、按最佳相似度排序
+
+用法:
+    python3 -m pytest test_pattern_scan.py
+    python3 test_pattern_scan.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.csv_manager import CSVManager
+from utils.pattern_scan import PatternScanner, extract_latest, rank_matches
+from strategy.pattern_feature_extractor import PatternFeatureExtractor
+
+
+def mock_stock(stock_code='600000', years=6):
+    """使用模拟数据生成器构造行情（不访问网络）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    return fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+
+
+def test_scanner_extracts_latest_windows_and_skips_broken_stocks():
+    codes = ['600000', '000001', '300750', '000002', '000003']
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = CSVManager(tmp)
+        frames = {code: mock_stock(code, years=1) for code in codes[:3]}
+        for code, df in frames.items():
+            manager.write_stock(code, df)
+        manager.write_stock('000002', frames['600000'].head(5))
+        # 缺少收盘价列、无法提取特征的文件只跳过这一只股票
+        manager.write_stock('000003', frames['600000'])
+        broken = pd.read_csv(manager.get_stock_path('000003')).drop(columns=['close'])
+        broken.to_csv(manager.get_stock_path('000003'), index=False)
+        
+        extractor = PatternFeatureExtractor()
+        items = extract_latest(manager, extractor, codes, 25)
+        assert [code for code, _, _ in items] == codes[:3]
+        for code, date, features in items:
+            assert date == str(frames[code]['date'].iloc[0])[:10]
+            assert features == extractor.extract(manager.read_stock(code), lookback_days=25)
+        progress = []
+        assert PatternScanner(tmp, workers=1).extract(codes, 25, on_progress=lambda *args: progress.append(args)) == items
+        assert progress == [(len(codes), len(codes))]
+        assert PatternScanner(tmp, workers=2).extract(codes, 25) == items
+
+
+def test_scan_ranks_stocks_by_best_match():
+    def match(case, score):
+        return {'case_name': case, 'case_date': '2025-01-01', 'case_code': '000000', 'similarity_score': score,
+                'breakdown': {'trend_structure': score, 'kdj_state': score, 'volume_pattern': score, 'price_shape': score}}
+    items = [('000001', '2026-01-05', {}), ('000002', '2026-01-05', {}), ('000003', '2026-01-05', {})]
+    table = rank_matches(items, [[match('A', 70.0), match('B', 60.0)], [], [match('C', 80.5)]], {'000001': '平安银行'})
+    assert list(table['stock_code']) == ['000003', '000001']
+    assert list(table['matched_case']) == ['C', 'A']
+    assert list(table['stock_name']) == ['未知', '平安银行']
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
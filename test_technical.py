@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+技术指标测试 - 向量化 KDJ/SMA 与原逐行递推实现对比，
+全市场批量版（technical_panel）与逐只计算结果对比，多策略共用指标缓存与单独计算对比
+
+用法:
+    python3 -m pytest test_technical.py
+    python3 test_technical.py
+"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.akshare_fetcher import AKShareFetcher
+from utils.indicator_cache import IndicatorCache
+from utils import technical as ta
+from utils import technical_panel as tp
+from utils.technical import KDJ, SMA
+from strategy.bowl_rebound import BowlReboundStrategy
+
+
+TOLERANCE = 1e-9
+
+
+def reference_sma(X, n, m):
+    """原逐行递推版 SMA"""
+    result = pd.Series(index=X.index, dtype=float)
+    result.iloc[0] = X.iloc[0]
+    for i in range(1, len(X)):
+        result.iloc[i] = (X.iloc[i] * m + result.iloc[i-1] * (n - m)) / n
+    return result
+
+
+def reference_kdj(df, n=9, m1=3, m2=3):
+    """原逐行递推版 KDJ"""
+    is_descending = df['date'].iloc[0] > df['date'].iloc[-1]
+    if is_descending:
+        df_calc = df.iloc[::-1].copy().reset_index(drop=True)
+    else:
+        df_calc = df.copy().reset_index(drop=True)
+
+    low_min = df_calc['low'].rolling(window=n, min_periods=1).min()
+    high_max = df_calc['high'].rolling(window=n, min_periods=1).max()
+    range_val = high_max - low_min
+    rsv = pd.Series(index=df_calc.index, dtype=float)
+    for i in range(len(df_calc)):
+        if i < n - 1 or range_val.iloc[i] == 0:
+            rsv.iloc[i] = 50.0
+        else:
+            rsv.iloc[i] = (df_calc['close'].iloc[i] - low_min.iloc[i]) / range_val.iloc[i] * 100
+
+    k = pd.Series(index=df_calc.index, dtype=float)
+    d = pd.Series(index=df_calc.index, dtype=float)
+    k.iloc[0] = 50.0
+    d.iloc[0] = 50.0
+    for i in range(1, len(df_calc)):
+        k.iloc[i] = (rsv.iloc[i] * 1 + k.iloc[i-1] * (m1 - 1)) / m1
+        d.iloc[i] = (k.iloc[i] * 1 + d.iloc[i-1] * (m2 - 1)) / m2
+    j = 3 * k - 2 * d
+
+    result = pd.DataFrame({'K': k, 'D': d, 'J': j})
+    if is_descending:
+        result = result.iloc[::-1].reset_index(drop=True)
+    result.index = df.index
+    return result
+
+
+def mock_stock(stock_code='600000', years=6):
+    """使用模拟数据生成器构造行情（不访问网络）"""
+    fetcher = AKShareFetcher.__new__(AKShareFetcher)
+    return fetcher._generate_mock_data(stock_code, years=years).reset_index(drop=True)
+
+
+def mock_panel(codes, seed=0):
+    """构造 (时间正序 × 股票) 面板，随机剔除部分交易日模拟上市前/停牌"""
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for i, code in enumerate(codes):
+        df = mock_stock(code, years=2)
+        df['date'] = df['date'].dt.normalize()
+        df = df.drop(index=rng.choice(len(df), size=20, replace=False))
+        frames[code] = df.iloc[:len(df) - i * 40].reset_index(drop=True)
+    
+    dates = sorted(set().union(*(set(df['date']) for df in frames.values())))
+    panel = {
+        field: pd.DataFrame({code: df.set_index('date')[field] for code, df in frames.items()},
+                            index=dates).to_numpy()
+        for field in ['open', 'high', 'low', 'close', 'volume', 'market_cap']
+    }
+    return frames, panel
+
+
+def panel_view(codes, raw, dates=None):
+    """
+    行情面板的内存替身（与 MarketPanel 相同的 codes / code_index / field / date_values 接口）
+    :param dates: 日期轴，None 时按行号生成
+    """
+    if dates is None:
+        dates = np.arange(len(raw['close'])).astype('datetime64[D]')
+    dates = np.array(dates, dtype='datetime64[D]')
+    return SimpleNamespace(codes=codes, code_index={code: i for i, code in enumerate(codes)},
+                           field=lambda name: raw[name], date_values=lambda: dates)
+
+
+def test_kdj_matches_reference_descending():
+    for code in ['600000', '000001', '300750']:
+        df = mock_stock(code)
+        expected = reference_kdj(df)
+        actual = KDJ(df)
+        assert np.allclose(actual.values, expected.values, rtol=0, atol=TOLERANCE)
+
+
+def test_kdj_matches_reference_ascending():
+    df = mock_stock('002594').iloc[::-1].reset_index(drop=True)
+    expected = reference_kdj(df, n=9, m1=3, m2=3)
+    actual = KDJ(df, n=9, m1=3, m2=3)
+    assert np.allclose(actual.values, expected.values, rtol=0, atol=TOLERANCE)
+
+
+def test_kdj_flat_range_and_short_history():
+    df = mock_stock('601318', years=0.05)
+    # 构造最高价=最低价的区间，RSV 应回退为 50
+    df.loc[:12, ['high', 'low', 'close']] = 10.0
+    expected = reference_kdj(df, n=5, m1=4, m2=2)
+    actual = KDJ(df, n=5, m1=4, m2=2)
+    assert np.allclose(actual.values, expected.values, rtol=0, atol=TOLERANCE)
+
+
+def test_sma_matches_reference():
+    df = mock_stock('000858')
+    for n, m in [(3, 1), (6, 1), (12, 5)]:
+        expected = reference_sma(df['close'], n, m)
+        actual = SMA(df['close'], n, m)
+        assert actual.index.equals(expected.index)
+        assert np.allclose(actual.values, expected.values, rtol=0, atol=TOLERANCE)
+
+
+def test_sma_propagates_nan_like_reference():
+    series = pd.Series([1.0, 2.0, np.nan, 4.0, 5.0], index=[10, 11, 12, 13, 14])
+    expected = reference_sma(series, 3, 1)
+    actual = SMA(series, 3, 1)
+    assert np.allclose(actual.values, expected.values, equal_nan=True)
+
+
+def test_panel_indicators_match_per_stock():
+    codes = ['600000', '000001', '300750', '688981']
+    frames, panel = mock_panel(codes)
+    index = tp.CompactIndex.from_values(panel['close'])
+    close = index.compact(panel['close'])
+    
+    stt, bbl = tp.calculate_zhixing_trend(close)
+    k, d, j = tp.KDJ(index.compact(panel['high']), index.compact(panel['low']), close)
+    ref_volume = tp.REF(index.compact(panel['volume']), 1)
+    llv = tp.LLV(close, 20)
+    
+    for col, code in enumerate(codes):
+        df = frames[code]
+        count = len(df)
+        expected_trend = ta.calculate_zhixing_trend(df)
+        expected_kdj = KDJ(df)
+        # 逐只结果为倒序，面板结果为正序且底部对齐
+        pairs = [
+            (stt, expected_trend['short_term_trend']),
+            (bbl, expected_trend['bull_bear_line']),
+            (k, expected_kdj['K']),
+            (d, expected_kdj['D']),
+            (j, expected_kdj['J']),
+            (ref_volume, ta.REF(df['volume'], 1)),
+            (llv, ta.LLV(df['close'], 20)),
+        ]
+        for actual, expected in pairs:
+            assert np.isnan(actual[:-count, col]).all()
+            assert np.allclose(actual[-count:, col][::-1], expected.to_numpy(dtype=float),
+                               rtol=0, atol=TOLERANCE, equal_nan=True)
+
+
+def test_compact_index_round_trip():
+    values = np.array([
+        [np.nan, 1.0, np.nan],
+        [2.0, np.nan, np.nan],
+        [3.0, 4.0, np.nan],
+        [np.nan, 5.0, 6.0],
+    ])
+    index = tp.CompactIndex.from_values(values)
+    compacted = index.compact(values)
+    assert np.allclose(compacted[:, 0], [np.nan, np.nan, 2.0, 3.0], equal_nan=True)
+    assert np.allclose(compacted[:, 1], [np.nan, 1.0, 4.0, 5.0], equal_nan=True)
+    assert np.allclose(compacted[:, 2], [np.nan, np.nan, np.nan, 6.0], equal_nan=True)
+    assert np.allclose(index.expand(compacted), values, equal_nan=True)
+    assert list(index.source_rows[-1]) == [2, 3, 3]
+
+
+def test_shared_indicator_cache_matches_separate_calculation():
+    df = mock_stock('600519')
+    strategies = [BowlReboundStrategy(), BowlReboundStrategy({'N': 2, 'J_VAL': 40}), BowlReboundStrategy({'M1': 10})]
+    cache = IndicatorCache(df)
+    for strategy in strategies:
+        shared = strategy.calculate_indicators(df, cache=cache)
+        assert shared.equals(strategy.calculate_indicators(df))
+    # KDJ和量比只计算一次，趋势线按均线参数各算一次
+    assert cache.misses == 4 and cache.hits == 5
+
+
+if __name__ == '__main__':
+    tests = [obj for name, obj in list(globals().items()) if name.startswith('test_')]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError:
+            failed += 1
+            print(f"❌ {test.__name__}")
+    sys.exit(1 if failed else 0)
@@ -10,20 +10,104 @@ from pathlib import Path
 import json
 import requests
 import random
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 # 添加项目根目录到路径
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.csv_manager import CSVManager
+from utils.csv_manager import get_storage_manager
+from utils.market_cap_snapshot import normalize_market_cap
 
-# 设置请求会话
-session = requests.Session()
-session.headers.update({
+# 并发抓取默认配置（可在 config.yaml 的 fetch 段覆盖）
+DEFAULT_FETCH_WORKERS = 8      # 并发线程数
+DEFAULT_RATE_LIMIT = 20        # 限速（请求/秒），0 表示不限速
+
+# 请求会话的默认请求头
+SESSION_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'application/json, text/javascript, */*',
     'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
     'Referer': 'https://quote.eastmoney.com/',
     'Connection': 'keep-alive',
-})
+}
+
+
+class RateLimiter:
+    """令牌桶限速器（线程安全），同一抓取器的所有抓取线程共享"""
+    
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: 每秒补充的令牌数（请求/秒），0 或 None 表示不限速
+        :param burst: 桶容量（允许的瞬时突发请求数），默认等于 rate
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, rate or 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待"""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestCounter:
+    """按阶段统计网络请求数（线程安全），用于确认各阶段实际发出的请求量"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.current = '其他'
+    
+    @contextmanager
+    def phase(self, name):
+        """在 with 块内发出的请求计入 name 阶段（工作线程共享当前阶段）"""
+        previous, self.current = self.current, name
+        try:
+            yield
+        finally:
+            self.current = previous
+    
+    def record(self, n=1):
+        with self.lock:
+            self.counts[self.current] = self.counts.get(self.current, 0) + n
+    
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+    
+    def report(self):
+        """打印各阶段请求数"""
+        if not self.counts:
+            return
+        detail = ', '.join(f"{name} {count}" for name, count in self.counts.items())
+        print(f"网络请求统计: {detail} (合计 {sum(self.counts.values())})")
+
+
+request_counter = RequestCounter()
+
+
+def create_session(workers=DEFAULT_FETCH_WORKERS):
+    """创建请求会话，连接池大小与并发数一致"""
+    session = requests.Session()
+    session.headers.update(SESSION_HEADERS)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 # 备选A股股票列表（当网络获取失败时使用）
@@ -84,10 +168,57 @@ DEFAULT_STOCK_LIST = {
 class AKShareFetcher:
     """AKShare 数据抓取器"""
     
-    def __init__(self, data_dir="data"):
-        self.csv_manager = CSVManager(data_dir)
+    def __init__(self, data_dir="data", workers=DEFAULT_FETCH_WORKERS, rate=DEFAULT_RATE_LIMIT,
+                 quote_update=True):
+        """
+        :param workers: 并发抓取线程数（1 表示串行）
+        :param rate: 限速（请求/秒），本抓取器的全部线程共用
+        :param quote_update: 每日更新优先用批量行情构造当日K线，只缺一天且未除权的股票不再逐只抓K线
+        """
+        self.csv_manager = get_storage_manager(data_dir)
         self.full_data_dir = Path(data_dir)
         self.stock_names_file = Path(data_dir) / 'stock_names.json'
+        self.workers = max(int(workers or 1), 1)
+        self.quote_update = quote_update
+        # 最近一次批量获取的总市值（元）及来源，市值快照刷新时直接复用
+        self.market_caps = {}
+        self.market_cap_source = None
+        # 连接池和限速器属于本抓取器，创建其他抓取器不会替换正在使用的限速器
+        self.session = create_session(self.workers)
+        self.rate_limiter = RateLimiter(rate)
+    
+    def http_get(self, url, **kwargs):
+        """经过限速、复用连接池的 GET 请求"""
+        self.rate_limiter.acquire()
+        request_counter.record()
+        return self.session.get(url, **kwargs)
+    
+    def _fetch_concurrently(self, tasks, fetch):
+        """
+        并发执行抓取任务，按完成顺序产出 (task, result)
+        写文件等后续处理由调用方在当前线程完成，避免多线程同时写同一文件
+        :param tasks: 参数元组列表
+        :param fetch: 抓取函数，fetch(*task)
+        """
+        if self.workers <= 1:
+            for task in tasks:
+                try:
+                    result = fetch(*task)
+                except Exception as e:
+                    print(f"  {task[0]} 抓取异常: {e}")
+                    result = None
+                yield task, result
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(fetch, *task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"  {futures[future][0]} 抓取异常: {e}")
+                    result = None
+                yield futures[future], result
     
     def _load_local_stock_names(self):
         """从本地文件加载股票名称"""
@@ -107,56 +238,110 @@ class AKShareFetcher:
         except Exception as e:
             print(f"  保存股票名称失败: {e}")
 
+    def _iter_tencent_quotes(self, stock_codes):
+        """
+        腾讯行情批量接口（qt.gtimg.cn，每批100只），逐只产出 (code, 字段列表)
+        常用字段：3=现价 4=昨收 5=今开 6=成交量(手) 30=时间戳 33=最高 34=最低 44=总市值(亿)
+        """
+        batch_size = 100
+        total = len(stock_codes)
+        
+        for i in range(0, total, batch_size):
+            batch = stock_codes[i:i + batch_size]
+            query_codes = []
+            for code in batch:
+                if code.startswith('6') or code.startswith('8'):
+                    query_codes.append(f"sh{code}")
+                else:
+                    query_codes.append(f"sz{code}")
+            
+            url = f"https://qt.gtimg.cn/q={','.join(query_codes)}"
+            resp = self.http_get(url, timeout=30, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            })
+            
+            lines = resp.text.strip().split(';')
+            for line in lines:
+                if 'v_' in line and '~' in line:
+                    # 提取代码
+                    code_match = line.split('v_')[1].split('=')[0]
+                    if not code_match or len(code_match) < 8:
+                        continue
+                    parts = line.split('~')
+                    if len(parts) >= 46:
+                        yield code_match[2:], parts  # 去掉 sh/sz 前缀
+            
+            if i % 500 == 0 and i > 0:
+                print(f"  已获取 {i}/{total} 只行情...")
+    
     def _fetch_market_cap_tencent(self, stock_codes):
         """使用腾讯接口批量获取市值数据（akshare备选方案）"""
         market_cap_map = {}
-        batch_size = 100
-        total = len(stock_codes)
         
         try:
-            for i in range(0, total, batch_size):
-                batch = stock_codes[i:i + batch_size]
-                query_codes = []
-                for code in batch:
-                    if code.startswith('6') or code.startswith('8'):
-                        query_codes.append(f"sh{code}")
-                    else:
-                        query_codes.append(f"sz{code}")
-                
-                url = f"https://qt.gtimg.cn/q={','.join(query_codes)}"
-                resp = requests.get(url, timeout=30, headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                })
-                
-                lines = resp.text.strip().split(';')
-                for line in lines:
-                    if 'v_' in line and '~' in line:
-                        try:
-                            # 提取代码
-                            code_match = line.split('v_')[1].split('=')[0] if 'v_' in line else ''
-                            if not code_match or len(code_match) < 8:
-                                continue
-                            code = code_match[2:]  # 去掉 sh/sz 前缀
-                            
-                            parts = line.split('~')
-                            if len(parts) >= 46:
-                                # 字段44是总市值（亿）
-                                cap = float(parts[44]) if parts[44] else 0
-                                if cap > 0:
-                                    # 转为元（腾讯接口是亿）
-                                    market_cap_map[code] = int(cap * 1e8)
-                        except:
-                            continue
-                
-                if i % 500 == 0 and i > 0:
-                    print(f"  已获取 {i}/{total} 只市值...")
-                    time.sleep(0.1)
-                    
+            for code, parts in self._iter_tencent_quotes(stock_codes):
+                try:
+                    # 字段44是总市值（亿）
+                    cap = float(parts[44]) if parts[44] else 0
+                    if cap > 0:
+                        market_cap_map[code] = int(normalize_market_cap(cap, 'tencent'))
+                except:
+                    continue
         except Exception as e:
             print(f"  腾讯接口获取市值失败: {e}")
         
         return market_cap_map
     
+    def _fetch_quote_bars_tencent(self, stock_codes):
+        """
+        使用腾讯行情批量接口构造当日K线（约50次请求覆盖全市场）
+        :return: {code: {date, open, close, high, low, volume, prev_close, market_cap}}
+                 停牌（成交量为0）的股票不返回
+        """
+        quote_bars = {}
+        
+        try:
+            for code, parts in self._iter_tencent_quotes(stock_codes):
+                try:
+                    volume = int(float(parts[6]))
+                    close = float(parts[3])
+                    if volume <= 0 or close <= 0:
+                        continue
+                    quote_bars[code] = {
+                        'date': pd.Timestamp(parts[30][:8]),
+                        'open': float(parts[5]),
+                        'close': close,
+                        'high': float(parts[33]),
+                        'low': float(parts[34]),
+                        'volume': volume,
+                        'prev_close': float(parts[4]),
+                        'market_cap': int(normalize_market_cap(float(parts[44]), 'tencent')) if parts[44] else None,
+                    }
+                except (ValueError, IndexError):
+                    continue
+        except Exception as e:
+            print(f"  腾讯接口获取行情失败: {e}")
+        
+        return quote_bars
+    
+    def _fetch_trade_days(self, days=10):
+        """
+        用上证指数日K线获取最近的交易日（判断股票是否只缺一个交易日）
+        :return: 按时间正序的日期列表，失败时返回空列表
+        """
+        url = f"https://web.ifzq.gtimg.cn/appstock/app/fqkline/get?param=sh000001,day,,,{days},qfq"
+        try:
+            resp = self.http_get(url, timeout=15, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Referer': 'https://stock.finance.qq.com/'
+            })
+            index_data = resp.json().get('data', {}).get('sh000001', {})
+            klines = index_data.get('day', []) or index_data.get('qfqday', [])
+            return sorted(pd.Timestamp(item[0]) for item in klines if item)
+        except Exception as e:
+            print(f"  获取交易日历失败: {e}")
+            return []
+    
     def _fetch_stock_list_http(self):
         """使用腾讯接口获取股票列表 - 覆盖5000+只A股"""
         try:
@@ -246,7 +431,7 @@ class AKShareFetcher:
                 url = f"https://qt.gtimg.cn/q={query_codes}"
                 
                 try:
-                    resp = requests.get(url, timeout=30, headers={
+                    resp = self.http_get(url, timeout=30, headers={
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                     })
                     
@@ -355,6 +540,7 @@ class AKShareFetcher:
             try:
                 print(f"  尝试akshare (第{attempt+1}/{max_retries}次)...")
                 
+                request_counter.record(2)
                 sh_df = ak.stock_sh_a_spot_em()
                 sz_df = ak.stock_sz_a_spot_em()
                 
@@ -388,11 +574,12 @@ class AKShareFetcher:
         print(f"✓ 加载默认列表: {len(DEFAULT_STOCK_LIST)} 只股票")
         return DEFAULT_STOCK_LIST.copy()
     
-    def _fetch_stock_history_http(self, stock_code, years=6):
-        """使用腾讯接口获取股票历史数据"""
+    def _fetch_stock_history_http(self, stock_code, years=6, market_cap=None):
+        """
+        使用腾讯接口获取股票历史数据
+        :param market_cap: 调用方批量获取的总市值（元），不逐只请求
+        """
         try:
-            import requests
-            
             # 判断市场前缀
             if stock_code.startswith('6') or stock_code.startswith('88'):
                 market_code = 'sh' + stock_code
@@ -404,7 +591,7 @@ class AKShareFetcher:
             max_days = min(years * 365, 1000)  # 最多1000天
             url = f"https://web.ifzq.gtimg.cn/appstock/app/fqkline/get?param={market_code},day,,,{max_days},qfq"
             
-            resp = requests.get(url, timeout=15, headers={
+            resp = self.http_get(url, timeout=15, headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
                 'Referer': 'https://stock.finance.qq.com/'
             })
@@ -456,12 +643,7 @@ class AKShareFetcher:
                 if records:
                     df = pd.DataFrame(records)
                     df['date'] = pd.to_datetime(df['date'])
-                    # 从实时数据获取总市值
-                    market_cap = self._get_realtime_market_cap(stock_code)
-                    if market_cap:
-                        df['market_cap'] = market_cap
-                    else:
-                        df['market_cap'] = abs(hash(stock_code)) % 500 * 100000000 + 5000000000
+                    df['market_cap'] = self._market_cap_column(market_cap)
                     df = df.sort_values('date', ascending=False)
                     return df
             
@@ -470,26 +652,12 @@ class AKShareFetcher:
             print(f"  HTTP获取历史数据失败: {e}")
             return None
     
-    def _get_realtime_market_cap(self, stock_code):
-        """从实时数据获取总市值"""
-        try:
-            import akshare as ak
-            spot_df = ak.stock_individual_info_em(symbol=stock_code)
-            if not spot_df.empty:
-                total_cap_row = spot_df[spot_df['item'] == '总市值']
-                if not total_cap_row.empty:
-                    total_cap = total_cap_row['value'].values[0]
-                    if isinstance(total_cap, str):
-                        if '亿' in total_cap:
-                            return float(total_cap.replace('亿', '')) * 1e8
-                        else:
-                            return float(total_cap)
-                    return float(total_cap)
-        except Exception as e:
-            print(f"  获取总市值失败: {e}")
-        return None
+    @staticmethod
+    def _market_cap_column(market_cap):
+        """总市值列：使用批量获取的市值，缺失时留空（选股时改查本地市值快照）"""
+        return market_cap if market_cap else float('nan')
     
-    def _generate_mock_data(self, stock_code, years=6):
+    def _generate_mock_data(self, stock_code, years=6, market_cap=None):
         """生成模拟数据（当网络不可用时使用）"""
         import numpy as np
         
@@ -520,12 +688,10 @@ class AKShareFetcher:
         df['low'] = np.minimum(df[['open', 'close']].min(axis=1) * (1 - abs(np.random.normal(0, 0.01, days))),
                                df[['open', 'close']].min(axis=1))
         
-        # 添加总市值（从实时数据获取）
-        market_cap = self._get_realtime_market_cap(stock_code)
+        # 添加总市值（调用方批量获取的市值，没有时使用估算值）
         if market_cap:
             df['market_cap'] = market_cap
         else:
-            # 如果获取失败，使用估算值（ but this is still wrong, just a fallback ）
             df['market_cap'] = np.random.uniform(5000000000, 50000000000)
         
         # 按日期倒序排列
@@ -533,16 +699,16 @@ class AKShareFetcher:
         
         return df
     
-    def fetch_stock_history(self, stock_code, years=6):
+    def fetch_stock_history(self, stock_code, years=6, market_cap=None):
         """
         抓取单只股票历史数据
         前复权，按日期倒序排列
+        :param market_cap: 调用方批量获取的总市值（元），不逐只请求
         """
         # 方法1: 直接HTTP请求
         try:
-            df = self._fetch_stock_history_http(stock_code, years)
+            df = self._fetch_stock_history_http(stock_code, years, market_cap)
             if df is not None and not df.empty:
-                print(f"✓ (HTTP获取 {len(df)}条)")
                 return df
             else:
                 print(f"  HTTP返回空数据，尝试akshare...")
@@ -556,6 +722,7 @@ class AKShareFetcher:
             start_str = start_date.strftime("%Y%m%d")
             end_str = end_date.strftime("%Y%m%d")
             
+            request_counter.record()
             df = ak.stock_zh_a_hist(
                 symbol=stock_code,
                 period="daily",
@@ -570,12 +737,7 @@ class AKShareFetcher:
                     '收盘': 'close', '成交量': 'volume', '成交额': 'amount', '换手率': 'turnover'
                 })
                 df = df[['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'turnover']]
-                # 从实时数据获取总市值
-                market_cap = self._get_realtime_market_cap(stock_code)
-                if market_cap:
-                    df['market_cap'] = market_cap
-                else:
-                    df['market_cap'] = (hash(stock_code) % 100 + 50) * 1000000000
+                df['market_cap'] = self._market_cap_column(market_cap)
                 df['date'] = pd.to_datetime(df['date'])
                 df = df.sort_values('date', ascending=False)
                 return df
@@ -583,16 +745,15 @@ class AKShareFetcher:
             print(f"  akshare获取失败，使用模拟数据...")
         
         # 降级: 使用模拟数据
-        return self._generate_mock_data(stock_code, years)
+        return self._generate_mock_data(stock_code, years, market_cap)
     
-    def fetch_stock_update(self, stock_code, days=10):
+    def fetch_stock_update(self, stock_code, days=10, market_cap=None):
         """
         抓取近期数据用于增量更新
         优化：直接指定天数，避免计算误差
+        :param market_cap: 调用方批量获取的总市值（元），不逐只请求
         """
         try:
-            import requests
-            
             # 判断市场前缀
             if stock_code.startswith('6') or stock_code.startswith('88'):
                 market_code = 'sh' + stock_code
@@ -604,7 +765,7 @@ class AKShareFetcher:
             fetch_days = min(days + 2, 1000)
             url = f"https://web.ifzq.gtimg.cn/appstock/app/fqkline/get?param={market_code},day,,,{fetch_days},qfq"
             
-            resp = requests.get(url, timeout=15, headers={
+            resp = self.http_get(url, timeout=15, headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
                 'Referer': 'https://stock.finance.qq.com/'
             })
@@ -645,12 +806,7 @@ class AKShareFetcher:
                 if records:
                     df = pd.DataFrame(records)
                     df['date'] = pd.to_datetime(df['date'])
-                    # 从实时数据获取总市值
-                    market_cap = self._get_realtime_market_cap(stock_code)
-                    if market_cap:
-                        df['market_cap'] = market_cap
-                    else:
-                        df['market_cap'] = abs(hash(stock_code)) % 500 * 100000000 + 5000000000
+                    df['market_cap'] = self._market_cap_column(market_cap)
                     df = df.sort_values('date', ascending=False)
                     return df
             
@@ -659,15 +815,48 @@ class AKShareFetcher:
             print(f"  获取更新数据失败: {e}")
             return None
     
+    def _fetch_market_cap_map(self, stock_codes):
+        """
+        批量获取总市值（元），K线抓取时按股票注入，不再逐只请求
+        主接口：akshare 全市场实时行情；备选：腾讯批量行情接口（只查 stock_codes）
+        """
+        market_cap_map = {}
+        
+        with request_counter.phase('市值'):
+            # 方法1: 尝试akshare接口
+            try:
+                request_counter.record()
+                spot_df = ak.stock_zh_a_spot_em()
+                for _, row in spot_df.iterrows():
+                    code = str(row['代码']).zfill(6)
+                    cap = row['总市值']
+                    if pd.notna(cap) and cap > 0:
+                        # 实时行情的总市值单位为元
+                        market_cap_map[code] = int(normalize_market_cap(cap, 'akshare'))
+                print(f"  ✓ akshare接口成功: {len(market_cap_map)} 只股票市值")
+                self.market_caps, self.market_cap_source = market_cap_map, 'akshare'
+            except Exception as e:
+                print(f"  akshare接口失败: {e}")
+                print("  尝试腾讯备选接口...")
+                # 方法2: 使用腾讯接口备选
+                market_cap_map = self._fetch_market_cap_tencent(stock_codes)
+                self.market_caps, self.market_cap_source = market_cap_map, 'tencent'
+                if market_cap_map:
+                    print(f"  ✓ 腾讯接口成功: {len(market_cap_map)} 只股票市值")
+                else:
+                    print(f"  ✗ 腾讯接口也失败，市值数据将缺失")
+        
+        return market_cap_map
+    
     def init_full_data(self, max_stocks=None, skip_failed=True):
         """
         首次全量抓取
         :param max_stocks: 限制抓取数量（用于测试）
         :param skip_failed: 是否跳过之前失败的股票
         """
-        import akshare as ak
-        
-        stock_dict = self.get_all_stock_codes()
+        request_counter.reset()
+        with request_counter.phase('股票列表'):
+            stock_dict = self.get_all_stock_codes()
         
         if not stock_dict:
             print("无法获取股票列表")
@@ -693,71 +882,47 @@ class AKShareFetcher:
         
         # 批量获取市值数据（主接口：akshare，备选：腾讯）
         print("\n正在批量获取市值数据...")
-        market_cap_map = {}
-        
-        # 方法1: 尝试akshare接口
-        try:
-            spot_df = ak.stock_zh_a_spot_em()
-            for _, row in spot_df.iterrows():
-                code = str(row['代码']).zfill(6)
-                cap = row['总市值']
-                if pd.notna(cap) and cap > 0:
-                    # 统一转为元
-                    if cap < 1e10:
-                        cap = int(cap * 1e8)
-                    else:
-                        cap = int(cap)
-                    market_cap_map[code] = cap
-            print(f"  ✓ akshare接口成功: {len(market_cap_map)} 只股票市值")
-        except Exception as e:
-            print(f"  akshare接口失败: {e}")
-            print("  尝试腾讯备选接口...")
-            # 方法2: 使用腾讯接口备选
-            market_cap_map = self._fetch_market_cap_tencent(stock_codes)
-            if market_cap_map:
-                print(f"  ✓ 腾讯接口成功: {len(market_cap_map)} 只股票市值")
-            else:
-                print(f"  ✗ 腾讯接口也失败，市值数据将缺失")
+        market_cap_map = self._fetch_market_cap_map(stock_codes)
         
         total = len(stock_codes)
         success = 0
         failed = 0
         failed_list = []
         
-        print(f"\n开始抓取 {total} 只股票的6年历史数据...")
+        print(f"\n开始抓取 {total} 只股票的6年历史数据 (并发 {self.workers})...")
         print("=" * 60)
         
-        for i, code in enumerate(stock_codes, 1):
-            print(f"[{i}/{total}] 抓取 {code} {stock_dict.get(code, '')} ...", end=" ")
-            
-            df = self.fetch_stock_history(code, years=6)
+        # 并发抓取，结果按完成顺序逐只写入
+        tasks = [(code, 6, market_cap_map.get(code)) for code in stock_codes]
+        with request_counter.phase('K线'):
+            results = self._fetch_concurrently(tasks, self.fetch_stock_history)
+            for i, ((code, _, _), df) in enumerate(results, 1):
+                print(f"[{i}/{total}] 抓取 {code} {stock_dict.get(code, '')} ...", end=" ")
             
-            if df is not None and not df.empty:
-                # 数据校验 - 检查是否有有效价格数据
-                valid_data = True
-                if len(df) < 10:  # 数据太少，可能是新股或数据异常
-                    print(f"⚠ 数据太少({len(df)}条)")
-                    valid_data = False
-                    failed_list.append(code)
-                elif df['close'].mean() <= 0:  # 价格异常
-                    print(f"⚠ 价格异常")
-                    valid_data = False
-                    failed_list.append(code)
+                if df is not None and not df.empty:
+                    # 数据校验 - 检查是否有有效价格数据
+                    valid_data = True
+                    if len(df) < 10:  # 数据太少，可能是新股或数据异常
+                        print(f"⚠ 数据太少({len(df)}条)")
+                        valid_data = False
+                        failed_list.append(code)
+                    elif df['close'].mean() <= 0:  # 价格异常
+                        print(f"⚠ 价格异常")
+                        valid_data = False
+                        failed_list.append(code)
+                    else:
+                        self.csv_manager.write_stock(code, df)
+                        print(f"✓ ({len(df)}条)")
+                        success += 1
+                        # 定期保存清单，中断后已写入的股票仍在清单中
+                        if success % 100 == 0:
+                            self.csv_manager.save_manifest()
                 else:
-                    # 使用批量获取的市值数据
-                    if code in market_cap_map:
-                        df['market_cap'] = market_cap_map[code]
-                    self.csv_manager.write_stock(code, df)
-                    print(f"✓ ({len(df)}条)")
-                    success += 1
-            else:
-                print("✗ 失败")
-                failed += 1
-                failed_list.append(code)
-            
-            # 限速，避免请求过快
-            if i % 10 == 0:
-                time.sleep(1)
+                    print("✗ 失败")
+                    failed += 1
+                    failed_list.append(code)
+        
+        self.csv_manager.save_manifest()
         
         # 保存失败的股票列表
         if failed_list:
@@ -772,6 +937,64 @@ class AKShareFetcher:
         print(f"完成! 成功: {success}, 失败: {failed + len(failed_list)}")
         if failed_list and not max_stocks:
             print(f"提示: 再次运行 init 命令可跳过失败股票，专注于成功获取的数据")
+        request_counter.report()
+    
+    def _update_from_quotes(self, stocks_to_update, latest_info, market_cap_map):
+        """
+        批量行情更新：只缺最近一个交易日、且昨收与本地最新收盘价一致的股票，
+        直接用行情快照追加当日K线
+        其余股票（缺口超过一天、昨收不一致即发生除权除息）回退到逐只K线抓取
+        :param stocks_to_update: [(code, days_to_fetch)]
+        :param latest_info: {code: (本地最新日期, 本地最新收盘价)}
+        :return: (追加成功数, 停牌数, 需要回退K线抓取的 [(code, days_to_fetch)])
+        """
+        trade_days = self._fetch_trade_days()
+        if len(trade_days) < 2:
+            print("  ⚠️ 无法确定最近交易日，全部回退逐只K线抓取")
+            return 0, 0, stocks_to_update
+        last_day, prev_day = trade_days[-1], trade_days[-2]
+        
+        # 只有本地最新日期恰好是上一交易日的股票才可能走行情快照
+        candidates = [code for code, _ in stocks_to_update
+                      if code in latest_info and latest_info[code][0] == prev_day.date()]
+        print(f"\n正在批量获取行情快照 ({len(candidates)} 只, 交易日 {last_day:%Y-%m-%d})...")
+        quote_bars = self._fetch_quote_bars_tencent(candidates) if candidates else {}
+        
+        appended = 0
+        suspended = 0
+        fallback = []
+        candidate_set = set(candidates)
+        for code, days_to_fetch in stocks_to_update:
+            quote = quote_bars.get(code)
+            if code not in candidate_set:
+                fallback.append((code, days_to_fetch))
+                continue
+            if quote is None:
+                # 行情中没有成交：停牌或接口缺失，与逐只抓取一样不会有当日K线
+                suspended += 1
+                continue
+            latest_close = latest_info[code][1]
+            if quote['date'] != last_day or abs(quote['prev_close'] - latest_close) > 0.005:
+                # 日期不符或昨收与本地不一致（除权除息，需要重新获取前复权历史）
+                fallback.append((code, days_to_fetch))
+                continue
+            
+            df = pd.DataFrame([{
+                'date': quote['date'],
+                'open': quote['open'],
+                'close': quote['close'],
+                'high': quote['high'],
+                'low': quote['low'],
+                'volume': quote['volume'],
+                'amount': 0,
+                'turnover': 0,
+                'market_cap': market_cap_map.get(code) or quote['market_cap'],
+            }])
+            self.csv_manager.merge_stock(code, df)
+            appended += 1
+        
+        print(f"  ✓ 行情快照追加 {appended} 只, 停牌 {suspended} 只, 回退K线抓取 {len(fallback)} 只")
+        return appended, suspended, fallback
     
     def daily_update(self, max_stocks=None):
         """
@@ -781,6 +1004,7 @@ class AKShareFetcher:
         """
         from datetime import datetime
         
+        request_counter.reset()
         existing_stocks = self.csv_manager.list_all_stocks()
         
         if not existing_stocks:
@@ -831,25 +1055,20 @@ class AKShareFetcher:
             print("=" * 60)
             return
         
-        # 预筛选：快速检查哪些股票需要更新（只读取第一行）
+        # 预筛选：快速检查哪些股票需要更新（查股票清单，不打开数据文件）
         stocks_to_update = []
+        latest_info = {}
         print("  正在检查股票更新状态...")
         
         for code in existing_stocks:
-            # 快速读取：只读CSV第一行（最新日期）
-            path = self.csv_manager.get_stock_path(code)
-            if not path.exists():
-                stocks_to_update.append((code, 30))  # 默认取30天
-                continue
-            
             try:
-                # 只读取第一行（header + 第一行数据）
-                df_quick = pd.read_csv(path, nrows=1)
-                if df_quick.empty:
-                    stocks_to_update.append((code, 30))
+                latest = self.csv_manager.get_latest(code)
+                if latest is None:
+                    stocks_to_update.append((code, 30))  # 默认取30天
                     continue
                 
-                latest_date = pd.to_datetime(df_quick.iloc[0]['date']).date()
+                latest_date = latest[0]
+                latest_info[code] = latest
                 days_needed = (today - latest_date).days
                 
                 if days_needed > 0:
@@ -871,6 +1090,7 @@ class AKShareFetcher:
         print(f"  需要更新: {need_update} 只, 已最新: {skipped} 只")
         
         if need_update == 0:
+            self.csv_manager.save_manifest()
             # 只有在完整更新（非max_stocks模式）且收盘后才记录缓存
             if not max_stocks and is_after_market_close:
                 update_cache['last_update_date'] = today_str
@@ -880,65 +1100,40 @@ class AKShareFetcher:
             print("=" * 60)
             return
         
-        # 批量获取最新市值数据（主接口：akshare，备选：腾讯）
+        # 批量获取最新市值数据（主接口：akshare，备选：腾讯，只获取需要更新的股票）
         print("\n正在批量获取最新市值数据...")
-        market_cap_map = {}
+        market_cap_map = self._fetch_market_cap_map([code for code, _ in stocks_to_update])
         
-        # 方法1: 尝试akshare接口
-        try:
-            import akshare as ak
-            spot_df = ak.stock_zh_a_spot_em()
-            for _, row in spot_df.iterrows():
-                code = str(row['代码']).zfill(6)
-                cap = row['总市值']
-                if pd.notna(cap) and cap > 0:
-                    # 统一转为元
-                    if cap < 1e10:
-                        cap = int(cap * 1e8)
-                    else:
-                        cap = int(cap)
-                    market_cap_map[code] = cap
-            print(f"  ✓ akshare接口成功: {len(market_cap_map)} 只股票市值")
-        except Exception as e:
-            print(f"  akshare接口失败: {e}")
-            print("  尝试腾讯备选接口...")
-            # 方法2: 使用腾讯接口备选（只获取需要更新的股票）
-            update_codes = [code for code, _ in stocks_to_update]
-            market_cap_map = self._fetch_market_cap_tencent(update_codes)
-            if market_cap_map:
-                print(f"  ✓ 腾讯接口成功: {len(market_cap_map)} 只股票市值")
-            else:
-                print(f"  ✗ 腾讯接口也失败，市值数据将缺失")
+        # 批量行情快照追加当日K线，剩余股票逐只抓取
+        if self.quote_update:
+            with request_counter.phase('行情快照'):
+                appended, suspended, stocks_to_update = self._update_from_quotes(
+                    stocks_to_update, latest_info, market_cap_map)
+            updated += appended
+            skipped += suspended
+            need_update = len(stocks_to_update)
         
-        print(f"\n开始更新 {need_update} 只股票...")
+        print(f"\n开始更新 {need_update} 只股票 (并发 {self.workers})...")
         print("=" * 60)
         
-        for i, (code, days_to_fetch) in enumerate(stocks_to_update, 1):
-            print(f"[{i}/{need_update}] 更新 {code} (需获取 {days_to_fetch} 天数据)...", end=" ")
-            
-            # 重新读取现有数据以获取旧记录数
-            existing_df = self.csv_manager.read_stock(code)
-            old_count = len(existing_df)
-            
-            df = self.fetch_stock_update(code, days=days_to_fetch)
-            
-            if df is not None and not df.empty:
-                # 更新市值数据（和价格数据一起更新）
-                if code in market_cap_map:
-                    df['market_cap'] = market_cap_map[code]
-                self.csv_manager.update_stock(code, df)
-                new_df = self.csv_manager.read_stock(code)
-                new_count = len(new_df)
-                added = new_count - old_count
-                print(f"✓ (新增 {added} 条)")
-                updated += 1
-            else:
-                print("✗ 失败")
-                failed += 1
+        # 并发抓取，结果按完成顺序逐只写入（市值使用批量获取的数据）
+        tasks = [(code, days_to_fetch, market_cap_map.get(code)) for code, days_to_fetch in stocks_to_update]
+        with request_counter.phase('K线'):
+            results = self._fetch_concurrently(tasks, self.fetch_stock_update)
+            for i, ((code, days_to_fetch, _), df) in enumerate(results, 1):
+                print(f"[{i}/{need_update}] 更新 {code} (需获取 {days_to_fetch} 天数据)...", end=" ")
             
-            if i % 10 == 0:
-                time.sleep(0.1)  # 降低限速
+                if df is not None and not df.empty:
+                    # 读取一次、内存合并、写入一次，新增行数由合并结果得出
+                    _, added = self.csv_manager.merge_stock(code, df)
+                    print(f"✓ (新增 {added} 条)")
+                    updated += 1
+                else:
+                    print("✗ 失败")
+                    failed += 1
         
+        self.csv_manager.save_manifest()
+            
         # 更新缓存记录
         update_cache['last_update_date'] = today_str
         with open(update_cache_file, 'w', encoding='utf-8') as f:
@@ -946,3 +1141,4 @@ class AKShareFetcher:
         
         print("=" * 60)
         print(f"完成! 更新成功: {updated}, 跳过: {skipped}, 失败: {failed}")
+        request_counter.report()
@@ -0,0 +1,386 @@
+"""
+历史相似走势检索 - 全市场所有 (股票, 截止日) 滑动窗口的运动模式（motif）索引
+
+- 数据来自全市场行情面板，停牌日先用 CompactIndex 压缩，窗口只跨有效K线
+- 每个窗口的收盘价、成交量曲线分别做 z 标准化（z 标准化对 _extract_shape_features
+  的 0-1 归一化不变，查询可以直接用特征中的 normalized_curve），两条曲线的
+  平方欧氏距离加权求和作为窗口距离
+- 按 MASS 的思路用 FFT 计算距离剖面：建索引时预先算好每只股票序列的频谱和
+  全部窗口的标准差，查询时每条曲线只需一次逆 FFT 即得到与所有窗口的距离，
+  不需要展开窗口矩阵（全市场约六百万个窗口也只占几百MB内存）
+- 同一只股票相邻窗口几乎相同，取 Top K 时以窗口长度为排除区，每段走势只保留最近的一个
+- 指定 cache_dir 时，建好的频谱、窗口标准差、曲线和收益保存为 .npy，再次运行时按内存映射加载；
+  面板版本、日期轴、参与的股票或其数据文件变化后自动重建
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.fft import irfft, next_fast_len, rfft
+
+from strategy.pattern_feature_extractor import normalize_curve
+from utils.backtest import DEFAULT_HORIZONS, load_raw, signal_dates, forward_returns
+from utils.technical_panel import CompactIndex
+
+
+# 默认窗口长度（与B1匹配的回看天数一致）
+DEFAULT_WINDOW = 25
+
+# 默认返回的相似窗口数
+DEFAULT_TOP_K = 10
+
+# 标准差低于该值的窗口视为平坦（z 标准化后为全零）
+FLAT_STD = 1e-8
+
+# 计算窗口标准差时每块的股票数
+STD_CHUNK = 256
+
+# 索引的曲线字段
+CHANNELS = ('close', 'volume')
+
+# 索引缓存格式版本（缓存内容变化时递增，旧缓存自动重建）
+CACHE_VERSION = 1
+
+# 缓存目录中的元信息文件（最后写入，存在且缓存键一致才加载）
+CACHE_META = 'meta.json'
+
+
+def znormalize(values):
+    """z 标准化（总体标准差），平坦序列返回全零"""
+    values = np.asarray(values, dtype=float)
+    std = values.std()
+    if std <= FLAT_STD * max(1.0, np.abs(values).max()):
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+
+class _Channel:
+    """单条曲线（收盘价或成交量）的频谱和滑动统计量"""
+    
+    @classmethod
+    def from_arrays(cls, spectrum, inv_std, window, fft_size):
+        """由缓存的频谱和窗口标准差倒数恢复（非平坦窗口的倒数必然大于 0）"""
+        channel = cls.__new__(cls)
+        channel.window = window
+        channel.fft_size = fft_size
+        channel.spectrum = spectrum
+        channel.inv_std = inv_std
+        channel.flat = inv_std == 0
+        return channel
+    
+    def __init__(self, values, window, fft_size):
+        """
+        :param values: (股票数, T) 压缩后的序列，只含前导NaN
+        """
+        valid = ~np.isnan(values)
+        counts = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+        filled = np.where(valid, values, 0.0)
+        # 按股票整体标准化后再做 FFT，避免成交量等大数值在点积中的舍入误差；
+        # 窗口的 z 标准化对这一线性变换不变
+        mean = filled.sum(axis=1, keepdims=True) / counts
+        std = np.sqrt((np.where(valid, filled - mean, 0.0) ** 2).sum(axis=1, keepdims=True) / counts)
+        std[~(std > 0)] = 1.0
+        series = np.where(valid, (filled - mean) / std, 0.0)
+        self.window = window
+        self.fft_size = fft_size
+        self.spectrum = rfft(series, fft_size, axis=1, workers=-1)
+        
+        # 窗口标准差按股票分块两遍计算（累加和相减在近乎平坦的窗口上误差过大）
+        win_std = np.empty((series.shape[0], max(series.shape[1] - window + 1, 0)))
+        for start in range(0, series.shape[0], STD_CHUNK):
+            view = np.lib.stride_tricks.sliding_window_view(series[start:start + STD_CHUNK], window, axis=1)
+            win_std[start:start + STD_CHUNK] = view.std(axis=-1)
+        self.flat = win_std <= FLAT_STD
+        self.inv_std = np.where(self.flat, 0.0, 1.0 / np.where(self.flat, 1.0, win_std))
+    
+    def norm(self):
+        """各窗口 z 标准化后的平方范数（平坦窗口为 0）"""
+        return np.where(self.flat, 0.0, float(self.window))
+    
+    def dot(self, query):
+        """
+        已 z 标准化的查询与全部窗口（z 标准化后）的点积
+        查询均值为 0，点积不受窗口均值影响，只需除以窗口标准差
+        :return: (股票数, 窗口数)
+        """
+        kernel = rfft(query[::-1], self.fft_size)
+        dot = irfft(self.spectrum * kernel, self.fft_size, axis=1, workers=-1)
+        return dot[:, self.window - 1:self.window - 1 + self.inv_std.shape[1]] * self.inv_std
+
+
+class AnalogIndex:
+    """
+    全市场历史窗口索引
+    
+    用法:
+        index = AnalogIndex(load_market_panel(data_dir))
+        table = index.query_stock('600519', end_date='2024-03-01', k=20)
+    """
+    
+    def __init__(self, panel, stock_codes=None, window=DEFAULT_WINDOW, horizons=DEFAULT_HORIZONS,
+                 volume_weight=1.0, cache_dir=None):
+        """
+        :param panel: 已加载的 MarketPanel
+        :param stock_codes: 参与索引的股票，None 表示面板中全部股票
+        :param window: 窗口长度（K线数）
+        :param horizons: 窗口截止日之后统计收益的持有期
+        :param volume_weight: 成交量曲线距离的权重（收盘价为 1）
+        :param cache_dir: 索引缓存目录，None 表示每次重建
+        """
+        self.window = window
+        self.horizons = tuple(horizons)
+        self.volume_weight = volume_weight
+        self.cached = False  # 是否由缓存加载
+        
+        key = self._cache_key(panel, stock_codes) if cache_dir is not None else None
+        if key is not None and self._load(Path(cache_dir), key):
+            self.cached = True
+        else:
+            self._build(panel, stock_codes)
+            if key is not None:
+                self._save(Path(cache_dir), key)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        
+        # 与查询无关的部分：窗口平方范数的加权和，无效窗口为 inf
+        self._base = self.channels['close'].norm() + volume_weight * self.channels['volume'].norm()
+        self._base[~self.valid] = np.inf
+    
+    def _build(self, panel, stock_codes):
+        """由面板计算频谱、窗口标准差、曲线、日期和后续收益"""
+        self.codes, raw = load_raw(panel, stock_codes)
+        index = CompactIndex.from_values(raw['close'])
+        close = index.compact(raw['close'])
+        compacted = {field: index.compact(raw[field]).T for field in CHANNELS}
+        
+        n_rows = close.shape[0]
+        self.n_windows = max(n_rows - self.window + 1, 0)
+        self.fft_size = next_fast_len(max(n_rows + self.window - 1, 2), real=True)
+        self.channels = {field: _Channel(compacted[field], self.window, self.fft_size) for field in CHANNELS}
+        
+        # 窗口 j 的截止行为 j + window - 1；窗口必须完全落在有效K线内
+        first_valid = n_rows - index.counts
+        self.valid = np.arange(self.n_windows)[None, :] >= first_valid[:, None]
+        self.dates = signal_dates(index, panel.date_values()).T[:, self.window - 1:]
+        self.returns = {
+            n: ret.T[:, self.window - 1:]
+            for n, (ret, _) in forward_returns(close, index.compact(raw['low']), self.horizons).items()
+        }
+        self._raw = compacted
+    
+    def _cache_key(self, panel, stock_codes):
+        """缓存键：面板版本、日期轴、参与的股票及其数据文件版本、窗口和持有期，任一变化都重建"""
+        codes = [code for code in (panel.codes if stock_codes is None else stock_codes) if code in panel.code_index]
+        files = getattr(panel, 'files', {})
+        dates = [str(date) for date in panel.date_values()]
+        content = {
+            'cache_version': CACHE_VERSION,
+            'panel_version': getattr(panel, 'version', 0),
+            'dates': [dates[0], dates[-1], len(dates)] if dates else [],
+            'codes': codes,
+            'files': [files.get(code) for code in codes],
+            'window': self.window,
+            'horizons': self.horizons,
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def _cache_arrays(self):
+        """需要缓存的数组 {文件名: 数组}"""
+        arrays = {'valid': self.valid, 'dates': self.dates}
+        for field in CHANNELS:
+            arrays[f'{field}_spectrum'] = self.channels[field].spectrum
+            arrays[f'{field}_inv_std'] = self.channels[field].inv_std
+            arrays[f'{field}_curve'] = self._raw[field]
+        arrays.update({f'return_{n}': ret for n, ret in self.returns.items()})
+        return arrays
+    
+    def _save(self, cache_dir, key):
+        """
+        保存索引：先删除元信息使旧缓存失效，数组写入临时文件后原子替换
+        （其他进程已映射的旧文件不受影响），最后写入元信息
+        """
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        meta_file = cache_dir / CACHE_META
+        meta_file.unlink(missing_ok=True)
+        for name, values in self._cache_arrays().items():
+            tmp = cache_dir / f'{name}.tmp.npy'
+            np.save(tmp, values)
+            os.replace(tmp, cache_dir / f'{name}.npy')
+        meta = {'key': key, 'codes': self.codes, 'n_windows': self.n_windows, 'fft_size': self.fft_size}
+        tmp = meta_file.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_file)
+    
+    def _load(self, cache_dir, key):
+        """按内存映射加载缓存，缓存不存在、键不一致或文件损坏时返回 False"""
+        try:
+            with open(cache_dir / CACHE_META, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('key') != key:
+                return False
+            
+            def load(name):
+                return np.load(cache_dir / f'{name}.npy', mmap_mode='r')
+            
+            self.codes = meta['codes']
+            self.n_windows = meta['n_windows']
+            self.fft_size = meta['fft_size']
+            self.valid = load('valid')
+            self.dates = load('dates')
+            self.channels = {
+                field: _Channel.from_arrays(load(f'{field}_spectrum'), load(f'{field}_inv_std'),
+                                            self.window, self.fft_size)
+                for field in CHANNELS
+            }
+            self._raw = {field: load(f'{field}_curve') for field in CHANNELS}
+            self.returns = {n: load(f'return_{n}') for n in self.horizons}
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+    
+    @property
+    def size(self):
+        """索引中的有效窗口数"""
+        return int(self.valid.sum())
+    
+    def window_of(self, stock_code, end_date=None):
+        """
+        某只股票截止到 end_date（含，None 表示最新）的窗口
+        :return: (股票下标, 窗口下标)，数据不足时返回 None
+        """
+        col = self.code_index.get(stock_code)
+        if col is None:
+            return None
+        ends = np.nonzero(self.valid[col])[0]
+        if end_date is not None:
+            ends = ends[self.dates[col, ends] <= np.datetime64(end_date, 'D')]
+        if not len(ends):
+            return None
+        return col, int(ends[-1])
+    
+    def curves(self, col, j):
+        """窗口的原始收盘价、成交量曲线（时间正序）"""
+        return tuple(self._raw[field][col, j:j + self.window] for field in CHANNELS)
+    
+    def distances(self, close, volume):
+        """
+        查询曲线与全部窗口的距离
+        :param close / volume: 长度为 window 的曲线（任意尺度，时间正序）
+        :return: (总距离, 收盘价距离, 成交量距离)，均为 (股票数, 窗口数)，无效窗口的总距离为 inf
+        """
+        squared, norms, dots = self._profile(close, volume)
+        close_dist, volume_dist = (
+            np.sqrt(np.maximum(norms[field] + self.channels[field].norm() - 2 * dots[field], 0))
+            for field in CHANNELS
+        )
+        return np.sqrt(np.maximum(squared, 0)), close_dist, volume_dist
+    
+    def query(self, close, volume, k=DEFAULT_TOP_K, exclude=None, before=None):
+        """
+        查询最相似的 k 个历史窗口
+        :param close / volume: 长度为 window 的曲线
+        :param exclude: (股票下标, 窗口下标)，该窗口及其排除区内的同股窗口不参与（查询自身时使用）
+        :param before: 只检索截止日早于该日期的窗口（YYYY-MM-DD）
+        :return: DataFrame（stock_code, end_date, distance, close_distance, volume_distance,
+                 return_<N>d...），距离升序，收益为截止日收盘买入持有 N 天的百分比
+        """
+        squared, norms, dots = self._profile(close, volume)
+        if exclude is not None:
+            col, j = exclude
+            squared[col, max(0, j - self.window + 1):j + self.window] = np.inf
+        if before is not None:
+            squared[~(self.dates < np.datetime64(before, 'D'))] = np.inf
+        
+        rows = []
+        for col, j in self._top_k(squared, k):
+            row = {
+                'stock_code': self.codes[col],
+                'end_date': str(self.dates[col, j]),
+                'distance': np.sqrt(max(squared[col, j], 0)),
+            }
+            for field in CHANNELS:
+                channel = self.channels[field]
+                norm = 0.0 if channel.flat[col, j] else float(self.window)
+                row[f'{field}_distance'] = np.sqrt(max(norms[field] + norm - 2 * dots[field][col, j], 0))
+            row.update({f'return_{n}d': self.returns[n][col, j] * 100 for n in self.horizons})
+            rows.append(row)
+        columns = ['stock_code', 'end_date', 'distance', 'close_distance', 'volume_distance',
+                   *(f'return_{n}d' for n in self.horizons)]
+        return pd.DataFrame(rows, columns=columns)
+    
+    def query_stock(self, stock_code, end_date=None, k=DEFAULT_TOP_K, before=None):
+        """
+        以某只股票截止到 end_date 的窗口为查询，排除自身附近的窗口
+        :return: DataFrame（见 query），股票不在索引中或K线不足时返回 None
+        """
+        position = self.window_of(stock_code, end_date)
+        if position is None:
+            return None
+        close, volume = self.curves(*position)
+        return self.query(close, volume, k=k, exclude=position, before=before)
+    
+    def _profile(self, close, volume):
+        """
+        查询的平方距离剖面
+        :return: (加权平方距离, {曲线: 查询平方范数}, {曲线: 点积})，无效窗口的平方距离为 inf
+        """
+        queries = {
+            'close': znormalize(normalize_curve(np.asarray(close, dtype=float))),
+            'volume': znormalize(normalize_curve(np.asarray(volume, dtype=float))),
+        }
+        for field, query in queries.items():
+            if len(query) != self.window:
+                raise ValueError(f"{field} 曲线长度 {len(query)} 与索引窗口 {self.window} 不一致")
+        
+        norms = {field: float(np.dot(query, query)) for field, query in queries.items()}
+        dots = {field: self.channels[field].dot(queries[field]) for field in CHANNELS}
+        # |q - t|^2 = |q|^2 + |t|^2 - 2 q·t，两条曲线按权重相加（原地运算，避免多余的全量临时数组）
+        squared = self.volume_weight * dots['volume']
+        squared += dots['close']
+        squared *= -2
+        squared += self._base
+        squared += norms['close'] + self.volume_weight * norms['volume']
+        return squared, norms, dots
+    
+    def _top_k(self, squared, k):
+        """
+        平方距离最小的 k 个窗口，同一股票的窗口互相间隔至少一个窗口长度
+        每选中一个窗口最多排除 2 * window - 1 个候选，取这么多倍的最近候选即可保证结果精确
+        """
+        flat = squared.ravel()
+        m = min(int(np.isfinite(flat).sum()), k * (2 * self.window - 1))
+        if m <= 0:
+            return []
+        candidates = np.argpartition(flat, m - 1)[:m]
+        candidates = candidates[np.argsort(flat[candidates], kind='stable')]
+        
+        picked = []
+        for position in candidates:
+            col, j = divmod(int(position), squared.shape[1])
+            if any(col == c and abs(j - p) < self.window for c, p in picked):
+                continue
+            picked.append((col, j))
+            if len(picked) == k:
+                break
+        return picked
+
+
+def summarize_analogs(table, horizons=DEFAULT_HORIZONS):
+    """
+    相似窗口的后续收益统计
+    :return: DataFrame（horizon, analogs, mean_return, median_return, hit_rate），百分比
+    """
+    rows = []
+    for n in horizons:
+        ret = table[f'return_{n}d'].dropna()
+        rows.append({
+            'horizon': n,
+            'analogs': len(ret),
+            'mean_return': ret.mean() if len(ret) else np.nan,
+            'median_return': ret.median() if len(ret) else np.nan,
+            'hit_rate': (ret > 0).mean() * 100 if len(ret) else np.nan,
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,170 @@
+"""
+历史信号回测 - 基于全市场面板，一次性计算每只股票每个交易日的选股信号
+
+流程：
+1. 从行情面板取出原始行情 (时间正序 × 股票)
+2. 策略的 history_indicators / history_signals 在压缩（底部对齐）数组上
+   向量化计算全部交易日的信号和分类，不逐日调用 select_stocks
+3. 以信号日收盘价买入，统计持有 N 个交易日（停牌日不计）后的收益、
+   胜率和持有期内的最大回撤，按分类汇总
+
+指标全部是因果的（只用到当日及以前的数据），第 t 行的信号等价于
+截至该日的数据做一次选股；市值快照只有最新一份，单位异常的股票按当前市值判断。
+"""
+import numpy as np
+import pandas as pd
+
+
+# 默认持有期（交易日）
+DEFAULT_HORIZONS = (1, 3, 5, 10)
+
+# 回测用到的面板字段
+BACKTEST_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'market_cap')
+
+
+def load_raw(panel, stock_codes=None):
+    """
+    从面板取出回测所需的原始行情
+    :param stock_codes: 参与回测的股票，None 表示面板中全部股票
+    :return: (股票代码列表, {字段: (时间正序 × 股票) 数组})，取全部股票时为面板内存映射的只读视图（不复制），
+             只取部分股票时才按列复制
+    """
+    if stock_codes is None:
+        stock_codes = panel.codes
+    codes = [code for code in stock_codes if code in panel.code_index]
+    if codes == list(panel.codes):
+        return codes, {field: np.asarray(panel.field(field), dtype=float) for field in BACKTEST_FIELDS}
+    cols = np.array([panel.code_index[code] for code in codes], dtype=np.int64)
+    raw = {field: np.asarray(panel.field(field)[:, cols], dtype=float) for field in BACKTEST_FIELDS}
+    return codes, raw
+
+
+def signal_dates(index, dates):
+    """
+    压缩数组每个位置对应的交易日
+    :param dates: 面板日期轴（datetime64数组）
+    :return: datetime64 数组，无数据的位置为 NaT
+    """
+    out = np.full(index.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+    valid = index.source_rows >= 0
+    out[valid] = dates[index.source_rows[valid]]
+    return out
+
+
+def forward_returns(close, low, horizons=DEFAULT_HORIZONS):
+    """
+    以当日收盘价买入、持有 N 根K线后的收益和持有期最大回撤
+    :param close: 压缩后的收盘价
+    :param low: 压缩后的最低价
+    :return: {N: (收益率数组, 最大回撤数组)}，持有期超出数据末尾的位置为 NaN
+    """
+    results = {}
+    low_min = np.full(close.shape, np.inf)
+    for n in range(1, max(horizons) + 1):
+        # 持有期第 n 天的最低价（底部对齐数组中同一列向下 n 行）
+        shifted = np.full(close.shape, np.nan)
+        shifted[:-n] = low[n:]
+        low_min = np.fmin(low_min, shifted)
+        if n not in horizons:
+            continue
+        exit_close = np.full(close.shape, np.nan)
+        exit_close[:-n] = close[n:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret = exit_close / close - 1
+            drawdown = np.minimum(low_min / close - 1, 0)
+        drawdown[np.isnan(ret)] = np.nan
+        results[n] = (ret, drawdown)
+    return results
+
+
+def summarize(signal, category, returns, categories, mask=None):
+    """
+    按分类和持有期汇总信号表现
+    :param signal: 信号布尔数组
+    :param category: 分类编号数组（categories 下标，-1 为无）
+    :param returns: forward_returns 的结果
+    :param categories: 分类名称列表
+    :param mask: 额外的布尔掩码（如日期范围），None 表示不限
+    :return: DataFrame（category, horizon, signals, mean_return, median_return, hit_rate,
+             mean_drawdown, max_drawdown），收益类指标为百分比
+    """
+    if mask is not None:
+        signal = signal & mask
+    groups = [('all', signal)] + [(name, signal & (category == i)) for i, name in enumerate(categories)]
+    
+    rows = []
+    for name, selected in groups:
+        for n, (ret, drawdown) in returns.items():
+            picked = selected & ~np.isnan(ret)
+            rows.append(dict({'category': name, 'horizon': n}, **return_metrics(ret[picked], drawdown[picked])))
+    return pd.DataFrame(rows)
+
+
+def return_metrics(ret, drawdown):
+    """
+    一组信号的收益统计
+    :param ret: 各信号的持有期收益（不含NaN）
+    :param drawdown: 各信号的持有期最大回撤
+    :return: dict（signals, mean_return, median_return, hit_rate, mean_drawdown, max_drawdown），百分比
+    """
+    if not len(ret):
+        return {'signals': 0, 'mean_return': np.nan, 'median_return': np.nan, 'hit_rate': np.nan,
+                'mean_drawdown': np.nan, 'max_drawdown': np.nan}
+    return {
+        'signals': len(ret),
+        'mean_return': ret.mean() * 100,
+        'median_return': np.median(ret) * 100,
+        'hit_rate': (ret > 0).mean() * 100,
+        'mean_drawdown': drawdown.mean() * 100,
+        'max_drawdown': drawdown.min() * 100,
+    }
+
+
+def date_mask(dates, start=None, end=None):
+    """信号日期在 [start, end] 内的掩码（YYYY-MM-DD，None 表示不限）"""
+    mask = ~np.isnat(dates)
+    if start:
+        mask &= dates >= np.datetime64(start, 'D')
+    if end:
+        mask &= dates <= np.datetime64(end, 'D')
+    return mask
+
+
+def run_backtest(strategy, panel, stock_codes=None, horizons=DEFAULT_HORIZONS, start=None, end=None):
+    """
+    对支持历史信号的策略做全市场回测
+    :param strategy: 实现 history_indicators / history_signals 的策略
+    :param panel: 已加载的 MarketPanel
+    :param start / end: 只统计该日期范围内的信号（指标仍使用全部历史计算）
+    :return: dict（summary: 汇总表, signals: 信号总数, stocks: 出现过信号的股票数, dates: 统计的交易日数）
+    """
+    codes, raw = load_raw(panel, stock_codes)
+    data = strategy.history_indicators(raw, codes)
+    signal, category = strategy.history_signals(data)
+    returns = forward_returns(data['close'], data['low'], horizons)
+    
+    dates = signal_dates(data['index'], panel.date_values())
+    mask = date_mask(dates, start, end)
+    selected = signal & mask
+    return {
+        'summary': summarize(signal, category, returns, strategy.history_categories, mask),
+        'signals': int(selected.sum()),
+        'stocks': int(selected.any(axis=0).sum()),
+        'dates': len(np.unique(dates[mask])),
+    }
+
+
+def print_summary(summary):
+    """打印回测汇总表"""
+    labels = {
+        'all': '全部',
+        'bowl_center': '回落碗中',
+        'near_duokong': '靠近多空线',
+        'near_short_trend': '靠近短期趋势线',
+    }
+    print(f"{'分类':<10}{'持有':>6}{'信号数':>10}{'平均收益%':>12}{'中位收益%':>12}"
+          f"{'胜率%':>10}{'平均回撤%':>12}{'最大回撤%':>12}")
+    for row in summary.itertuples(index=False):
+        print(f"{labels.get(row.category, row.category):<10}{row.horizon:>5}天{row.signals:>10}"
+              f"{row.mean_return:>12.2f}{row.median_return:>12.2f}{row.hit_rate:>10.1f}"
+              f"{row.mean_drawdown:>12.2f}{row.max_drawdown:>12.2f}")
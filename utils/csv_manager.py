@@ -1,17 +1,80 @@
 """
 CSV 数据管理工具
+
+支持两种存储格式（同一套 read_stock/write_stock/update_stock/list_all_stocks 接口）：
+- csv: 每只股票一个CSV文件（默认，兼容旧数据）
+- feather: Arrow IPC 列式二进制文件，列类型固定，读取无需解析文本和日期
+
+数据目录下的 .storage_format 标记文件记录当前使用的格式，
+由 `python main.py migrate` 迁移完成后写入。
+
+文件内的行顺序由 .storage_order 标记记录：
+- asc:  按时间正序（新数据目录的默认值），每日更新只解析并重写文件尾部的重叠行，其余字节原样复制
+- desc: 按时间倒序（旧数据目录，无标记且已有数据时），更新需要重写整个文件
+- mixed: 原地转换行顺序的过程中（或转换中断后），新旧顺序的文件并存，读取时按每个文件的首末日期判断顺序
+无论哪种顺序，read_stock/read_latest 都返回倒序（最新在前）的数据。
 """
+import io
 import os
 import pandas as pd
 from pathlib import Path
 
+from utils.stock_manifest import StockManifest
+
+try:
+    import pyarrow.feather as feather
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+# 支持的存储格式
+STORAGE_FORMATS = ('csv', 'feather')
+
+# 存储格式标记文件（位于数据目录下）
+STORAGE_MARKER_FILE = '.storage_format'
+
+# 文件内行顺序标记文件（位于数据目录下）
+STORAGE_ORDER_FILE = '.storage_order'
+STORAGE_ORDERS = ('asc', 'desc')
+MIXED_ORDER = 'mixed'
+
+# 反向查找文件尾部行时每次读取的字节数
+TAIL_BLOCK_SIZE = 8192
+
+# 列式存储的固定列类型
+COLUMN_DTYPES = {
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'volume': 'int64',
+    'amount': 'float64',
+    'turnover': 'float64',
+    'market_cap': 'float64',
+}
+
 
 class CSVManager:
     """CSV文件管理器"""
     
-    def __init__(self, data_dir):
+    FILE_SUFFIX = '.csv'
+    STORAGE_FORMAT = 'csv'
+    
+    def __init__(self, data_dir, order=None):
+        """
+        :param order: 文件内行顺序（asc/desc/mixed），None 表示按数据目录下的顺序标记自动选择
+        """
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.order = order or read_storage_order(self.data_dir)
+        # mixed 目录按正序写入，但不做尾部追加（文件实际顺序不确定）
+        self.mixed = self.order == MIXED_ORDER
+        self.ascending = self.order != 'desc'
+        self.manifest = StockManifest(self.data_dir, self.STORAGE_FORMAT).load()
+        if not self.manifest.complete and not self.manifest.manifest_file.exists():
+            # 全新的数据目录：空清单即完整清单
+            self.manifest.complete = next(self.data_dir.rglob(f"*{self.FILE_SUFFIX}"), None) is None
     
     def get_stock_path(self, stock_code):
         """获取股票CSV文件路径"""
@@ -19,7 +82,94 @@ class CSVManager:
         prefix = stock_code[:2] if len(stock_code) >= 2 else stock_code
         subdir = self.data_dir / prefix
         subdir.mkdir(exist_ok=True)
-        return subdir / f"{stock_code}.csv"
+        return subdir / f"{stock_code}{self.FILE_SUFFIX}"
+    
+    def _read_file(self, path, nrows=None):
+        """读取单个数据文件（按文件内顺序，nrows 取前N行）"""
+        return pd.read_csv(path, parse_dates=['date'], nrows=nrows)
+    
+    def _read_tail(self, path, n):
+        """读取文件最后n行（按文件内顺序）"""
+        return self._read_from(path, self._tail_offset(path, n))
+    
+    def _read_from(self, path, offset):
+        """读取表头和从 offset 字节开始的数据行"""
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(max(offset, len(header)))
+            body = f.read()
+        return pd.read_csv(io.BytesIO(header + body), parse_dates=['date'])
+    
+    def _tail_offset(self, path, n):
+        """文件最后n行数据的起始字节偏移（不足n行时为表头之后），从文件末尾分块反向查找换行符"""
+        with open(path, 'rb') as f:
+            header_end = len(f.readline())
+            end = f.seek(0, os.SEEK_END)
+            if end <= header_end:
+                return header_end
+            f.seek(end - 1)
+            # 末尾换行属于最后一行，需要多找一个换行符
+            remaining = n + 1 if f.read(1) == b'\n' else n
+            pos = end
+            while pos > header_end:
+                size = min(TAIL_BLOCK_SIZE, pos - header_end)
+                pos -= size
+                f.seek(pos)
+                chunk = f.read(size)
+                i = len(chunk)
+                while True:
+                    i = chunk.rfind(b'\n', 0, i)
+                    if i < 0:
+                        break
+                    remaining -= 1
+                    if remaining == 0:
+                        return pos + i + 1
+        return header_end
+    
+    def _write_file(self, path, df):
+        """写入单个数据文件"""
+        df.to_csv(path, index=False)
+    
+    def _append(self, stock_code, path, new_df):
+        """
+        时间正序文件的追加写入：只解析与新数据重叠的尾部行，之前的字节原样复制，再写入合并结果
+        :param new_df: 已去重排序（正序）的新数据
+        :return: (路径, 新增行数)；列不一致或重叠超出尾部窗口时返回 None（整体重写）
+        """
+        offset = self._tail_offset(path, len(new_df) + 1)
+        tail = self._read_from(path, offset)
+        columns = list(tail.columns)
+        if set(new_df.columns) != set(columns) or not pd.api.types.is_datetime64_any_dtype(tail['date']):
+            return None
+        # 读到的尾部行数已满且最早一行不早于新数据，说明更早的行也可能重叠
+        if len(tail) > len(new_df) and tail['date'].iloc[0] >= new_df['date'].iloc[0]:
+            return None
+        
+        merged = self._prepare(pd.concat([tail, new_df[columns]], ignore_index=True))
+        # 未变化的前 offset 字节和合并后的尾部写入临时文件再替换，中断时原文件保持完整
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(src.read(offset))
+            dst.write(merged.to_csv(index=False, header=False).encode('utf-8'))
+        os.replace(tmp_path, path)
+        added = len(merged) - len(tail)
+        if not self.manifest.record_append(stock_code, path, merged, added):
+            self._scan_into_manifest(stock_code, path)
+        return path, added
+    
+    def _count_rows(self, path):
+        """数据行数（统计换行符，不解析内容）"""
+        rows = 0
+        last = b'\n'
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                rows += chunk.count(b'\n')
+                last = chunk[-1:]
+        # 末行没有换行符时补1行，再去掉表头
+        return rows + (last != b'\n') - 1
     
     def read_stock(self, stock_code):
         """读取股票数据"""
@@ -32,47 +182,173 @@ class CSVManager:
             return pd.DataFrame()
         
         try:
-            df = pd.read_csv(path, parse_dates=['date'])
+            df = self._read_file(path)
+            if self._file_ascending(df):
+                df = df.iloc[::-1].reset_index(drop=True)
+            # 记录股票代码，供策略查询市值快照等使用
+            df.attrs['code'] = stock_code
+            return df
+        except Exception as e:
+            print(f"  读取 {stock_code} 数据失败: {e}")
+            return pd.DataFrame()
+    
+    def read_latest(self, stock_code, n=1):
+        """只读取最新的n条数据（倒序，最新在前）"""
+        path = self.get_stock_path(stock_code)
+        if not path.exists() or path.stat().st_size == 0:
+            return pd.DataFrame()
+        
+        if self.mixed:
+            return self.read_stock(stock_code).head(n)
+        
+        try:
+            if self.ascending:
+                df = self._read_tail(path, n).iloc[::-1].reset_index(drop=True)
+            else:
+                df = self._read_file(path, nrows=n)
+            df.attrs['code'] = stock_code
             return df
         except Exception as e:
             print(f"  读取 {stock_code} 数据失败: {e}")
             return pd.DataFrame()
     
+    def _file_ascending(self, df):
+        """整个文件读出的数据是否为正序（mixed 目录按首末日期判断）"""
+        if self.mixed and len(df) > 1:
+            return df['date'].iloc[0] < df['date'].iloc[-1]
+        return self.ascending
+    
     def write_stock(self, stock_code, df):
         """写入股票数据（自动去重排序）"""
-        path = self.get_stock_path(stock_code)
+        return self._store(stock_code, df)[0]
+    
+    def _prepare(self, df):
+        """去重并按文件内顺序排序"""
+        if self.ascending:
+            # 日K线只保留日期，保证追加写入的日期格式与已有行一致
+            df = df.assign(date=pd.to_datetime(df['date']).dt.normalize())
         
         # 去重：按日期去重，保留最后出现的
         df = df.drop_duplicates(subset=['date'], keep='last')
         
-        # 按日期倒序排列（最新在前）
-        df = df.sort_values('date', ascending=False)
+        # 按文件内顺序排列（正序或倒序）
+        return df.sort_values('date', ascending=self.ascending)
+    
+    def _store(self, stock_code, df):
+        """去重排序后写入，同步更新清单；返回 (路径, 实际写入的数据)"""
+        path = self.get_stock_path(stock_code)
+        df = self._prepare(df)
         
         # 确保目录存在
         path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 写入CSV
-        df.to_csv(path, index=False)
-        return path
+        # 先写临时文件再替换，中断时不会留下写了一半的文件
+        tmp_path = path.with_name(path.name + '.tmp')
+        self._write_file(tmp_path, df)
+        os.replace(tmp_path, path)
+        self.manifest.record(stock_code, path, df)
+        return path, df
     
     def update_stock(self, stock_code, new_df):
         """增量更新股票数据"""
+        return self.merge_stock(stock_code, new_df)[0]
+    
+    def merge_stock(self, stock_code, new_df):
+        """
+        合并新数据
+        - 时间正序存储：只读取并重写文件尾部的重叠行，其余直接追加
+        - 时间倒序存储：读取一次、内存中合并、写入一次
+        :return: (路径, 新增行数)
+        """
+        path = self.get_stock_path(stock_code)
+        if self.ascending and not self.mixed and not new_df.empty and path.exists() and path.stat().st_size > 0:
+            result = self._append(stock_code, path, self._prepare(new_df))
+            if result is not None:
+                return result
+        
         existing_df = self.read_stock(stock_code)
         
         if existing_df.empty:
-            return self.write_stock(stock_code, new_df)
+            path, merged = self._store(stock_code, new_df)
+            return path, len(merged)
         
         # 合并数据
         combined = pd.concat([existing_df, new_df], ignore_index=True)
-        return self.write_stock(stock_code, combined)
+        path, merged = self._store(stock_code, combined)
+        return path, len(merged) - len(existing_df)
+    
+    def get_latest(self, stock_code):
+        """
+        最新日期和收盘价，优先查清单（不打开数据文件）
+        清单中没有时读取文件第一行并补录
+        :return: (date, close)，没有数据时返回 None
+        """
+        latest = self.manifest.latest(stock_code)
+        if latest is not None:
+            return latest
+        
+        path = self.get_stock_path(stock_code)
+        if not path.exists():
+            return None
+        self._scan_into_manifest(stock_code, path)
+        return self.manifest.latest(stock_code)
+    
+    def save_manifest(self):
+        """批量写入结束后保存清单"""
+        self.manifest.save()
+    
+    def _scan_into_manifest(self, stock_code, path):
+        """只读取首行、末行并统计行数，补录一只股票的清单记录"""
+        if path.stat().st_size == 0:
+            self.manifest.remove(stock_code)
+            return
+        head = self._read_file(path, nrows=1)
+        tail = self._read_tail(path, 1)
+        if head.empty:
+            self.manifest.remove(stock_code)
+            return
+        ascending = head['date'].iloc[0] <= tail['date'].iloc[0] if self.mixed else self.ascending
+        first, latest = (head.iloc[0], tail.iloc[0]) if ascending else (tail.iloc[0], head.iloc[0])
+        self.manifest.record_summary(stock_code, path, self._count_rows(path), first, latest)
+    
+    def rebuild_manifest(self):
+        """
+        按数据目录重建清单：只扫描大小或修改时间与记录不一致的文件，删除已不存在的记录
+        :return: {'unchanged': 未变化数, 'scanned': 重新扫描数, 'removed': 删除数}
+        """
+        stats = {'unchanged': 0, 'scanned': 0, 'removed': 0}
+        found = set()
+        for path in self.data_dir.rglob(f"*{self.FILE_SUFFIX}"):
+            stock_code = path.stem
+            found.add(stock_code)
+            entry = self.manifest.get(stock_code)
+            if (self.manifest.is_current(stock_code, path.stat())
+                    and entry['path'] == path.relative_to(self.data_dir).as_posix()):
+                stats['unchanged'] += 1
+                continue
+            try:
+                self._scan_into_manifest(stock_code, path)
+                stats['scanned'] += 1
+            except Exception as e:
+                print(f"  扫描 {stock_code} 失败: {e}")
+                self.manifest.remove(stock_code)
+        
+        for stock_code in set(self.manifest.entries) - found:
+            self.manifest.remove(stock_code)
+            stats['removed'] += 1
+        
+        self.manifest.complete = True
+        self.manifest.dirty = True
+        self.manifest.save()
+        return stats
     
     def list_all_stocks(self):
-        """列出所有已保存的股票代码"""
-        stocks = []
-        for csv_file in self.data_dir.rglob("*.csv"):
-            stock_code = csv_file.stem
-            stocks.append(stock_code)
-        return sorted(stocks)
+        """列出所有已保存的股票代码（查股票清单，清单不完整时先重建）"""
+        self.manifest.reload_if_changed()
+        if not self.manifest.complete:
+            print("  正在建立股票清单（首次运行或清单已失效）...")
+            self.rebuild_manifest()
+        return list(self.manifest.codes())
     
     def get_stock_count(self):
         """获取已保存的股票数量"""
@@ -81,3 +357,181 @@ class CSVManager:
     def stock_exists(self, stock_code):
         """检查股票数据是否存在"""
         return self.get_stock_path(stock_code).exists()
+
+
+class FeatherManager(CSVManager):
+    """Arrow IPC (Feather) 列式存储管理器 - 接口与 CSVManager 一致"""
+    
+    FILE_SUFFIX = '.feather'
+    STORAGE_FORMAT = 'feather'
+    
+    def __init__(self, data_dir, order=None):
+        if not HAS_PYARROW:
+            raise ImportError("feather 存储需要 pyarrow: pip install pyarrow")
+        super().__init__(data_dir, order)
+    
+    def _read_file(self, path, nrows=None):
+        # 单个文件很小，关闭多线程反而更快；列类型已固定，跳过pandas元数据还原
+        table = feather.read_table(path, memory_map=True, use_threads=False)
+        if nrows is not None:
+            table = table.slice(0, nrows)
+        return table.to_pandas(use_threads=False, ignore_metadata=True)
+    
+    def _read_tail(self, path, n):
+        table = feather.read_table(path, memory_map=True, use_threads=False)
+        table = table.slice(max(table.num_rows - n, 0))
+        return table.to_pandas(use_threads=False, ignore_metadata=True)
+    
+    def _write_file(self, path, df):
+        feather.write_feather(_normalize_dtypes(df), path, compression='lz4')
+    
+    def _append(self, stock_code, path, new_df):
+        # Arrow IPC 文件末尾有索引，无法原地追加；文件小且为二进制，整体重写
+        return None
+    
+    def _count_rows(self, path):
+        return feather.read_table(path, memory_map=True, use_threads=False).num_rows
+
+
+def _normalize_dtypes(df):
+    """统一列类型，保证列式文件的schema稳定"""
+    df = df.reset_index(drop=True)
+    if 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'])
+    
+    for col, dtype in COLUMN_DTYPES.items():
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        # 整数列存在缺失值时退化为浮点
+        if dtype == 'int64' and values.isna().any():
+            dtype = 'float64'
+        df[col] = values.astype(dtype)
+    return df
+
+
+STORAGE_MANAGERS = {
+    'csv': CSVManager,
+    'feather': FeatherManager,
+}
+
+
+def read_storage_format(data_dir):
+    """读取数据目录当前的存储格式（无标记时为csv）"""
+    marker = Path(data_dir) / STORAGE_MARKER_FILE
+    if marker.exists():
+        storage = marker.read_text(encoding='utf-8').strip()
+        if storage in STORAGE_FORMATS:
+            return storage
+    return 'csv'
+
+
+def read_storage_order(data_dir):
+    """
+    读取数据目录的文件内行顺序（asc/desc，原地转换未完成时为 mixed）
+    无标记时：已有数据文件为旧的倒序目录（desc），空目录按正序（asc）初始化并写入标记
+    """
+    data_dir = Path(data_dir)
+    marker = data_dir / STORAGE_ORDER_FILE
+    if marker.exists():
+        order = marker.read_text(encoding='utf-8').strip()
+        if order in STORAGE_ORDERS or order == MIXED_ORDER:
+            return order
+    
+    for manager in STORAGE_MANAGERS.values():
+        if next(data_dir.rglob(f"*{manager.FILE_SUFFIX}"), None) is not None:
+            return 'desc'
+    
+    data_dir.mkdir(parents=True, exist_ok=True)
+    marker.write_text('asc', encoding='utf-8')
+    return 'asc'
+
+
+def get_storage_manager(data_dir, storage=None, order=None):
+    """
+    创建数据管理器
+    :param data_dir: 数据目录
+    :param storage: 存储格式，None 表示按数据目录下的格式标记自动选择
+    :param order: 文件内行顺序，None 表示按数据目录下的顺序标记自动选择
+    """
+    storage = storage or read_storage_format(data_dir)
+    
+    if storage == 'feather' and not HAS_PYARROW:
+        print("⚠️ pyarrow 未安装，回退到CSV存储")
+        storage = 'csv'
+    
+    return STORAGE_MANAGERS[storage](data_dir, order)
+
+
+def migrate_storage(data_dir, target='feather', remove_source=False, order='asc'):
+    """
+    一次性迁移数据目录到目标存储格式和文件内行顺序
+    :param data_dir: 数据目录
+    :param target: 目标格式（csv/feather）
+    :param remove_source: 迁移成功后是否删除源文件（格式标记切换之后才删除）
+    :param order: 目标行顺序（asc/desc），格式不变时原地重写文件
+    :return: (成功数, 失败数)
+    """
+    data_dir = Path(data_dir)
+    source_format = read_storage_format(data_dir)
+    source_order = read_storage_order(data_dir)
+    if source_format == target and source_order == order:
+        print(f"数据目录已是 {target} 格式（{order}），无需迁移")
+        return 0, 0
+    
+    dest = get_storage_manager(data_dir, target, order)
+    if dest.STORAGE_FORMAT != target:
+        return 0, 0
+    in_place = dest.FILE_SUFFIX == STORAGE_MANAGERS[source_format].FILE_SUFFIX
+    if in_place:
+        # 原地重写期间新旧顺序的文件并存：先把顺序标记切换为 mixed，
+        # 读取方按每个文件的首末日期判断顺序，中断后也不会把最早的K线当作最新
+        (data_dir / STORAGE_ORDER_FILE).write_text(MIXED_ORDER, encoding='utf-8')
+        source_order = MIXED_ORDER
+    source = STORAGE_MANAGERS[source_format](data_dir, source_order)
+    
+    stock_codes = source.list_all_stocks()
+    total = len(stock_codes)
+    print(f"开始迁移 {total} 只股票: {source_format}({source_order}) -> {target}({order})")
+    
+    success = 0
+    failed = 0
+    migrated = []
+    for i, code in enumerate(stock_codes, 1):
+        df = source.read_stock(code)
+        if df.empty:
+            # 空文件无需迁移
+            continue
+        
+        try:
+            dest.write_stock(code, df)
+            # 校验行数，确认写入完整
+            if len(dest.read_stock(code)) != len(df.drop_duplicates(subset=['date'])):
+                raise ValueError("行数校验不一致")
+            success += 1
+            migrated.append(code)
+        except Exception as e:
+            print(f"  ✗ {code} 迁移失败: {e}")
+            failed += 1
+        
+        if i % 500 == 0 or i == total:
+            print(f"  进度: [{i}/{total}] 成功 {success} 只")
+    
+    dest.rebuild_manifest()
+    
+    # 全部成功才切换格式标记，避免读到不完整的数据
+    # （原地重写中断时标记保持 mixed，重新执行 migrate 即可）
+    if failed:
+        print(f"⚠️ {failed} 只股票迁移失败，格式标记未切换（仍使用 {source_format}/{source_order}），源文件均已保留")
+        return success, failed
+    
+    (data_dir / STORAGE_MARKER_FILE).write_text(target, encoding='utf-8')
+    (data_dir / STORAGE_ORDER_FILE).write_text(order, encoding='utf-8')
+    print(f"✓ 迁移完成，数据目录已切换为 {target} 格式（{order}）")
+    
+    # 标记切换后才删除源文件：此前失败或中断时，读取方仍在使用源格式
+    if remove_source and not in_place:
+        for code in migrated:
+            os.remove(source.get_stock_path(code))
+    
+    return success, failed
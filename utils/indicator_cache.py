@@ -0,0 +1,46 @@
+"""
+单只股票的指标缓存 - 同一份K线上多个策略共用相同参数的指标
+
+选股时每只股票只读取一次，按窗口长度各建一个缓存交给所有策略；
+参数相同的知行趋势线、KDJ 等只计算一次。缓存的结果是只读的，
+策略需要修改时应先复制。
+"""
+from utils.technical import KDJ, REF, calculate_zhixing_trend
+
+
+class IndicatorCache:
+    """单只股票、单个数据窗口的指标缓存"""
+    
+    def __init__(self, df):
+        """
+        :param df: 股票数据（倒序，与 technical 模块约定一致）
+        """
+        self.df = df
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, compute):
+        """
+        取缓存的指标，没有时调用 compute() 计算并缓存
+        :param key: 指标名和参数组成的元组
+        """
+        if key in self._values:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._values[key] = compute()
+        return self._values[key]
+    
+    def zhixing_trend(self, m1=14, m2=28, m3=57, m4=114):
+        """知行趋势线（short_term_trend / bull_bear_line）"""
+        return self.get(('zhixing_trend', m1, m2, m3, m4),
+                        lambda: calculate_zhixing_trend(self.df, m1=m1, m2=m2, m3=m3, m4=m4))
+    
+    def kdj(self, n=9, m1=3, m2=3):
+        """KDJ（K / D / J）"""
+        return self.get(('kdj', n, m1, m2), lambda: KDJ(self.df, n=n, m1=m1, m2=m2))
+    
+    def ref(self, column, n=1):
+        """REF(column, n)"""
+        return self.get(('ref', column, n), lambda: REF(self.df[column], n))
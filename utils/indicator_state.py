@@ -0,0 +1,318 @@
+"""
+流式指标状态 - 每日只用新增K线递推指标
+
+每只股票保存一份状态（持久化到数据目录下的 indicator_state.json）：
+- 两级EMA的当前值（知行短期趋势线）
+- 最近 max(M1..M4) 个收盘价（知行多空线的各条均线）
+- 最近9日最高/最低价、K/D当前值（KDJ(9,3,3)）
+- 最近30个J值、最近M天的K线记录（异动/关键K线判断）
+
+daily_update 追加新K线后，只需把新K线逐根送入 update()，与历史长度无关。
+前复权会改写历史价格：若状态中最后一根K线的收盘价与数据文件不一致，则从全量数据重建。
+"""
+import json
+import math
+import os
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.technical import EMA, REF, KDJ
+
+
+# 状态文件名（位于数据目录下）
+STATE_FILE_NAME = 'indicator_state.json'
+
+# 状态格式版本，结构变化时递增，旧文件自动重建
+STATE_VERSION = 1
+
+# 增量同步时读取的最新K线条数，超过则视为缺口过大，全量重建
+SYNC_RECENT_BARS = 10
+
+# KDJ 参数（与 BowlReboundStrategy 一致）
+KDJ_N, KDJ_M1, KDJ_M2 = 9, 3, 3
+
+# J值异常过滤使用的窗口
+RECENT_J_BARS = 30
+
+# 知行短期趋势线的EMA周期
+TREND_EMA_SPAN = 10
+
+
+def _ema_step(prev, value, span):
+    """单步EMA递推，算法与 pandas ewm(adjust=False) 相同"""
+    if prev is None or math.isnan(prev):
+        return value
+    alpha = 2.0 / (span + 1)
+    if prev == value:
+        return prev
+    return ((1 - alpha) * prev + alpha * value) / ((1 - alpha) + alpha)
+
+
+class StreamingIndicators:
+    """单只股票的流式指标状态"""
+    
+    def __init__(self, ma_periods=(14, 28, 57, 114), lookback=15):
+        """
+        :param ma_periods: 知行多空线的四个MA周期
+        :param lookback: 回溯天数M（保留最近M天的K线记录）
+        """
+        self.ma_periods = tuple(ma_periods)
+        self.lookback = lookback
+        self.count = 0
+        self.last_date = None
+        self.ema1 = None            # EMA(CLOSE,10)
+        self.ema2 = None            # EMA(EMA(CLOSE,10),10)
+        self.k = None
+        self.d = None
+        self.prev_volume = None
+        self.closes = deque(maxlen=max(self.ma_periods))
+        self.highs = deque(maxlen=KDJ_N)
+        self.lows = deque(maxlen=KDJ_N)
+        self.recent_j = deque(maxlen=RECENT_J_BARS)
+        # 最近M天的K线记录: [date, open, close, volume, vol_ratio, market_cap]
+        self.recent_bars = deque(maxlen=lookback)
+    
+    # ========== 递推 ==========
+    
+    def update(self, bar):
+        """
+        送入一根新K线（必须按时间正序）
+        :param bar: 含 date/open/high/low/close/volume/market_cap 的字典或Series
+        """
+        close = float(bar['close'])
+        high = float(bar['high'])
+        low = float(bar['low'])
+        volume = float(bar['volume'])
+        market_cap = float(bar.get('market_cap', np.nan))
+        
+        # 知行趋势线
+        self.ema1 = _ema_step(self.ema1, close, TREND_EMA_SPAN)
+        self.ema2 = _ema_step(self.ema2, self.ema1, TREND_EMA_SPAN)
+        self.closes.append(close)
+        
+        # KDJ：前n-1个周期或最高=最低时RSV取50，首日K=D=50
+        self.highs.append(high)
+        self.lows.append(low)
+        low_min = min(self.lows)
+        range_val = max(self.highs) - low_min
+        if self.count < KDJ_N - 1 or range_val == 0:
+            rsv = 50.0
+        else:
+            rsv = (close - low_min) / range_val * 100
+        if self.count == 0:
+            self.k, self.d = 50.0, 50.0
+        else:
+            self.k = (rsv * 1 + self.k * (KDJ_M1 - 1)) / KDJ_M1
+            self.d = (self.k * 1 + self.d * (KDJ_M2 - 1)) / KDJ_M2
+        self.recent_j.append(3 * self.k - 2 * self.d)
+        
+        # 量比
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol_ratio = float(np.float64(volume) / np.float64(np.nan if self.prev_volume is None else self.prev_volume))
+        self.prev_volume = volume
+        
+        date = pd.Timestamp(bar['date']).strftime('%Y-%m-%d')
+        self.recent_bars.append([date, float(bar['open']), close, volume, vol_ratio, market_cap])
+        self.last_date = date
+        self.count += 1
+    
+    @classmethod
+    def from_history(cls, df, ma_periods=(14, 28, 57, 114), lookback=15):
+        """
+        从全量历史数据重建状态（向量化计算后截取尾部，不逐根递推）
+        :param df: 股票数据（倒序或正序均可）
+        """
+        state = cls(ma_periods, lookback)
+        if df is None or df.empty:
+            return state
+        
+        # technical 模块按倒序（最新在前）计算
+        df = df.drop_duplicates(subset=['date'], keep='last')
+        df = df.sort_values('date', ascending=False).reset_index(drop=True)
+        ema1 = EMA(df['close'], TREND_EMA_SPAN)
+        ema2 = EMA(ema1, TREND_EMA_SPAN)
+        kdj = KDJ(df, n=KDJ_N, m1=KDJ_M1, m2=KDJ_M2)
+        vol_ratio = df['volume'] / REF(df['volume'], 1)
+        market_cap = df['market_cap'] if 'market_cap' in df.columns else pd.Series(np.nan, index=df.index)
+        
+        state.count = len(df)
+        state.last_date = df['date'].iloc[0].strftime('%Y-%m-%d')
+        state.ema1 = float(ema1.iloc[0])
+        state.ema2 = float(ema2.iloc[0])
+        state.k = float(kdj['K'].iloc[0])
+        state.d = float(kdj['D'].iloc[0])
+        state.prev_volume = float(df['volume'].iloc[0])
+        
+        # 各窗口按时间正序填入（最早在前）
+        oldest_first = slice(None, None, -1)
+        state.closes.extend(df['close'].astype(float).iloc[:state.closes.maxlen].iloc[oldest_first])
+        state.highs.extend(df['high'].astype(float).iloc[:KDJ_N].iloc[oldest_first])
+        state.lows.extend(df['low'].astype(float).iloc[:KDJ_N].iloc[oldest_first])
+        state.recent_j.extend(kdj['J'].astype(float).iloc[:RECENT_J_BARS].iloc[oldest_first])
+        
+        for i in range(min(lookback, len(df)) - 1, -1, -1):
+            state.recent_bars.append([
+                df['date'].iloc[i].strftime('%Y-%m-%d'),
+                float(df['open'].iloc[i]),
+                float(df['close'].iloc[i]),
+                float(df['volume'].iloc[i]),
+                float(vol_ratio.iloc[i]),
+                float(market_cap.iloc[i]),
+            ])
+        return state
+    
+    # ========== 当前指标值 ==========
+    
+    def moving_average(self, n):
+        """最近n个收盘价的均值（不足n个时取全部，与 min_periods=1 一致）"""
+        window = list(self.closes)[-n:]
+        return math.fsum(window) / len(window)
+    
+    @property
+    def short_term_trend(self):
+        return self.ema2
+    
+    @property
+    def bull_bear_line(self):
+        return sum(self.moving_average(n) for n in self.ma_periods) / 4
+    
+    @property
+    def j(self):
+        return self.recent_j[-1]
+    
+    @property
+    def latest_bar(self):
+        """最新K线记录: {date, open, close, volume, vol_ratio, market_cap}"""
+        keys = ('date', 'open', 'close', 'volume', 'vol_ratio', 'market_cap')
+        return dict(zip(keys, self.recent_bars[-1]))
+    
+    # ========== 序列化 ==========
+    
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'last_date': self.last_date,
+            'ema1': self.ema1,
+            'ema2': self.ema2,
+            'k': self.k,
+            'd': self.d,
+            'prev_volume': self.prev_volume,
+            'closes': list(self.closes),
+            'highs': list(self.highs),
+            'lows': list(self.lows),
+            'recent_j': list(self.recent_j),
+            'recent_bars': list(self.recent_bars),
+        }
+    
+    @classmethod
+    def from_dict(cls, data, ma_periods=(14, 28, 57, 114), lookback=15):
+        state = cls(ma_periods, lookback)
+        for key in ('count', 'last_date', 'ema1', 'ema2', 'k', 'd', 'prev_volume'):
+            setattr(state, key, data[key])
+        state.closes.extend(data['closes'])
+        state.highs.extend(data['highs'])
+        state.lows.extend(data['lows'])
+        state.recent_j.extend(data['recent_j'])
+        state.recent_bars.extend(data['recent_bars'])
+        return state
+
+
+class IndicatorStateStore:
+    """全部股票的流式指标状态（JSON持久化）"""
+    
+    def __init__(self, data_dir="data", ma_periods=(14, 28, 57, 114), lookback=15):
+        self.state_file = Path(data_dir) / STATE_FILE_NAME
+        self.ma_periods = tuple(int(n) for n in ma_periods)
+        self.lookback = int(lookback)
+        self.states = {}
+        self.stats = {'incremental': 0, 'rebuilt': 0, 'unchanged': 0}
+    
+    @property
+    def params(self):
+        """状态依赖的参数，变化后需要全量重建"""
+        return {'version': STATE_VERSION, 'ma_periods': list(self.ma_periods), 'lookback': self.lookback}
+    
+    def load(self):
+        """加载状态文件，参数或版本不一致时丢弃"""
+        self.states = {}
+        if not self.state_file.exists():
+            return self
+        
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"  读取指标状态失败，将全量重建: {e}")
+            return self
+        
+        if data.get('params') != self.params:
+            print("  策略参数已变化，指标状态将全量重建")
+            return self
+        
+        self.states = {
+            code: StreamingIndicators.from_dict(state, self.ma_periods, self.lookback)
+            for code, state in data.get('stocks', {}).items()
+        }
+        return self
+    
+    def save(self):
+        """原子写入状态文件"""
+        data = {
+            'params': self.params,
+            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'stocks': {code: state.to_dict() for code, state in self.states.items()},
+        }
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.state_file)
+    
+    def clear(self):
+        """清空全部状态（下次同步时全量重建）"""
+        self.states = {}
+    
+    def rebuild(self, stock_code, csv_manager):
+        """从全量数据重建单只股票的状态"""
+        df = csv_manager.read_stock(stock_code)
+        state = StreamingIndicators.from_history(df, self.ma_periods, self.lookback)
+        self.states[stock_code] = state
+        self.stats['rebuilt'] += 1
+        return state
+    
+    def sync(self, stock_code, csv_manager):
+        """
+        把状态同步到数据文件的最新K线
+        - 只读取最新 SYNC_RECENT_BARS 条数据，把新K线逐根递推
+        - 状态缺失、缺口过大或最后一根K线收盘价不一致（前复权改写历史）时全量重建
+        :return: 同步后的状态
+        """
+        state = self.states.get(stock_code)
+        if state is None or state.count == 0:
+            return self.rebuild(stock_code, csv_manager)
+        
+        recent = csv_manager.read_latest(stock_code, n=SYNC_RECENT_BARS)
+        if recent.empty:
+            return self.rebuild(stock_code, csv_manager)
+        
+        days = recent['date'].to_numpy().astype('datetime64[D]')
+        last_day = np.datetime64(state.last_date)
+        anchor = np.flatnonzero(days == last_day)
+        if not len(anchor) or not math.isclose(float(recent['close'].iloc[anchor[0]]), state.closes[-1],
+                                               rel_tol=1e-9, abs_tol=1e-9):
+            return self.rebuild(stock_code, csv_manager)
+        
+        newer = np.flatnonzero(days > last_day)
+        if not len(newer):
+            self.stats['unchanged'] += 1
+            return state
+        
+        records = recent.to_dict('records')
+        for i in newer[np.argsort(days[newer], kind='stable')]:
+            state.update(records[i])
+        self.stats['incremental'] += 1
+        return state
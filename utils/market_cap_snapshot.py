@@ -0,0 +1,176 @@
+"""
+全市场总市值快照
+
+一次批量请求获取全市场总市值，保存到数据目录下的 market_cap_snapshot.json（带时间戳），
+选股时只读本地快照，不再逐只股票访问网络。
+
+数据来源（按顺序尝试）：
+1. 本次数据更新已批量获取的全市场市值（AKShareFetcher._fetch_market_cap_map，不再重复请求）
+2. akshare 沪深京A股实时行情（stock_zh_a_spot_em）
+3. 腾讯行情批量接口（qt.gtimg.cn，每批100只，总市值单位为亿）
+各来源按各自的单位（MARKET_CAP_UNITS）用 normalize_market_cap 换算为元。
+
+离线时沿用已有快照；没有快照时 get() 返回 None，由调用方决定回退策略。
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+
+# 快照文件名（位于数据目录下）
+SNAPSHOT_FILE_NAME = 'market_cap_snapshot.json'
+
+# 快照有效期（小时），超过后数据更新时重新获取
+DEFAULT_MAX_AGE_HOURS = 12
+
+# 快照格式版本，旧版本的快照（市值按数值大小猜测单位）不再加载
+SNAPSHOT_VERSION = 2
+
+# 各数据来源总市值的单位（元）：akshare 实时行情为元，腾讯行情为亿元
+MARKET_CAP_UNITS = {'akshare': 1, 'tencent': 1e8}
+
+
+def normalize_market_cap(cap, source):
+    """按数据来源的单位把总市值换算为元"""
+    return cap * MARKET_CAP_UNITS[source]
+
+
+class MarketCapSnapshot:
+    """全市场总市值快照（单位：元）"""
+    
+    def __init__(self, data_dir="data"):
+        self.snapshot_file = Path(data_dir) / SNAPSHOT_FILE_NAME
+        self.caps = {}
+        self.updated_at = None
+        self.source = None
+        # 加载时快照文件的修改时间（纳秒），文件被其他进程更新后据此重新加载
+        self.mtime = None
+    
+    def load(self):
+        """从本地文件加载快照（不访问网络），文件不存在或为旧版本时为空快照"""
+        self.caps, self.updated_at, self.source = {}, None, None
+        self.mtime = self.file_mtime()
+        if self.mtime is None:
+            return self
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 旧版本快照的市值可能换算错误（元被当作亿元），丢弃后在数据更新时重新获取
+            if data.get('version') != SNAPSHOT_VERSION:
+                return self
+            self.caps = {code: float(cap) for code, cap in data.get('caps', {}).items()}
+            self.updated_at = datetime.strptime(data['updated_at'], '%Y-%m-%d %H:%M:%S')
+            self.source = data.get('source')
+        except Exception as e:
+            print(f"  读取市值快照失败: {e}")
+            self.caps = {}
+            self.updated_at = None
+        return self
+    
+    def file_mtime(self):
+        """快照文件的修改时间（纳秒），文件不存在时返回 None"""
+        try:
+            return self.snapshot_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def save(self):
+        """原子写入快照文件"""
+        data = {
+            'version': SNAPSHOT_VERSION,
+            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'source': self.source,
+            'caps': self.caps,
+        }
+        self.snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.snapshot_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.snapshot_file)
+        self.mtime = self.file_mtime()
+    
+    def get(self, stock_code):
+        """获取单只股票总市值（元），快照中没有时返回 None"""
+        return self.caps.get(stock_code)
+    
+    def age_hours(self):
+        """快照距今小时数，没有快照时返回 None"""
+        if self.updated_at is None:
+            return None
+        return (datetime.now() - self.updated_at).total_seconds() / 3600
+    
+    def is_fresh(self, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+        age = self.age_hours()
+        return age is not None and age <= max_age_hours
+    
+    def refresh(self, fetcher=None, stock_codes=None):
+        """
+        批量获取全市场总市值并保存
+        :param fetcher: AKShareFetcher，优先复用其本次已获取的全市场市值，akshare 失败时用其腾讯接口作为备选
+        :param stock_codes: 腾讯接口需要的股票列表
+        :return: 获取到的股票数，失败时返回0（保留旧快照）
+        """
+        caps, source = {}, None
+        if fetcher is not None and fetcher.market_cap_source == 'akshare':
+            caps, source = fetcher.market_caps, 'akshare'
+        if not caps:
+            caps, source = self._fetch_akshare(), 'akshare'
+        if not caps and fetcher is not None and stock_codes:
+            caps, source = fetcher._fetch_market_cap_tencent(list(stock_codes)), 'tencent'
+        
+        if not caps:
+            if self.caps:
+                print(f"  ⚠️ 市值快照获取失败，沿用 {self.updated_at:%Y-%m-%d %H:%M} 的快照")
+            else:
+                print("  ⚠️ 市值快照获取失败，且无本地快照（市值单位异常的股票将不过滤）")
+            return 0
+        
+        self.caps = {code: float(cap) for code, cap in caps.items()}
+        self.updated_at = datetime.now()
+        self.source = source
+        self.save()
+        print(f"  ✓ 市值快照已更新: {len(self.caps)} 只股票 (来源: {source})")
+        return len(self.caps)
+    
+    def _fetch_akshare(self):
+        """akshare 一次性获取全市场实时行情中的总市值"""
+        try:
+            import akshare as ak
+            spot_df = ak.stock_zh_a_spot_em()
+            caps = pd.to_numeric(spot_df['总市值'], errors='coerce')
+            valid = caps > 0
+            codes = spot_df.loc[valid, '代码'].astype(str).str.zfill(6)
+            return {code: normalize_market_cap(cap, 'akshare') for code, cap in zip(codes, caps[valid])}
+        except Exception as e:
+            print(f"  akshare获取市值失败: {e}")
+            return {}
+
+
+# 已加载的快照（按数据目录的绝对路径，首次使用及快照文件修改时间变化时从本地文件加载）
+_snapshots = {}
+
+# 不指定数据目录时使用的目录（QuantSystem 和子进程初始化时设为配置的数据目录）
+_default_data_dir = "data"
+
+
+def set_default_data_dir(data_dir):
+    """设置默认数据目录（策略查询快照时不传数据目录）"""
+    global _default_data_dir
+    _default_data_dir = data_dir
+
+
+def get_market_cap_snapshot(data_dir=None):
+    """
+    获取数据目录的市值快照（只读本地文件，不访问网络），None 表示默认数据目录
+    快照文件被其他进程更新（修改时间变化）后重新加载
+    """
+    key = Path(data_dir or _default_data_dir).resolve()
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        snapshot = _snapshots[key] = MarketCapSnapshot(key).load()
+    elif snapshot.mtime != snapshot.file_mtime():
+        snapshot.load()
+    return snapshot
@@ -0,0 +1,354 @@
+"""
+全市场行情面板 - 内存映射的 日期 × 股票 × 字段 数组
+
+目录结构（位于数据目录下）:
+    panel/index.json           股票代码列表、日期列表、容量、版本号、各股票数据文件的大小和修改时间
+    panel/<field>.v<N>.npy     版本 N 的字段数组 (capacity, n_codes)，float64
+
+- 行按日期正序排列（最早在前），列按股票代码排序
+- 停牌/未上市的位置为 NaN
+- 预留 capacity 行空间，日常更新把新交易日写入预留行（已打开面板的读者只看到自己索引中的日期）
+- 历史数据被改写（前复权）时写入新版本的文件，最后原子替换 index.json 切换版本，
+  并保留上一版本，已打开旧版本的读者不会看到写了一半的列
+- 多进程以 mmap_mode='r' 打开同一组文件即可零拷贝共享
+"""
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+
+
+# 面板包含的字段
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'market_cap')
+
+# 面板目录名（位于数据目录下）
+PANEL_DIR_NAME = 'panel'
+
+# 预留的追加行数（约一年的交易日）
+DEFAULT_SLACK_ROWS = 250
+
+# 切换版本后保留的旧版本数（给刚读取旧索引、尚未打开数组的读者）
+KEEP_VERSIONS = 1
+
+
+class MarketPanel:
+    """全市场行情面板"""
+    
+    def __init__(self, data_dir="data"):
+        self.panel_dir = Path(data_dir) / PANEL_DIR_NAME
+        self.index_file = self.panel_dir / 'index.json'
+        self.codes = []
+        self.dates = []
+        self.capacity = 0
+        self.version = 0
+        self.files = {}        # code -> [数据文件大小, 修改时间]，与股票清单比对找出有改动的股票
+        self.code_index = {}   # code -> 列号
+        self.date_index = {}   # 'YYYY-MM-DD' -> 行号
+        self.arrays = {}       # field -> memmap (capacity, n_codes)
+    
+    def exists(self):
+        """面板文件是否存在"""
+        return self.index_file.exists()
+    
+    @property
+    def n_dates(self):
+        return len(self.dates)
+    
+    @property
+    def n_codes(self):
+        return len(self.codes)
+    
+    def load(self, mode='r'):
+        """
+        以内存映射方式打开面板
+        :param mode: 'r' 只读共享，'r+' 原地更新
+        """
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        
+        self.codes = index['codes']
+        self.dates = index['dates']
+        self.capacity = index['capacity']
+        self.version = index.get('version', 0)
+        self.files = index.get('files', {})
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.date_index = {date: i for i, date in enumerate(self.dates)}
+        self.arrays = {
+            field: np.load(self._field_path(field, self.version), mmap_mode=mode)
+            for field in PANEL_FIELDS
+        }
+        return self
+    
+    def _field_path(self, field, version):
+        """字段数组文件（版本 0 为未分版本的旧面板）"""
+        if version == 0:
+            return self.panel_dir / f"{field}.npy"
+        return self.panel_dir / f"{field}.v{version}.npy"
+    
+    def field(self, name):
+        """获取某个字段的有效区域 (n_dates, n_codes)"""
+        return self.arrays[name][:self.n_dates]
+    
+    def date_values(self):
+        """日期轴（datetime64数组）"""
+        return np.array(self.dates, dtype='datetime64[D]')
+    
+    def get_stock(self, stock_code):
+        """
+        取出单只股票的数据，格式与 read_stock 一致（倒序，最新在前）
+        停牌/未上市的日期会被剔除
+        """
+        col = self.code_index.get(stock_code)
+        if col is None:
+            return pd.DataFrame()
+        
+        data = {field: self.arrays[field][:self.n_dates, col] for field in PANEL_FIELDS}
+        df = pd.DataFrame(data)
+        df.insert(0, 'date', pd.to_datetime(self.dates))
+        df = df[df['close'].notna()]
+        return df.iloc[::-1].reset_index(drop=True)
+    
+    # ========== 构建与更新 ==========
+    
+    def build(self, csv_manager, stock_codes=None, slack=DEFAULT_SLACK_ROWS):
+        """
+        从 CSVManager 数据全量构建面板
+        :param csv_manager: 数据管理器
+        :param stock_codes: 股票列表，None 表示全部
+        :param slack: 预留的追加行数
+        """
+        if stock_codes is None:
+            stock_codes = csv_manager.list_all_stocks()
+        
+        print(f"  读取 {len(stock_codes)} 只股票数据...")
+        frames = {}
+        for i, code in enumerate(stock_codes, 1):
+            df = csv_manager.read_stock(code)
+            if df.empty:
+                continue
+            frames[code] = _prepare_frame(df)
+            
+            if i % 500 == 0 or i == len(stock_codes):
+                print(f"    进度: [{i}/{len(stock_codes)}]")
+        
+        codes = sorted(frames)
+        days = np.unique(np.concatenate([frames[code][0] for code in codes] or [np.array([], dtype='int64')]))
+        dates = list(np.datetime_as_string(days.astype('datetime64[D]')))
+        capacity = len(dates) + slack
+        
+        # 写入新版本的文件，完成后切换索引，避免读者看到半成品
+        self.panel_dir.mkdir(parents=True, exist_ok=True)
+        version = self._next_version()
+        arrays = {}
+        for field in PANEL_FIELDS:
+            arr = np.lib.format.open_memmap(self._field_path(field, version), mode='w+', dtype='float64',
+                                            shape=(capacity, len(codes)))
+            arr[:] = np.nan
+            arrays[field] = arr
+        
+        for col, code in enumerate(codes):
+            stock_days, values = frames[code]
+            rows = np.searchsorted(days, stock_days)
+            for field, column in values.items():
+                arrays[field][rows, col] = column
+        
+        for arr in arrays.values():
+            arr.flush()
+        arrays.clear()
+        
+        self._write_index(codes, dates, capacity, version, _file_versions(csv_manager, codes))
+        print(f"  ✓ 面板构建完成: {len(dates)} 个交易日 × {len(codes)} 只股票")
+        return self.load()
+    
+    def update(self, csv_manager, stock_codes=None):
+        """
+        daily_update 之后刷新面板，只读取数据文件有改动的股票
+        - 按股票清单中的文件大小和修改时间找出有改动的股票，只读取面板最后一根K线之后的新增行
+          （多读一行核对收盘价）；核对不一致（前复权改写了历史）时重新读取该股票全部数据
+        - 只有新交易日时写入预留行，再原子替换索引；有股票历史被改写时复制出新版本的文件
+          修改后切换，正在读取旧版本的进程不受影响
+        - 预留行不足、新日期插在历史中间、出现新股票或有股票移出清单（退市删除数据）时全量重建
+        :param stock_codes: 需要检查的股票，None 表示清单中的全部股票
+        """
+        if not self.exists():
+            return self.build(csv_manager)
+        
+        self.load()
+        listed = csv_manager.list_all_stocks()
+        if stock_codes is None:
+            stock_codes = listed
+        
+        # 出现新股票或有股票移出清单，列数变化只能重建（否则移出的股票会作为过期的列留在面板中）
+        new_codes = [code for code in stock_codes if code not in self.code_index]
+        if new_codes:
+            print(f"  发现 {len(new_codes)} 只新股票，重建面板...")
+            return self._rebuild(csv_manager)
+        listed = set(listed)
+        removed_codes = [code for code in self.codes if code not in listed]
+        if removed_codes:
+            print(f"  {len(removed_codes)} 只股票已移出股票清单，重建面板...")
+            return self._rebuild(csv_manager)
+        
+        versions = _file_versions(csv_manager, stock_codes)
+        changed = [code for code in stock_codes if versions.get(code) is None or versions[code] != self.files.get(code)]
+        appended, rewritten = self._read_changes(csv_manager, changed)
+        
+        panel_days = self.date_values().astype('int64')
+        frames = {**appended, **rewritten}
+        new_days = np.array([], dtype='int64')
+        if frames:
+            all_days = np.unique(np.concatenate([stock_days for stock_days, _ in frames.values()]))
+            new_days = np.setdiff1d(all_days, panel_days)
+        
+        # 新日期插在历史中间或超出预留空间时，只能重建
+        if len(new_days) and ((len(panel_days) and new_days[0] <= panel_days[-1]) or
+                              self.n_dates + len(new_days) > self.capacity):
+            return self._rebuild(csv_manager)
+        
+        n_old = self.n_dates
+        dates = self.dates + list(np.datetime_as_string(new_days.astype('datetime64[D]')))
+        panel_days = np.concatenate([panel_days, new_days])
+        version = self.version
+        if rewritten:
+            # 复制出新版本再修改，旧版本的文件保持不变
+            version = self._next_version()
+            arrays = {}
+            for field in PANEL_FIELDS:
+                arr = np.lib.format.open_memmap(self._field_path(field, version), mode='w+', dtype='float64',
+                                                shape=(self.capacity, self.n_codes))
+                arr[:] = self.arrays[field]
+                arrays[field] = arr
+        else:
+            # 只写入当前索引之外的预留行，读者看不到
+            self.arrays = {}
+            arrays = {field: np.load(self._field_path(field, version), mmap_mode='r+') for field in PANEL_FIELDS}
+        
+        for field in PANEL_FIELDS:
+            # 预留行可能残留中断的更新写入的数据
+            arrays[field][n_old:len(dates)] = np.nan
+        for code, (stock_days, values) in frames.items():
+            col = self.code_index[code]
+            rows = np.searchsorted(panel_days, stock_days)
+            for field in PANEL_FIELDS:
+                if code in rewritten:
+                    arrays[field][:len(dates), col] = np.nan
+                if field in values:
+                    arrays[field][rows, col] = values[field]
+        
+        for arr in arrays.values():
+            arr.flush()
+        arrays.clear()
+        self._write_index(self.codes, dates, self.capacity, version, {**self.files, **versions})
+        print(f"  ✓ 面板已更新: 读取 {len(changed)} 只有改动的股票（{len(rewritten)} 只历史被改写），"
+              f"新增 {len(new_days)} 个交易日")
+        return self.load()
+    
+    def _read_changes(self, csv_manager, stock_codes):
+        """
+        读取有改动的股票
+        :return: (只追加了新K线的股票 {code: 新增行}, 历史被改写的股票 {code: 全部数据})，
+                 均为 _prepare_frame 的格式
+        """
+        appended, rewritten = {}, {}
+        if not stock_codes:
+            return appended, rewritten
+        
+        cols = [self.code_index[code] for code in stock_codes]
+        valid = ~np.isnan(self.field('close')[:, cols])
+        counts = valid.sum(axis=0)
+        last_rows = self.n_dates - 1 - np.argmax(valid[::-1], axis=0)
+        panel_days = self.date_values().astype('int64')
+        for code, col, count, last_row in zip(stock_codes, cols, counts, last_rows):
+            entry = csv_manager.manifest.get(code)
+            if count and entry is not None and entry['rows'] >= count:
+                # 多读一行与面板最后一根K线核对（CSV 文本往返可能有末位舍入差异）
+                days, values = _prepare_frame(csv_manager.read_latest(code, entry['rows'] - count + 1))
+                if len(days) and days[0] == panel_days[last_row] and \
+                        math.isclose(values['close'][0], self.arrays['close'][last_row, col], rel_tol=1e-9, abs_tol=1e-9):
+                    keep = days > panel_days[last_row]
+                    appended[code] = (days[keep], {field: column[keep] for field, column in values.items()})
+                    continue
+            df = csv_manager.read_stock(code)
+            if not df.empty:
+                rewritten[code] = _prepare_frame(df)
+        return appended, rewritten
+    
+    def _rebuild(self, csv_manager):
+        """释放内存映射后全量重建"""
+        self.arrays = {}
+        return self.build(csv_manager)
+    
+    def _next_version(self):
+        """新版本号（大于索引中和目录下已有的版本）"""
+        return max([self.version, *self._stored_versions()]) + 1
+    
+    def _stored_versions(self):
+        """目录下已有字段文件的版本号"""
+        versions = set()
+        for path in self.panel_dir.glob('*.npy'):
+            tag = path.suffixes[-2] if len(path.suffixes) >= 2 else ''
+            if tag[:2] == '.v' and tag[2:].isdigit():
+                versions.add(int(tag[2:]))
+            elif path.stem in PANEL_FIELDS:
+                versions.add(0)
+        return versions
+    
+    def _write_index(self, codes, dates, capacity, version, files):
+        """原子写入索引文件（切换到 version），之后删除更早的版本"""
+        index = {
+            'codes': list(codes),
+            'dates': list(dates),
+            'capacity': int(capacity),
+            'fields': list(PANEL_FIELDS),
+            'version': int(version),
+            'files': files,
+            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        tmp_file = self.index_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, self.index_file)
+        
+        # 已打开的内存映射不受删除影响
+        for old in self._stored_versions():
+            if old < version - KEEP_VERSIONS:
+                for field in PANEL_FIELDS:
+                    self._field_path(field, old).unlink(missing_ok=True)
+
+
+def _file_versions(csv_manager, stock_codes):
+    """各股票数据文件在清单中记录的 [大小, 修改时间]"""
+    versions = {}
+    for code in stock_codes:
+        entry = csv_manager.manifest.get(code)
+        if entry is not None:
+            versions[code] = [entry['size'], entry['mtime']]
+    return versions
+
+
+def _prepare_frame(df):
+    """整理单只股票数据为 (日期天数数组, {字段: 数值数组})，日期正序、去重保留最后一条"""
+    dates = df['date']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    days = dates.to_numpy().astype('datetime64[D]').astype('int64')
+    
+    order = np.argsort(days, kind='stable')
+    days = days[order]
+    keep = np.append(days[1:] != days[:-1], True)
+    values = {
+        field: df[field].to_numpy(dtype='float64')[order][keep]
+        for field in PANEL_FIELDS if field in df.columns
+    }
+    return days[keep], values
+
+
+def load_market_panel(data_dir="data"):
+    """只读打开全市场面板，不存在时返回 None"""
+    panel = MarketPanel(data_dir)
+    if not panel.exists():
+        return None
+    return panel.load()
@@ -0,0 +1,240 @@
+"""
+逐只选股 - 每只股票只读取一次，依次交给全部策略，可分片交给进程池并行
+
+读取数据前先做预筛选：按股票名称（退市/ST）、数据清单中的行数，
+以及策略声明的 prefilter（只看清单元信息）缩小范围。
+
+同一只股票上预热窗口相同的策略共用一个指标缓存（IndicatorCache），
+多注册一个策略只增加计算，不增加磁盘读取。支持分阶段选股的策略
+先检查廉价条件，被淘汰的股票不计算完整指标，并记录淘汰阶段。
+
+并行时子进程按 (模块名, 类名, 参数) 重新创建策略并打开数据管理器，
+每个分片只把选股信号（return_data 时附带入选股票的指标数据）传回主进程。
+主进程按分片顺序合并结果，输出顺序与串行选股完全一致。
+"""
+import importlib
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# 添加项目根目录到路径（子进程以 spawn 方式启动时同样需要）
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.csv_manager import get_storage_manager
+from utils.indicator_cache import IndicatorCache
+from utils.market_cap_snapshot import set_default_data_dir
+from strategy.base_strategy import INVALID_NAME_KEYWORDS, CachedIndicatorStrategy, StagedStrategy
+
+
+# 按名称剔除的预筛选项（其余预筛选项为K线不足）
+NAME_FILTERS = ('退市/未知', 'ST/*ST')
+
+# 选股所需的最少K线数
+MIN_BARS = 60
+
+# 单个分片的股票数上限（分片越小进度越平滑，越大调度开销越低）
+MAX_CHUNK_SIZE = 100
+
+
+def is_excluded_name(name):
+    """退市/未知/ST 股票"""
+    return any(kw in name for kw in INVALID_NAME_KEYWORDS) or name.startswith('ST') or name.startswith('*ST')
+
+
+def prescreen(codes, stock_names, manifest, min_bars=MIN_BARS):
+    """
+    读取数据前的预筛选：只用股票名称和清单中的行数，每只股票计入第一个命中的筛选项
+    :param manifest: StockManifest，清单中没有的股票不按行数过滤
+    :return: (通过的股票代码列表, {筛选项: 剔除数})
+    """
+    rows_label = f'K线不足{min_bars}条'
+    removed = {**dict.fromkeys(NAME_FILTERS, 0), rows_label: 0}
+    eligible = []
+    for code in codes:
+        name = stock_names.get(code, '未知')
+        entry = manifest.get(code)
+        if any(kw in name for kw in INVALID_NAME_KEYWORDS):
+            removed[NAME_FILTERS[0]] += 1
+        elif name.startswith('ST') or name.startswith('*ST'):
+            removed[NAME_FILTERS[1]] += 1
+        elif entry is not None and entry['rows'] < min_bars:
+            removed[rows_label] += 1
+        else:
+            eligible.append(code)
+    return eligible, removed
+
+
+def strategy_prefilter(strategy, codes, manifest):
+    """策略声明的预筛选（只看清单元信息），清单中没有的股票保留"""
+    kept = []
+    for code in codes:
+        entry = manifest.get(code)
+        if entry is None or strategy.prefilter(entry):
+            kept.append(code)
+    return kept
+
+
+def read_window(strategies, tail_window=True):
+    """
+    多个策略共用一次读取时的K线条数：取各策略预热窗口的最大值
+    :return: 条数，None 表示读取全部历史
+    """
+    if not tail_window:
+        return None
+    warmups = [strategy.warmup_bars for strategy in strategies.values()]
+    return None if not warmups or None in warmups else max(warmups)
+
+
+def _run_strategies(strategies, df, tail_window, name, keep_data, staged=True):
+    """
+    在同一份数据上依次运行多个策略，预热窗口相同的策略共用一个指标缓存
+    :param staged: 支持分阶段选股的策略先检查廉价条件，通过后才计算完整指标
+    :return: {策略名: (数据是否足够, 选股信号, 指标数据, 淘汰阶段)}
+    """
+    caches = {}
+    results = {}
+    for strategy_name, strategy in strategies.items():
+        warmup = strategy.warmup_bars if tail_window else None
+        window = df.head(warmup) if warmup and warmup < len(df) else df
+        if len(window) < MIN_BARS:
+            results[strategy_name] = (False, [], None, None)
+            continue
+        
+        cache = None
+        if isinstance(strategy, CachedIndicatorStrategy):
+            cache = caches.get(len(window))
+            if cache is None:
+                cache = caches[len(window)] = IndicatorCache(window)
+        
+        if staged and isinstance(strategy, StagedStrategy):
+            stage, signal_list, df_with_indicators = strategy.select_stocks_staged(window, name, cache=cache)
+        else:
+            if cache is not None:
+                df_with_indicators = strategy.calculate_indicators(window, cache=cache)
+            else:
+                df_with_indicators = strategy.calculate_indicators(window)
+            signal_list = strategy.select_stocks(df_with_indicators, name)
+            stage = None
+        results[strategy_name] = (True, signal_list, df_with_indicators if keep_data and signal_list else None, stage)
+    return results
+
+
+def screen_stock(csv_manager, strategies, code, name, tail_window=True, validate=False, keep_data=False, staged=True):
+    """
+    单只股票选股（串行和并行共用）：只读取一次数据，依次交给全部策略
+    :param strategies: {策略名: 策略实例}
+    :param tail_window: 是否只读取策略声明的尾部预热窗口
+    :param validate: 是否与全量历史的选股结果比对（仅尾部窗口生效）
+    :param keep_data: 入选时是否返回指标数据
+    :param staged: 是否分阶段选股（策略支持时）
+    :return: {'status': 'invalid'(名称过滤) / 'read',
+              'strategies': {策略名: {'status': 'short'(K线不足) / 'screened', 'signals': 选股信号,
+                                      'data': 指标数据或None, 'expected': 全量历史信号或None,
+                                      'stage': 分阶段选股的淘汰阶段或None}}}
+    """
+    outcome = {'status': 'invalid', 'strategies': {}}
+    if is_excluded_name(name):
+        return outcome
+    outcome['status'] = 'read'
+    
+    # 读取单只股票（各策略都声明了预热窗口时只读尾部）
+    warmup = read_window(strategies, tail_window)
+    df = csv_manager.read_latest(code, n=warmup) if warmup else csv_manager.read_stock(code)
+    for strategy_name, (valid, signal_list, data, stage) in _run_strategies(
+            strategies, df, tail_window, name, keep_data, staged).items():
+        outcome['strategies'][strategy_name] = {'status': 'screened' if valid else 'short', 'signals': signal_list,
+                                                'data': data, 'expected': None, 'stage': stage}
+    
+    # 校验：尾部窗口（及分阶段）结果必须与全量历史的完整计算一致
+    if tail_window and validate:
+        full_df = csv_manager.read_stock(code)
+        checked = {strategy_name: strategy for strategy_name, strategy in strategies.items()
+                   if strategy.warmup_bars and outcome['strategies'][strategy_name]['status'] == 'screened'
+                   and len(full_df) > strategy.warmup_bars}
+        for strategy_name, (_, expected, _, _) in _run_strategies(checked, full_df, False, name, False, False).items():
+            outcome['strategies'][strategy_name]['expected'] = expected
+    return outcome
+
+
+# ========== 子进程 ==========
+
+_worker = {}
+
+
+def _init_worker(data_dir, strategy_dir, strategy_specs):
+    """子进程初始化：重建数据管理器、市值快照和策略实例"""
+    if strategy_dir not in sys.path:
+        sys.path.insert(0, strategy_dir)
+    set_default_data_dir(data_dir)
+    _worker['csv_manager'] = get_storage_manager(data_dir)
+    _worker['strategies'] = {
+        name: getattr(importlib.import_module(module), class_name)(params=params)
+        for name, module, class_name, params in strategy_specs
+    }
+
+
+def _screen_chunk(chunk, tail_window, validate, keep_data, staged):
+    strategies = _worker['strategies']
+    return [
+        (code, screen_stock(_worker['csv_manager'], {strategy_name: strategies[strategy_name] for strategy_name in strategy_names},
+                            code, name, tail_window, validate, keep_data, staged))
+        for code, name, strategy_names in chunk
+    ]
+
+
+# ========== 主进程 ==========
+
+class ParallelScreener:
+    """选股进程池"""
+    
+    def __init__(self, data_dir, strategies, workers, strategy_dir="strategy"):
+        """
+        :param strategies: {策略名: 策略实例}，子进程按类名和参数重新创建
+        :param workers: 进程数
+        """
+        self.workers = workers
+        specs = [(name, type(strategy).__module__, type(strategy).__name__, strategy.params)
+                 for name, strategy in strategies.items()]
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(str(data_dir), str(Path(strategy_dir).resolve()), specs),
+        )
+    
+    def screen(self, items, tail_window=True, validate=False, keep_data=False, staged=True, on_progress=None):
+        """
+        并行选股
+        :param items: [(code, name, 参与逐只选股的策略名列表)]
+        :param on_progress: 每完成一个分片回调 on_progress(已完成数, 总数, 读取数, 入选数)
+        :return: [(code, outcome)]，顺序与 items 一致
+        """
+        total = len(items)
+        chunk_size = max(1, min(MAX_CHUNK_SIZE, math.ceil(total / (self.workers * 4))))
+        chunks = [items[i:i + chunk_size] for i in range(0, total, chunk_size)]
+        futures = {
+            self.pool.submit(_screen_chunk, chunk, tail_window, validate, keep_data, staged): index
+            for index, chunk in enumerate(chunks)
+        }
+        
+        results = [None] * len(chunks)
+        done = read = selected = 0
+        for future in as_completed(futures):
+            chunk_result = future.result()
+            results[futures[future]] = chunk_result
+            done += len(chunk_result)
+            read += sum(outcome['status'] == 'read' for _, outcome in chunk_result)
+            selected += sum(any(result['signals'] for result in outcome['strategies'].values())
+                            for _, outcome in chunk_result)
+            if on_progress:
+                on_progress(done, total, read, selected)
+        
+        return [item for chunk_result in results for item in chunk_result]
+    
+    def close(self):
+        self.pool.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,321 @@
+"""
+策略参数搜索 - 基于历史信号回测，在进程池中评估一组参数网格（或随机抽样）
+
+- 子进程以只读内存映射打开行情面板，原始行情和持有期收益每个进程只准备一次
+- 策略通过 history_indicator_params 声明 history_indicators 依赖的参数（碗口反弹为 M1~M4），
+  这些参数相同的参数组共用同一份趋势线和KDJ：参数组按它们分组后再切片，
+  每个进程对同一组指标只计算一次，N/M/J_VAL/分类百分比只重算信号
+- 结果按指定持有期的收益指标排序
+
+滚动前推（walk-forward）：指标只用到当日及以前的数据，整段历史算一次即可；
+每组参数的信号也只算一次，各样本内/样本外区间只是按信号日期切分，
+不为每个区间重新读取数据或重算指标。
+"""
+import importlib
+import itertools
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到路径（子进程以 spawn 方式启动时同样需要）
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.backtest import (
+    DEFAULT_HORIZONS, date_mask, forward_returns, load_raw, return_metrics, signal_dates, summarize
+)
+from utils.market_cap_snapshot import set_default_data_dir
+from utils.market_panel import load_market_panel
+
+
+# 排序可用的指标（summarize 中的列），回撤为负数，同样越大越好
+SWEEP_METRICS = ('mean_return', 'median_return', 'hit_rate', 'mean_drawdown')
+
+# 未指定进程数时最多使用的进程数（每个进程各自保留一组压缩后的指标，进程过多时内存占用随之成倍增加）
+MAX_DEFAULT_WORKERS = 4
+
+
+def default_workers():
+    """未指定进程数时使用的进程数：CPU核数，至多 MAX_DEFAULT_WORKERS"""
+    return max(1, min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS))
+
+
+def expand_grid(grid, samples=0, seed=None):
+    """
+    展开参数网格
+    :param grid: {参数名: 候选值列表}
+    :param samples: >0 时从全部组合中不放回随机抽取这么多组
+    :return: [{参数名: 值}]
+    """
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    if samples and samples < len(combos):
+        combos = random.Random(seed).sample(combos, samples)
+    return combos
+
+
+class SweepContext:
+    """
+    单个进程内的参数评估环境：持有期收益和统计日期范围只准备一次，
+    指标按 history_indicator_params 缓存；原始行情只在计算指标时从面板取出，算完即释放
+    （取全部股票时为内存映射视图，不复制）
+    """
+    
+    def __init__(self, panel, strategy_class, base_params, stock_codes=None,
+                 horizons=DEFAULT_HORIZONS, start=None, end=None):
+        self.strategy_class = strategy_class
+        self.base_params = dict(base_params)
+        self.horizons = tuple(horizons)
+        self.panel = panel
+        self.stock_codes = stock_codes
+        self.codes = None
+        self.panel_dates = panel.date_values()
+        self.start, self.end = start, end
+        self.returns = None
+        self.dates = None
+        self.mask = None
+        self._indicator_key = None
+        self._indicators = None
+        self.indicator_builds = 0
+    
+    def strategy(self, params):
+        return self.strategy_class(params=dict(self.base_params, **params))
+    
+    def indicators(self, strategy):
+        """取（或计算）与策略指标参数对应的 history_indicators 结果，只保留最近一组"""
+        names = strategy.history_indicator_params
+        key = tuple(strategy.params[name] for name in names) if names is not None else repr(sorted(strategy.params.items()))
+        if key != self._indicator_key:
+            # 先释放上一组指标再计算，进程内最多同时保留一组
+            self._indicators = None
+            self.codes, raw = load_raw(self.panel, self.stock_codes)
+            self._indicators = strategy.history_indicators(raw, self.codes)
+            del raw
+            self._indicator_key = key
+            self.indicator_builds += 1
+            if self.returns is None:
+                # 压缩索引只由收盘价决定，持有期收益和日期对所有参数组都相同
+                self.returns = forward_returns(self._indicators['close'], self._indicators['low'], self.horizons)
+                self.dates = signal_dates(self._indicators['index'], self.panel_dates)
+                self.mask = date_mask(self.dates, self.start, self.end)
+        return self._indicators
+    
+    def evaluate(self, params):
+        """
+        评估一组参数
+        :return: {'params': params, 'signals': 信号数, '<指标>_<N>': 全部分类汇总后的指标}
+        """
+        strategy = self.strategy(params)
+        data = self.indicators(strategy)
+        signal, category = strategy.history_signals(data)
+        summary = summarize(signal, category, self.returns, strategy.history_categories, self.mask)
+        overall = summary[summary['category'] == 'all']
+        row = {'params': params, 'signals': int((signal & self.mask).sum())}
+        for item in overall.itertuples(index=False):
+            for metric in SWEEP_METRICS:
+                row[f"{metric}_{item.horizon}"] = getattr(item, metric)
+        return row
+    
+    def evaluate_windows(self, params, windows):
+        """
+        在多个日期区间上评估同一组参数：信号只计算一次，再按信号日期切分
+        :param windows: [(start, end)]，YYYY-MM-DD
+        :return: {'params': params, 'windows': [{'signals': 信号数, 'signals_<N>': 有持有期收益的信号数,
+                                                 '<指标>_<N>': 指标}]}
+        """
+        strategy = self.strategy(params)
+        data = self.indicators(strategy)
+        signal, _ = strategy.history_signals(data)
+        rows, cols = np.nonzero(signal)
+        event_dates = self.dates[rows, cols]
+        event_returns = {n: (ret[rows, cols], drawdown[rows, cols]) for n, (ret, drawdown) in self.returns.items()}
+        
+        results = []
+        for start, end in windows:
+            in_window = date_mask(event_dates, start, end)
+            result = {'signals': int(in_window.sum())}
+            for n, (ret, drawdown) in event_returns.items():
+                picked = in_window & ~np.isnan(ret)
+                metrics = return_metrics(ret[picked], drawdown[picked])
+                result[f"signals_{n}"] = metrics['signals']
+                for metric in SWEEP_METRICS:
+                    result[f"{metric}_{n}"] = metrics[metric]
+            results.append(result)
+        return {'params': params, 'windows': results}
+
+
+def indicator_key(strategy_class, base_params, params):
+    """参数组对应的指标缓存键（用于分组）"""
+    names = strategy_class.history_indicator_params
+    merged = dict(base_params, **params)
+    return tuple(merged.get(name) for name in names) if names is not None else repr(sorted(merged.items()))
+
+
+def rank_results(rows, horizon=5, metric='mean_return', min_signals=0):
+    """
+    整理为排序后的结果表：每组参数一行，参数列在前
+    :param min_signals: 信号数少于此值的参数组排在最后
+    """
+    table = pd.DataFrame([dict(row['params'], **{k: v for k, v in row.items() if k != 'params'}) for row in rows])
+    if table.empty:
+        return table
+    sort_column = f"{metric}_{horizon}"
+    table['_enough'] = table['signals'] >= min_signals
+    table = table.sort_values(['_enough', sort_column], ascending=[False, False], na_position='last')
+    return table.drop(columns='_enough').reset_index(drop=True)
+
+
+# ========== 滚动前推 ==========
+
+def walk_forward_windows(dates, in_sample, out_of_sample, gap=0):
+    """
+    按交易日切分滚动窗口：样本内 in_sample 天，紧接着样本外 out_of_sample 天，每次前推 out_of_sample 天
+    :param dates: 交易日列表（YYYY-MM-DD，正序）
+    :param gap: 样本内最后 gap 天的信号不参与优化（其持有期会延伸到样本外），通常取最长持有期
+    :return: [{'in_sample': (start, end), 'out_of_sample': (start, end)}]
+    """
+    windows = []
+    start = 0
+    while start + in_sample < len(dates) and in_sample > gap:
+        oos_end = min(start + in_sample + out_of_sample, len(dates)) - 1
+        windows.append({
+            'in_sample': (dates[start], dates[start + in_sample - 1 - gap]),
+            'out_of_sample': (dates[start + in_sample], dates[oos_end]),
+        })
+        start += out_of_sample
+    return windows
+
+
+def walk_forward_select(rows, windows, horizon=5, metric='mean_return', min_signals=0):
+    """
+    每个窗口按样本内指标选出最优参数，取其样本外表现并串联
+    :param rows: evaluate_windows 的结果，区间顺序为 [窗口1样本内, 窗口1样本外, 窗口2样本内, ...]
+    :param min_signals: 样本内信号数少于此值的参数组不参与选择（都不满足时放宽）
+    :return: (每个窗口一行的 DataFrame, 串联后的样本外汇总 dict)
+    """
+    key = f"{metric}_{horizon}"
+    records = []
+    for i, window in enumerate(windows):
+        candidates = [(row['params'], row['windows'][2 * i], row['windows'][2 * i + 1]) for row in rows]
+        candidates = [c for c in candidates if not np.isnan(c[1][key])]
+        if not candidates:
+            continue
+        enough = [c for c in candidates if c[1]['signals'] >= min_signals] or candidates
+        params, in_sample, out_of_sample = max(enough, key=lambda c: c[1][key])
+        record = {
+            'in_sample': f"{window['in_sample'][0]} ~ {window['in_sample'][1]}",
+            'out_of_sample': f"{window['out_of_sample'][0]} ~ {window['out_of_sample'][1]}",
+            'params': params,
+            f"is_{key}": in_sample[key],
+            'is_signals': in_sample['signals'],
+        }
+        record.update({f"oos_{name}": value for name, value in out_of_sample.items()})
+        records.append(record)
+    
+    table = pd.DataFrame(records)
+    combined = {}
+    if not table.empty:
+        for n in sorted({int(column.rsplit('_', 1)[1]) for column in table.columns
+                         if column.startswith('oos_signals_')}):
+            weights = table[f"oos_signals_{n}"].to_numpy(dtype=float)
+            total = weights.sum()
+            combined[f"signals_{n}"] = int(total)
+            for metric_name in ('mean_return', 'hit_rate', 'mean_drawdown'):
+                values = table[f"oos_{metric_name}_{n}"].to_numpy(dtype=float)
+                combined[f"{metric_name}_{n}"] = (np.nansum(values * weights) / total) if total else np.nan
+    return table, combined
+
+
+# ========== 子进程 ==========
+
+_worker = {}
+
+
+def _init_worker(data_dir, strategy_dir, module, class_name, base_params, stock_codes, horizons, start, end):
+    """子进程初始化：只读打开面板，准备参数评估环境"""
+    if strategy_dir not in sys.path:
+        sys.path.insert(0, strategy_dir)
+    set_default_data_dir(data_dir)
+    strategy_class = getattr(importlib.import_module(module), class_name)
+    _worker['context'] = SweepContext(load_market_panel(data_dir), strategy_class, base_params,
+                                      stock_codes, horizons, start, end)
+
+
+def _evaluate_params(context, param_sets, windows=None):
+    if windows is not None:
+        return [context.evaluate_windows(params, windows) for params in param_sets]
+    return [context.evaluate(params) for params in param_sets]
+
+
+def _evaluate_chunk(param_sets, windows=None):
+    return _evaluate_params(_worker['context'], param_sets, windows)
+
+
+# ========== 主进程 ==========
+
+class ParamSweep:
+    """参数搜索（workers>1 时使用进程池）"""
+    
+    def __init__(self, data_dir, strategy, workers=1, stock_codes=None, horizons=DEFAULT_HORIZONS,
+                 start=None, end=None, strategy_dir="strategy"):
+        """
+        :param strategy: 作为基准参数的策略实例（需支持历史信号），搜索的参数覆盖其 params
+        :param workers: 进程数，0 或 None 时为 default_workers()
+        :param start / end: 只统计该日期范围内的信号
+        """
+        self.data_dir = str(data_dir)
+        self.strategy_class = type(strategy)
+        self.base_params = dict(strategy.params)
+        self.workers = workers or default_workers()
+        self.stock_codes = stock_codes
+        self.horizons = tuple(horizons)
+        self.start, self.end = start, end
+        self.strategy_dir = str(Path(strategy_dir).resolve())
+    
+    def _chunks(self, param_sets):
+        """按指标参数分组，每组再切成至多 workers 片，同一片内共用一份指标"""
+        groups = {}
+        for params in param_sets:
+            groups.setdefault(indicator_key(self.strategy_class, self.base_params, params), []).append(params)
+        chunks = []
+        for group in groups.values():
+            size = max(1, math.ceil(len(group) / self.workers))
+            chunks.extend(group[i:i + size] for i in range(0, len(group), size))
+        return chunks
+    
+    def run(self, param_sets, windows=None, on_progress=None):
+        """
+        评估全部参数组
+        :param windows: [(start, end)]，给出时每组参数在各区间上分别评估（evaluate_windows）
+        :param on_progress: 每完成一片回调 on_progress(已完成数, 总数)
+        :return: [evaluate / evaluate_windows 结果]，顺序与 param_sets 按指标参数分组后的顺序一致
+        """
+        chunks = self._chunks(param_sets)
+        total = len(param_sets)
+        
+        if self.workers <= 1:
+            context = SweepContext(load_market_panel(self.data_dir), self.strategy_class, self.base_params,
+                                   self.stock_codes, self.horizons, self.start, self.end)
+            rows = []
+            for chunk in chunks:
+                rows.extend(_evaluate_params(context, chunk, windows))
+                if on_progress:
+                    on_progress(len(rows), total)
+            return rows
+        
+        initargs = (self.data_dir, self.strategy_dir, self.strategy_class.__module__, self.strategy_class.__name__,
+                    self.base_params, self.stock_codes, self.horizons, self.start, self.end)
+        results = [None] * len(chunks)
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(_evaluate_chunk, chunk, windows): index for index, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                done += len(results[futures[future]])
+                if on_progress:
+                    on_progress(done, total)
+        return [row for chunk_rows in results for row in chunk_rows]
@@ -0,0 +1,130 @@
+"""
+B1全市场相似度扫描 - 不经过选股策略，把全部股票最新的回看窗口与B1案例库批量匹配
+
+- 特征提取只依赖最新 lookback_days 条K线，每只股票只读取这几条
+- 进程池分片提取特征，子进程只回传特征字典（几十个数值）
+- 主进程把全部候选特征编码为矩阵，与案例库一次性批量计算相似度（DTW下界剪枝），
+  按最佳匹配的相似度对全市场排序
+"""
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+# 添加项目根目录到路径（子进程以 spawn 方式启动时同样需要）
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.csv_manager import get_storage_manager
+from strategy.pattern_feature_extractor import PatternFeatureExtractor
+
+
+# 特征提取所需的最少K线数（与 PatternFeatureExtractor.extract 一致）
+MIN_FEATURE_BARS = 10
+
+# 单个分片的股票数上限
+MAX_CHUNK_SIZE = 200
+
+# 扫描结果的明细列
+BREAKDOWN_COLUMNS = ('trend_structure', 'kdj_state', 'volume_pattern', 'price_shape')
+
+
+def extract_latest(csv_manager, extractor, codes, lookback_days):
+    """
+    提取每只股票最新回看窗口的特征
+    :return: [(code, 最新日期, 特征)]，K线不足、读取或特征提取失败的股票跳过（不影响同一分片的其余股票）
+    """
+    results = []
+    for code in codes:
+        try:
+            df = csv_manager.read_latest(code, lookback_days)
+            if len(df) < MIN_FEATURE_BARS:
+                continue
+            results.append((code, str(df['date'].iloc[0])[:10], extractor.extract(df, lookback_days=lookback_days)))
+        except Exception as e:
+            print(f"  ⚠️ {code} 特征提取失败，跳过: {e}")
+    return results
+
+
+def rank_matches(items, match_lists, stock_names):
+    """
+    按最佳匹配的相似度对全部股票排序
+    :param items: [(code, 最新日期, 特征)]
+    :param match_lists: B1PatternLibrary.match_features 的结果，与 items 对应
+    :return: DataFrame（stock_code, stock_name, date, similarity_score, matched_case, matched_date,
+             matched_code, 四维明细），相似度降序
+    """
+    rows = []
+    for (code, date, _), matches in zip(items, match_lists):
+        if not matches:
+            continue
+        best = matches[0]
+        row = {
+            'stock_code': code,
+            'stock_name': stock_names.get(code, '未知'),
+            'date': date,
+            'similarity_score': best['similarity_score'],
+            'matched_case': best['case_name'],
+            'matched_date': best['case_date'],
+            'matched_code': best['case_code'],
+        }
+        row.update({column: best['breakdown'].get(column) for column in BREAKDOWN_COLUMNS})
+        rows.append(row)
+    
+    columns = ['stock_code', 'stock_name', 'date', 'similarity_score', 'matched_case', 'matched_date',
+               'matched_code', *BREAKDOWN_COLUMNS]
+    table = pd.DataFrame(rows, columns=columns)
+    return table.sort_values('similarity_score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+# ========== 子进程 ==========
+
+_worker = {}
+
+
+def _init_worker(data_dir):
+    """子进程初始化：重建数据管理器和特征提取器"""
+    _worker['csv_manager'] = get_storage_manager(data_dir)
+    _worker['extractor'] = PatternFeatureExtractor()
+
+
+def _extract_chunk(codes, lookback_days):
+    return extract_latest(_worker['csv_manager'], _worker['extractor'], codes, lookback_days)
+
+
+# ========== 主进程 ==========
+
+class PatternScanner:
+    """全市场特征提取（workers <= 1 时在当前进程串行执行）"""
+    
+    def __init__(self, data_dir, workers=1):
+        self.data_dir = str(data_dir)
+        self.workers = workers
+    
+    def extract(self, codes, lookback_days, on_progress=None):
+        """
+        提取全部股票的最新窗口特征
+        :param on_progress: 每完成一个分片回调 on_progress(已完成数, 总数)
+        :return: [(code, 最新日期, 特征)]，顺序与 codes 一致
+        """
+        total = len(codes)
+        if self.workers <= 1:
+            items = extract_latest(get_storage_manager(self.data_dir), PatternFeatureExtractor(), codes, lookback_days)
+            if on_progress:
+                on_progress(total, total)
+            return items
+        
+        chunk_size = max(1, min(MAX_CHUNK_SIZE, math.ceil(total / (self.workers * 4))))
+        chunks = [codes[i:i + chunk_size] for i in range(0, total, chunk_size)]
+        results = [None] * len(chunks)
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.data_dir,)) as pool:
+            futures = {pool.submit(_extract_chunk, chunk, lookback_days): index for index, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index] = future.result()
+                done += len(chunks[index])
+                if on_progress:
+                    on_progress(done, total)
+        return [item for chunk_result in results for item in chunk_result]
@@ -0,0 +1,225 @@
+"""
+选股流程 - 预筛选、批量选股、逐只选股和结果统计（main.py select 命令的实现）
+
+1. 预筛选：读取任何数据前按名称、清单行数和策略声明的 prefilter 缩小范围
+2. 批量选股：支持面板的策略交给全市场面板一次算完；开启增量模式时，
+   支持流式指标状态的策略只用新增K线递推指标
+3. 逐只选股：其余策略（以及面板中没有的股票）每只股票只读取一次，依次交给这些策略；
+   workers>1 时分片交给进程池，按原顺序合并
+4. 按策略汇总入选股票、过滤原因、分阶段淘汰数和尾部窗口校验结果
+"""
+import gc
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.parallel_select import (
+    NAME_FILTERS, ParallelScreener, prescreen, read_window, screen_stock, strategy_prefilter
+)
+from strategy.base_strategy import PanelStrategy, StateStrategy
+
+
+class SelectPipeline:
+    """一次选股的完整流程"""
+    
+    def __init__(self, csv_manager, strategies, data_dir, tail_window=True, validate=False, staged=True,
+                 workers=1, incremental=False, rebuild_state=False):
+        """
+        :param strategies: {策略名: 策略实例}
+        :param tail_window: 逐只选股时只读取策略声明的尾部预热窗口
+        :param validate: 尾部窗口结果与全量历史比对，不一致时报错
+        :param staged: 支持分阶段选股的策略先检查廉价条件
+        :param workers: 逐只选股的进程数
+        :param incremental: 支持流式指标状态的策略用增量指标选股（未使用面板时）
+        :param rebuild_state: 增量模式下全量重建指标状态
+        """
+        self.csv_manager = csv_manager
+        self.strategies = strategies
+        self.data_dir = data_dir
+        self.tail_window = tail_window
+        self.validate = validate
+        self.staged = staged
+        self.workers = workers
+        self.incremental = incremental
+        self.rebuild_state = rebuild_state
+    
+    def run(self, codes, stock_names, panel=None, category='all', return_data=False):
+        """
+        执行选股
+        :param codes: 参与选股的股票代码
+        :param panel: 已加载的 MarketPanel，None 表示不使用面板
+        :param category: 只保留该分类的信号，'all' 表示全部
+        :param return_data: 是否返回入选股票的指标数据（K线图使用）
+        :return: (results {策略名: [{'code', 'name', 'signals'}]}, 各分类信号数, {股票代码: 指标数据})
+        """
+        indicators_dict = {}  # 只保存入选股票的数据
+        category_count = {'bowl_center': 0, 'near_duokong': 0, 'near_short_trend': 0}
+        
+        # 每个策略的选股结果和计数
+        # 过滤原因分别计数：invalid 名称（退市/ST），short K线不足，prefiltered 策略预筛选
+        stats = {strategy_name: {'signals': [], 'valid': 0, 'invalid': 0, 'short': 0, 'prefiltered': 0,
+                                 'mismatched': [], 'stages': {}}
+                 for strategy_name in self.strategies}
+        
+        def collect(strategy_name, code, signal_list, data=None, strategy=None):
+            """记录一只股票的选股信号（data 为 None 且需要返回数据时读取全部历史按 strategy 重新计算）"""
+            for s in signal_list:
+                cat = s.get('category', 'unknown')
+                category_count[cat] = category_count.get(cat, 0) + 1
+                
+                if category == 'all' or cat == category:
+                    stats[strategy_name]['signals'].append({
+                        'code': code,
+                        'name': stock_names.get(code, '未知'),
+                        'signals': [s]
+                    })
+                    # 只保存入选股票的数据
+                    if return_data:
+                        if data is None:
+                            data = strategy.calculate_indicators(self.csv_manager.read_stock(code))
+                        indicators_dict[code] = data
+        
+        # 预筛选：读取任何数据前，按名称、清单行数和策略声明的 prefilter 缩小范围
+        manifest = self.csv_manager.manifest
+        eligible_codes, removed = prescreen(codes, stock_names, manifest)
+        print(f"\n预筛选（不读取数据）: {len(codes)} → {len(eligible_codes)} 只")
+        for label, count in removed.items():
+            print(f"  - {label}: {count} 只")
+        strategy_codes = {}
+        for strategy_name, strategy in self.strategies.items():
+            strategy_codes[strategy_name] = strategy_prefilter(strategy, eligible_codes, manifest)
+            stats[strategy_name]['invalid'] = sum(removed[label] for label in NAME_FILTERS)
+            stats[strategy_name]['short'] = len(codes) - len(eligible_codes) - stats[strategy_name]['invalid']
+            stats[strategy_name]['prefiltered'] = len(eligible_codes) - len(strategy_codes[strategy_name])
+            print(f"  - {strategy_name} 预筛选: {len(eligible_codes) - len(strategy_codes[strategy_name])} 只")
+        
+        # 面板/增量状态批量选股；其余策略（以及面板中没有的股票）逐只处理
+        loop_strategies = {}  # 股票代码 -> 需要逐只选股的策略名列表
+        for strategy_name, strategy in self.strategies.items():
+            use_panel = panel is not None and isinstance(strategy, PanelStrategy)
+            use_state = not use_panel and self.incremental and isinstance(strategy, StateStrategy)
+            if not (use_panel or use_state):
+                for code in strategy_codes[strategy_name]:
+                    loop_strategies.setdefault(code, []).append(strategy_name)
+                continue
+            
+            print(f"\n执行策略: {strategy_name}")
+            # 整体交给策略批量处理，面板中没有的股票仍逐只处理
+            batch_codes = []
+            for code in strategy_codes[strategy_name]:
+                if use_state or code in panel.code_index:
+                    batch_codes.append(code)
+                else:
+                    loop_strategies.setdefault(code, []).append(strategy_name)
+            
+            if use_panel:
+                print(f"  面板批量选股: {len(batch_codes)} 只")
+                batch_results = strategy.select_stocks_panel(panel, batch_codes)
+            else:
+                print(f"  增量指标选股: {len(batch_codes)} 只")
+                batch_results = self.select_with_state(strategy, batch_codes)
+            stats[strategy_name]['valid'] += len(batch_results)
+            for code, signal_list in batch_results.items():
+                # 只为入选股票计算完整指标（K线图使用）
+                collect(strategy_name, code, signal_list, strategy=strategy)
+        
+        # 逐只选股：每只股票只读取一次，依次交给全部策略（workers>1 时分片交给进程池，按原顺序合并）
+        loop_codes = [code for code in codes if code in loop_strategies]
+        if loop_codes:
+            loop_names = [name for name in self.strategies
+                          if any(name in loop_strategies[code] for code in loop_codes)]
+            print(f"\n逐只选股: {len(loop_codes)} 只，策略: {', '.join(loop_names)}")
+            warmup = read_window({name: self.strategies[name] for name in loop_names}, self.tail_window)
+            if warmup:
+                print(f"  尾部窗口: 每只股票读取最新 {warmup} 条K线")
+            # 尾部窗口的指标只覆盖预热窗口，需要返回数据时入选股票另外读取全部历史（K线图、B1匹配使用）
+            keep_data = return_data and not warmup
+            
+            # 多进程选股（各策略共用一个进程池，出现异常时也会关闭）
+            parallel = self.workers > 1 and len(loop_codes) > 1
+            if parallel:
+                print(f"  并行选股: {self.workers} 个进程")
+                with ParallelScreener(self.data_dir, self.strategies, self.workers) as screener:
+                    outcomes = screener.screen(
+                        [(code, stock_names.get(code, '未知'), loop_strategies[code]) for code in loop_codes],
+                        tail_window=self.tail_window, validate=self.validate, keep_data=keep_data, staged=self.staged,
+                        on_progress=lambda done, total, read, selected: print(
+                            f"  进度: [{done}/{total}] 读取 {read} 只，入选 {selected} 只..."))
+            else:
+                outcomes = ((code, screen_stock(self.csv_manager,
+                                                {name: self.strategies[name] for name in loop_strategies[code]},
+                                                code, stock_names.get(code, '未知'),
+                                                self.tail_window, self.validate, keep_data, self.staged))
+                            for code in loop_codes)
+            
+            read_count = 0
+            for i, (code, outcome) in enumerate(outcomes, 1):
+                if outcome['status'] == 'invalid':
+                    for strategy_name in loop_strategies[code]:
+                        stats[strategy_name]['invalid'] += 1
+                else:
+                    read_count += 1
+                
+                for strategy_name, result in outcome['strategies'].items():
+                    if result['status'] == 'short':
+                        stats[strategy_name]['short'] += 1
+                        continue
+                    stats[strategy_name]['valid'] += 1
+                    signal_list = result['signals']
+                    if result['stage']:
+                        stages = stats[strategy_name]['stages']
+                        stages[result['stage']] = stages.get(result['stage'], 0) + 1
+                    
+                    expected = result['expected']
+                    if expected is not None and signal_list != expected:
+                        stats[strategy_name]['mismatched'].append(code)
+                        print(f"  ✗ {strategy_name} {code} 尾部窗口结果与全量历史不一致: {signal_list} != {expected}")
+                    
+                    collect(strategy_name, code, signal_list, data=result['data'], strategy=self.strategies[strategy_name])
+                
+                # 每100只显示进度并GC（并行时由进程池回调显示进度）
+                if not parallel and (i % 100 == 0 or i == len(loop_codes)):
+                    gc.collect()
+                    selected = sum(len(stats[name]['signals']) for name in loop_names)
+                    print(f"  进度: [{i}/{len(loop_codes)}] 读取 {read_count} 只，选出 {selected} 只...")
+        
+        results = {}
+        for strategy_name, strategy in self.strategies.items():
+            stat = stats[strategy_name]
+            results[strategy_name] = stat['signals']
+            print(f"\n✓ {strategy_name} 选股完成: 共 {len(stat['signals'])} 只 (有效 {stat['valid']} 只，"
+                  f"名称过滤 {stat['invalid']} 只，K线不足 {stat['short']} 只，预筛选 {stat['prefiltered']} 只)")
+            if stat['stages']:
+                print("  分阶段淘汰: " + "，".join(f"{stage} {count} 只" for stage, count in sorted(stat["stages"].items(), key=lambda item: -item[1])))
+            
+            if self.tail_window and self.validate and strategy.warmup_bars:
+                mismatched = stat['mismatched']
+                assert not mismatched, f"{len(mismatched)} 只股票尾部窗口结果与全量历史不一致: {mismatched}"
+                print(f"  ✓ 尾部窗口校验通过: {stat['valid']} 只股票结果与全量历史一致")
+        
+        return results, category_count, indicators_dict
+    
+    def select_with_state(self, strategy, stock_codes):
+        """
+        基于流式指标状态选股：每只股票只读取最新几条K线递推指标
+        :return: {股票代码: 选股信号列表}，只包含K线数>=60的股票
+        """
+        store = strategy.create_state_store(self.data_dir)
+        if self.rebuild_state:
+            print("  全量重建指标状态...")
+        else:
+            store.load()
+        
+        results = {}
+        total = len(stock_codes)
+        for i, code in enumerate(stock_codes, 1):
+            state = store.sync(code, self.csv_manager)
+            if state.count >= 60:
+                results[code] = strategy.select_from_state(state, code)
+            
+            if i % 500 == 0 or i == total:
+                print(f"  进度: [{i}/{total}] 增量 {store.stats['incremental']} 只，"
+                      f"重建 {store.stats['rebuilt']} 只，无新数据 {store.stats['unchanged']} 只")
+        
+        store.save()
+        return results
@@ -0,0 +1,224 @@
+"""
+股票数据清单 - 记录每只股票数据文件的元信息
+
+保存在数据目录下的 stock_manifest.json，每只股票一条：
+- path: 数据文件相对数据目录的路径
+- rows / first_date / last_date: 行数和日期范围
+- last_close / last_volume / last_market_cap: 最新收盘价、成交量和总市值
+- size / mtime: 文件大小和修改时间（纳秒），用于发现清单之外的改动
+
+由 write_stock/update_stock 写入时维护。列出股票、计数、判断是否需要更新都直接查清单，
+不再遍历目录或打开数据文件；选股前的预筛选也只看清单（行数、最新一天的行情）。
+清单与文件不一致时用 `python main.py manifest` 重建。
+
+多个进程可以同时写入（如 update 与 web 服务）：保存时若清单文件在加载后被其他进程保存过，
+先读入磁盘上的记录，只用本进程改动或删除过的股票覆盖，再原子替换，不会丢掉对方的记录。
+读入与替换之间没有加锁，两个进程在同一瞬间保存时，先保存者在这一瞬间之后的改动可能被覆盖，
+下次写入同一股票或重建清单时恢复。
+"""
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+
+# 清单文件名（位于数据目录下）
+MANIFEST_FILE_NAME = 'stock_manifest.json'
+
+# 清单格式版本，结构变化时递增，旧文件视为不完整并重建
+MANIFEST_VERSION = 3
+
+
+class StockManifest:
+    """股票数据清单（JSON持久化）"""
+    
+    def __init__(self, data_dir="data", storage='csv'):
+        """
+        :param storage: 数据文件的存储格式，与清单记录的不一致时清单视为不完整
+        """
+        self.data_dir = Path(data_dir)
+        self.manifest_file = self.data_dir / MANIFEST_FILE_NAME
+        self.storage = storage
+        self.entries = {}
+        self.complete = False       # 是否覆盖数据目录下的全部文件（重建过）
+        self.dirty = False
+        self.loaded_mtime = None
+        self._codes = None
+        # 加载后本进程改动过的股票（保存时与其他进程写入的清单合并）
+        self.changed = set()
+        self.removed = set()
+    
+    def load(self):
+        """从本地文件加载清单"""
+        self.entries = {}
+        self.complete = False
+        self._codes = None
+        self.changed = set()
+        self.removed = set()
+        data = self._read()
+        if data is not None:
+            self.entries = data.get('stocks', {})
+            self.complete = bool(data.get('complete'))
+        return self
+    
+    def _read(self):
+        """读取清单文件，记录其修改时间；文件不存在、损坏或版本/存储格式不符时返回 None"""
+        if not self.manifest_file.exists():
+            return None
+        try:
+            self.loaded_mtime = self.manifest_file.stat().st_mtime_ns
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"  读取股票清单失败，将重建: {e}")
+            return None
+        
+        if data.get('version') != MANIFEST_VERSION or data.get('storage') != self.storage:
+            return None
+        return data
+    
+    def reload_if_changed(self):
+        """清单文件被其他进程更新过时重新加载（长期运行的进程在列出股票前调用）"""
+        if self.dirty or not self.manifest_file.exists():
+            return
+        if self.manifest_file.stat().st_mtime_ns != self.loaded_mtime:
+            self.load()
+    
+    def save(self):
+        """有改动时原子写入清单文件（清单文件在加载后被其他进程保存过时先合并）"""
+        if not self.dirty:
+            return
+        if self.manifest_file.exists() and self.manifest_file.stat().st_mtime_ns != self.loaded_mtime:
+            self._merge_saved()
+        data = {
+            'version': MANIFEST_VERSION,
+            'storage': self.storage,
+            'complete': self.complete,
+            'stocks': self.entries,
+        }
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.manifest_file)
+        self.loaded_mtime = self.manifest_file.stat().st_mtime_ns
+        self.dirty = False
+        self.changed = set()
+        self.removed = set()
+    
+    def _merge_saved(self):
+        """以其他进程保存的清单为基础，只覆盖本进程改动或删除过的股票"""
+        data = self._read()
+        if data is None:
+            return
+        entries = data.get('stocks', {})
+        for stock_code in self.removed:
+            entries.pop(stock_code, None)
+        for stock_code in self.changed:
+            entries[stock_code] = self.entries[stock_code]
+        self.entries = entries
+        # 任一方重建过即覆盖全部文件（另一方只会在此基础上增删记录）
+        self.complete = self.complete or bool(data.get('complete'))
+        self._codes = None
+    
+    # ========== 维护 ==========
+    
+    def record(self, stock_code, path, df):
+        """
+        按写入的完整数据记录一只股票
+        :param df: 文件中的全部数据（正序或倒序均可）
+        """
+        if df is None or df.empty:
+            self.remove(stock_code)
+            return
+        dates = df['date'].to_numpy()
+        entry = {
+            'rows': len(df),
+            'first_date': pd.Timestamp(dates.min()).strftime('%Y-%m-%d'),
+        }
+        entry.update(self._latest_fields(df.iloc[dates.argmax()]))
+        self._set(stock_code, path, entry)
+    
+    def record_append(self, stock_code, path, tail, added):
+        """
+        追加写入后更新记录
+        :param tail: 重写的文件尾部（含新数据）
+        :param added: 新增行数
+        :return: 清单中原来没有该股票时返回 False（需由调用方扫描文件后记录）
+        """
+        entry = self.entries.get(stock_code)
+        if entry is None:
+            return False
+        entry = dict(entry, rows=entry['rows'] + added)
+        entry.update(self._latest_fields(tail.iloc[tail['date'].to_numpy().argmax()]))
+        self._set(stock_code, path, entry)
+        return True
+    
+    def record_summary(self, stock_code, path, rows, first, latest):
+        """按文件摘要（行数、最早一行、最新一行）记录，重建清单时不读取完整文件"""
+        entry = {
+            'rows': rows,
+            'first_date': pd.Timestamp(first['date']).strftime('%Y-%m-%d'),
+        }
+        entry.update(self._latest_fields(latest))
+        self._set(stock_code, path, entry)
+    
+    def remove(self, stock_code):
+        if self.entries.pop(stock_code, None) is not None:
+            self._codes = None
+            self.dirty = True
+            self.changed.discard(stock_code)
+            self.removed.add(stock_code)
+    
+    def _latest_fields(self, latest):
+        market_cap = latest.get('market_cap', float('nan'))
+        volume = latest.get('volume', float('nan'))
+        return {
+            'last_date': pd.Timestamp(latest['date']).strftime('%Y-%m-%d'),
+            'last_close': float(latest['close']),
+            'last_volume': None if pd.isna(volume) else float(volume),
+            'last_market_cap': None if pd.isna(market_cap) else float(market_cap),
+        }
+    
+    def _set(self, stock_code, path, entry):
+        stat = Path(path).stat()
+        entry['path'] = Path(path).relative_to(self.data_dir).as_posix()
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime_ns
+        if stock_code not in self.entries:
+            self._codes = None
+        self.entries[stock_code] = entry
+        self.dirty = True
+        self.changed.add(stock_code)
+        self.removed.discard(stock_code)
+    
+    # ========== 查询 ==========
+    
+    def codes(self):
+        """全部股票代码（排序）"""
+        if self._codes is None:
+            self._codes = sorted(self.entries)
+        return self._codes
+    
+    def get(self, stock_code):
+        return self.entries.get(stock_code)
+    
+    def latest(self, stock_code):
+        """
+        最新日期和收盘价
+        :return: (date, close)，清单中没有时返回 None
+        """
+        entry = self.entries.get(stock_code)
+        if entry is None:
+            return None
+        return pd.Timestamp(entry['last_date']).date(), entry['last_close']
+    
+    def latest_date(self):
+        """全部股票中最新的数据日期（YYYY-MM-DD），没有数据时返回 None"""
+        return max((entry['last_date'] for entry in self.entries.values()), default=None)
+    
+    def is_current(self, stock_code, stat):
+        """记录的文件大小和修改时间是否与 stat 一致"""
+        entry = self.entries.get(stock_code)
+        return entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
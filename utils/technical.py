@@ -3,6 +3,7 @@
 """
 import pandas as pd
 import numpy as np
+from scipy.signal import lfilter
 
 
 def MA(series, n):
@@ -49,17 +50,32 @@ def HHV(series, n):
     return hhv_reversed.iloc[::-1].reset_index(drop=True).set_axis(series.index)
 
 
+def _sma_recursive(values, n, m, init):
+    """
+    通达信SMA递推的线性滤波实现
+    Y[0] = init, Y[i] = (X[i]*M + Y[i-1]*(N-M)) / N
+    等价于一阶IIR滤波器，由 scipy.signal.lfilter 在C层完成递推
+    """
+    result = np.empty(len(values), dtype=float)
+    if len(values) == 0:
+        return result
+    
+    result[0] = init
+    if len(values) > 1:
+        decay = (n - m) / n
+        result[1:], _ = lfilter([m / n], [1.0, -decay], values[1:], zi=[decay * init])
+    return result
+
+
 def SMA(X, n, m):
     """
     移动平均 - 通达信风格
     SMA(X,N,M): X的N日移动平均, M为权重
     公式: Y = (X*M + Y'*(N-M)) / N
     """
-    result = pd.Series(index=X.index, dtype=float)
-    result.iloc[0] = X.iloc[0]
-    for i in range(1, len(X)):
-        result.iloc[i] = (X.iloc[i] * m + result.iloc[i-1] * (n - m)) / n
-    return result
+    values = X.to_numpy(dtype=float)
+    init = values[0] if len(values) else np.nan
+    return pd.Series(_sma_recursive(values, n, m, init), index=X.index)
 
 
 def REF(series, n):
@@ -114,32 +130,22 @@ def KDJ(df, n=9, m1=3, m2=3):
         df_calc = df.copy().reset_index(drop=True)
     
     # 计算RSV
-    low_min = df_calc['low'].rolling(window=n, min_periods=1).min()
-    high_max = df_calc['high'].rolling(window=n, min_periods=1).max()
+    close = df_calc['close'].to_numpy(dtype=float)
+    low_min = df_calc['low'].rolling(window=n, min_periods=1).min().to_numpy()
+    high_max = df_calc['high'].rolling(window=n, min_periods=1).max().to_numpy()
     
     range_val = high_max - low_min
-    rsv = pd.Series(index=df_calc.index, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = (close - low_min) / range_val * 100
     
     # RSV计算，前n-1个周期不足时用50填充
-    for i in range(len(df_calc)):
-        if i < n - 1 or range_val.iloc[i] == 0:
-            rsv.iloc[i] = 50.0
-        else:
-            rsv.iloc[i] = (df_calc['close'].iloc[i] - low_min.iloc[i]) / range_val.iloc[i] * 100
+    rsv[(np.arange(len(df_calc)) < n - 1) | (range_val == 0)] = 50.0
     
     # SMA计算 - 通达信风格
     # K = SMA(RSV, M1, 1): K = (RSV*1 + K'*(M1-1)) / M1
-    k = pd.Series(index=df_calc.index, dtype=float)
-    d = pd.Series(index=df_calc.index, dtype=float)
-    
     # 初始化第一日K、D值为50
-    k.iloc[0] = 50.0
-    d.iloc[0] = 50.0
-    
-    # 递归计算
-    for i in range(1, len(df_calc)):
-        k.iloc[i] = (rsv.iloc[i] * 1 + k.iloc[i-1] * (m1 - 1)) / m1
-        d.iloc[i] = (k.iloc[i] * 1 + d.iloc[i-1] * (m2 - 1)) / m2
+    k = pd.Series(_sma_recursive(rsv, m1, 1, 50.0), index=df_calc.index)
+    d = pd.Series(_sma_recursive(k.to_numpy(), m2, 1, 50.0), index=df_calc.index)
     
     # 计算J值
     j = 3 * k - 2 * d
@@ -0,0 +1,160 @@
+"""
+批量技术指标计算模块 - 面向全市场二维数组 (时间 × 股票)
+
+与 utils/technical.py 的区别：
+- 输入为二维数组，行按时间正序（最早在前），列为股票，一次调用计算全市场
+- 不需要反转数据
+- 每列只允许存在"前导NaN"（上市前），计算结果与逐只股票调用 technical.py 一致
+
+面板中停牌日也是 NaN，会打断"连续交易日"的语义，需先用 CompactIndex
+把每只股票的有效K线压缩到底部对齐（最新K线都在最后一行），计算完再展开回原位置。
+"""
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+class CompactIndex:
+    """
+    停牌/上市前NaN的压缩索引
+    
+    compact: 把每列有效值按原顺序搬到底部，上方补NaN（只剩前导NaN）
+    expand:  把压缩后的结果放回原始行位置，其余为NaN
+    """
+    
+    def __init__(self, valid):
+        """
+        :param valid: (T, S) 布尔数组，True 表示该股票当日有K线
+        """
+        valid = np.asarray(valid, dtype=bool)
+        self.shape = valid.shape
+        n_rows = valid.shape[0]
+        self.counts = valid.sum(axis=0)
+        
+        # 每个有效值在压缩后的目标行：底部对齐
+        rank = np.cumsum(valid, axis=0) - 1
+        self.rows, self.cols = np.nonzero(valid)
+        self.target_rows = (n_rows - self.counts[self.cols]) + rank[self.rows, self.cols]
+        
+        # 压缩后每个位置对应的原始行号（-1 表示无数据）
+        self.source_rows = np.full(self.shape, -1, dtype=np.int64)
+        self.source_rows[self.target_rows, self.cols] = self.rows
+    
+    @classmethod
+    def from_values(cls, values):
+        """以某个字段（通常是收盘价）的非NaN位置作为有效K线"""
+        return cls(~np.isnan(values))
+    
+    def compact(self, values, fill=np.nan):
+        """压缩为底部对齐、只含前导空值的数组"""
+        values = np.asarray(values)
+        out = np.full(self.shape, fill, dtype=values.dtype if fill is not np.nan else float)
+        out[self.target_rows, self.cols] = values[self.rows, self.cols]
+        return out
+    
+    def expand(self, values, fill=np.nan):
+        """展开回原始行位置"""
+        values = np.asarray(values)
+        out = np.full(self.shape, fill, dtype=values.dtype if fill is not np.nan else float)
+        out[self.rows, self.cols] = values[self.target_rows, self.cols]
+        return out
+    
+    def leading_mask(self):
+        """压缩后数组中前导空位置的掩码"""
+        first_valid = self.shape[0] - self.counts
+        return np.arange(self.shape[0])[:, None] < first_valid[None, :]
+
+
+def _frame(values):
+    return pd.DataFrame(np.asarray(values, dtype=float))
+
+
+def MA(values, n):
+    """简单移动平均（min_periods=1，跳过前导NaN）"""
+    return _frame(values).rolling(window=n, min_periods=1).mean().to_numpy()
+
+
+def EMA(values, n):
+    """指数移动平均（adjust=False，从每列第一个有效值开始递推）"""
+    return _frame(values).ewm(span=n, adjust=False, min_periods=1).mean().to_numpy()
+
+
+def LLV(values, n):
+    """N周期最低值"""
+    return _frame(values).rolling(window=n, min_periods=1).min().to_numpy()
+
+
+def HHV(values, n):
+    """N周期最高值"""
+    return _frame(values).rolling(window=n, min_periods=1).max().to_numpy()
+
+
+def REF(values, n):
+    """向前引用N周期（时间正序下即向下平移n行）"""
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    if n < values.shape[0]:
+        out[n:] = values[:values.shape[0] - n]
+    return out
+
+
+def EXIST(cond, n):
+    """N周期内是否存在满足COND的情况"""
+    cond = np.asarray(cond, dtype=float)
+    return _frame(cond).rolling(window=n, min_periods=1).max().to_numpy() > 0
+
+
+def KDJ(high, low, close, n=9, m1=3, m2=3):
+    """
+    KDJ指标（通达信算法），逐列与 technical.KDJ 结果一致
+    每列从第一个有效值起：前n-1个周期RSV取50，首日K=D=50
+    :return: (K, D, J) 三个 (T, S) 数组，前导位置为NaN
+    """
+    close = np.asarray(close, dtype=float)
+    n_rows = close.shape[0]
+    if n_rows == 0:
+        empty = np.empty(close.shape)
+        return empty, empty, empty
+    
+    leading = np.isnan(close)
+    first_valid = np.where(leading.all(axis=0), n_rows, leading.argmin(axis=0))
+    rel = np.arange(n_rows)[:, None] - first_valid[None, :]
+    
+    low_min = LLV(low, n)
+    high_max = HHV(high, n)
+    range_val = high_max - low_min
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = (close - low_min) / range_val * 100
+    
+    # 首日及之前统一取50：递推从第0行的K=D=50开始，首日K仍为50，与逐只计算一致
+    rsv[(rel < n - 1) | (range_val == 0) | (rel <= 0)] = 50.0
+    
+    k = _sma_columns(rsv, m1, 1, 50.0)
+    d = _sma_columns(k, m2, 1, 50.0)
+    j = 3 * k - 2 * d
+    
+    k[leading] = np.nan
+    d[leading] = np.nan
+    j[leading] = np.nan
+    return k, d, j
+
+
+def _sma_columns(values, n, m, init):
+    """逐列通达信SMA递推：Y[0]=init, Y[i]=(X[i]*M + Y[i-1]*(N-M))/N"""
+    result = np.empty(values.shape, dtype=float)
+    result[0] = init
+    if values.shape[0] > 1:
+        decay = (n - m) / n
+        zi = np.full((1, values.shape[1]), decay * init)
+        result[1:], _ = lfilter([m / n], [1.0, -decay], values[1:], axis=0, zi=zi)
+    return result
+
+
+def calculate_zhixing_trend(close, m1=14, m2=28, m3=57, m4=114):
+    """
+    知行趋势线（全市场批量版）
+    :return: (short_term_trend, bull_bear_line)
+    """
+    short_term_trend = EMA(EMA(close, 10), 10)
+    bull_bear_line = (MA(close, m1) + MA(close, m2) + MA(close, m3) + MA(close, m4)) / 4
+    return short_term_trend, bull_bear_line
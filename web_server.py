@@ -12,7 +12,7 @@ import pandas as pd
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from utils.csv_manager import CSVManager
+from utils.csv_manager import get_storage_manager
 from strategy.strategy_registry import get_registry
 
 app = Flask(__name__, 
@@ -20,7 +20,7 @@ app = Flask(__name__,
             static_folder='web/static')
 
 # 全局实例
-csv_manager = CSVManager("data")
+csv_manager = get_storage_manager("data")
 registry = get_registry("config/strategy_params.yaml")
 
 # 加载策略
@@ -54,18 +54,18 @@ def get_stocks():
         end_idx = start_idx + per_page
         paginated_stocks = stocks[start_idx:end_idx]
         
+        # 基本信息直接取自股票清单，不打开数据文件
         stock_list = []
         for code in paginated_stocks:
-            df = csv_manager.read_stock(code)
-            if not df.empty:
-                latest = df.iloc[0]
+            entry = csv_manager.manifest.get(code)
+            if entry:
                 stock_list.append({
                     'code': code,
                     'name': stock_names.get(code, '未知'),
-                    'latest_price': round(latest['close'], 2),
-                    'latest_date': latest['date'].strftime('%Y-%m-%d'),
-                    'market_cap': round(latest.get('market_cap', 0) / 1e8, 2),  # 总市值，单位：亿
-                    'data_count': len(df)
+                    'latest_price': round(entry['last_close'], 2),
+                    'latest_date': entry['last_date'],
+                    'market_cap': round((entry['last_market_cap'] or 0) / 1e8, 2),  # 总市值，单位：亿
+                    'data_count': entry['rows']
                 })
         
         return jsonify({
@@ -175,14 +175,8 @@ def get_stats():
     try:
         stocks = csv_manager.list_all_stocks()
         
-        # 计算数据日期范围
-        dates = []
-        for code in stocks[:50]:  # 采样
-            df = csv_manager.read_stock(code)
-            if not df.empty:
-                dates.append(df.iloc[0]['date'])
-        
-        latest_date = max(dates).strftime('%Y-%m-%d') if dates else '-'
+        # 最新数据日期取自股票清单
+        latest_date = csv_manager.manifest.latest_date() or '-'
         
         return jsonify({
             'success': True,